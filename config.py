@@ -1,17 +1,24 @@
 import os
-import git
+
+# Where the yolov7 sources are cloned. They are only needed to load a PyTorch checkpoint;
+# a model package (python -m src.tools.build_model_package) runs without them.
+YOLOV7_URL = "https://github.com/WongKinYiu/yolov7.git"
+YOLOV7_DIR = "src/yolov7"
 
 
 def clone_repo():
     # Check if the repository exists locally. If not, clone it.
-    if not os.path.exists("src/yolov7"):
+    if not os.path.exists(YOLOV7_DIR):
+        # GitPython is only needed for the clone itself
+        import git
+
         try:
-            git.Repo.clone_from(
-                "https://github.com/WongKinYiu/yolov7.git", "src/yolov7"
-            )
+            git.Repo.clone_from(YOLOV7_URL, YOLOV7_DIR)
         except git.GitCommandError as e:
             print(f"Error occurred while cloning the repository: {e}")
             return None
 
 
-clone_repo()
+# Clone only when run as a script, never as a side effect of importing this module
+if __name__ == "__main__":
+    clone_repo()
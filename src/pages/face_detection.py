@@ -9,12 +9,12 @@ import sys
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
-from src.utils.video_helper import create_videotransformer
-from streamlit_webrtc import webrtc_streamer
-from src.utils.model_loader import load_model
-from src.utils.predict import predict
-from src.utils.box_drawer import blur_faces
-import cv2
+# Only light modules are imported here, so the page draws right away
+# torch, the model and the WebRTC stack are imported on first use, once a detection type is chosen
+from src.utils.settings import BACKEND, INFERENCE_SIZES, MODEL_PATH
+from src.utils.face_store import FaceStore
+from src.utils.metrics import METRICS
+from src.utils.result_cache import RESULT_CACHE, model_id
 
 
 def show():
@@ -24,7 +24,11 @@ def show():
         unsafe_allow_html=True,
     )
     st.sidebar.title("Navigation")
-    images = []
+    # Keep the detected faces in a bounded store that lives as long as the session
+    # Faces seen again at the same place replace their previous thumbnail
+    if "face_store" not in st.session_state:
+        st.session_state.face_store = FaceStore(max_faces=64, dedupe_iou=0.5)
+    face_store = st.session_state.face_store
     page = st.sidebar.radio("Go to", ["Detection Page", "Home"])
     st.sidebar.markdown(
         '<hr style="border: 0.9px solid orange">', unsafe_allow_html=True
@@ -43,6 +47,23 @@ def show():
             ["Upload Image", "Real-Time Detection"],
             index=None,
         )
+        # Create a select box in the sidebar to choose the inference size
+        # Smaller sizes are faster, "Full resolution" runs the model on the whole image
+        # (a traced model scales the images larger than its traced shape down to it)
+        # "Tiled" runs it at full resolution on overlapping tiles, to find the small faces of large photos
+        inference_size = st.sidebar.selectbox(
+            "Inference size",
+            list(INFERENCE_SIZES) + ["Full resolution", "Tiled (uploads only)"],
+            index=INFERENCE_SIZES.index(640),
+        )
+        tiled = inference_size == "Tiled (uploads only)"
+        # The video frames are small enough for the whole-image mode
+        img_size = inference_size if isinstance(inference_size, int) else None
+        # Create a checkbox in the sidebar to record the duration of every stage of the detection
+        # Nothing is recorded while it is unchecked
+        METRICS.enabled = st.sidebar.checkbox(
+            "Performance metrics", value=METRICS.enabled
+        )
         # Create an expandable section in the sidebar
         features_expander = st.sidebar.expander("Features")
         # create a multi-select box for the user to select the features to apply ,Within the "Features" section
@@ -92,6 +113,9 @@ def show():
                     # Open the image with PIL and convert it to a numpy array
                     background_image = np.array(Image.open(file))
 
+                    # OpenCV is imported only once an image is uploaded
+                    import cv2
+
                     # Convert the image from RGB to BGR (since OpenCV uses BGR)
                     background_image = cv2.cvtColor(background_image, cv2.COLOR_RGB2BGR)
 
@@ -116,6 +140,9 @@ def show():
                 # Open the image with PIL and convert it to a numpy array
                 image_replacement = np.array(Image.open(file))
 
+                # OpenCV is imported only once an image is uploaded
+                import cv2
+
                 # Convert the image from RGB to BGR (since OpenCV uses BGR)
                 image_replacement = cv2.cvtColor(image_replacement, cv2.COLOR_RGB2BGR)
 
@@ -140,15 +167,20 @@ def show():
                             </div>
                             """
                     components.html(choice_container, height=320)
-                # Load the model and related methods
-                # The loaded items include the model, names, scale_coords, non_max_suppression, and plot_one_box
-                (
-                    model,
-                    names,
-                    scale_coords,
-                    non_max_suppression,
-                    plot_one_box,
-                ) = load_model("src/models/model.pt")
+                else:
+                    # Import the model loader, and torch with it, only once a detection type is chosen
+                    from src.utils.model_loader import get_model
+
+                    # Get the model and related methods from the process-wide registry
+                    # The model is loaded, fused and warmed up only once, then shared by every rerun and VideoTransformer
+                    # The items include the model, names, scale_coords, non_max_suppression, and plot_one_box
+                    (
+                        model,
+                        names,
+                        scale_coords,
+                        non_max_suppression,
+                        plot_one_box,
+                    ) = get_model(MODEL_PATH)
                 # if the detection type is "Upload Image"
                 if detection_type == "Upload Image":
                     # Display a file uploader in the sidebar for the user to upload an image
@@ -199,14 +231,19 @@ def show():
                         # If the button is pressed, write a message saying "predict button is pressed"
                         st.write("predict button is pressed")
                         st.write(background_image)
+                        # Only show the faces of this prediction in the gallery
+                        face_store.clear()
                         # Call the predict function with the necessary parameters
-                        # The parameters include the image array, the model, the names, the images, the scale_coords, the non_max_suppression, the plot_one_box, the strategies, the background_image, the face_color, and the image_replacement
+                        # The parameters include the image array, the model, the names, the face_store, the scale_coords, the non_max_suppression, the plot_one_box, the strategies, the background_image, the face_color, the image_replacement, and the img_size
+                        # The detections are cached, so predicting the same image again with other features only renders it
                         # The function returns three values: v, bx, and image_with_boxes
+                        from src.utils.predict import predict
+
                         v, bx, image_with_boxes = predict(
                             img_array,
                             model,
                             names,
-                            images,
+                            face_store,
                             scale_coords,
                             non_max_suppression,
                             plot_one_box,
@@ -214,10 +251,14 @@ def show():
                             background_image,
                             face_color,
                             image_replacement,
+                            img_size,
+                            cache=RESULT_CACHE,
+                            model_key=model_id(MODEL_PATH, BACKEND),
+                            tiled=tiled,
                         )
                         # if len(images) > 0:
                         #     images.append(image_with_boxes)
-                        st.write(len(images))
+                        st.write(face_store.total)
                         # st.write(type(bx))
                         # st.write(bx)
                         # st.image(image_with_boxes)
@@ -225,22 +266,61 @@ def show():
                 if detection_type == "Real-Time Detection":
                     # If "Real-Time Detection" is selected, write a message in the sidebar saying "Real-Time Detection is selected"
                     st.sidebar.write("Real-Time Detection is selected")
+                    # Create a select box in the sidebar to choose where the detection runs
+                    # Off the callback thread, the video keeps its frame rate and shows the latest known boxes, however slow the model is
+                    # "Shared scheduler" batches the detections of every stream of the process on a few model replicas, for many concurrent streams
+                    # "Background thread" gives the stream a detection thread of its own, without waiting behind the other streams
+                    processing = st.sidebar.selectbox(
+                        "Processing",
+                        ["Shared scheduler", "Background thread", "Synchronous"],
+                    )
+                    async_processing = processing != "Synchronous"
+                    # Create a slider in the sidebar to choose how often the detector runs
+                    # The boxes are tracked with optical flow on the frames in between
+                    detect_interval = st.sidebar.slider(
+                        "Detect every N frames", min_value=1, max_value=10, value=3
+                    )
+                    # Create a slider in the sidebar to choose the frame rate to hold, 0 to keep the settings fixed
+                    # The inference size, detect interval and blur quality then adapt to the machine's load,
+                    # never above the chosen inference size nor below the chosen detect interval
+                    target_fps = st.sidebar.slider(
+                        "Adaptive quality target FPS (0 = off)",
+                        min_value=0,
+                        max_value=30,
+                        value=0,
+                    )
                     # Set the header of the main page to "Real Time Detection"
                     st.header("Real Time Detection")
+                    # Import the WebRTC stack only when the real-time detection is used
+                    from streamlit_webrtc import webrtc_streamer
+                    from src.utils.scheduler import get_scheduler
+                    from src.utils.video_helper import create_videotransformer
+
                     # Start a WebRTC streamer with the key "example"
                     # The video_transformer_factory is set to the result of the create_videotransformer function
-                    # The create_videotransformer function is called with the necessary parameters, including the model, the names, the images, the scale_coords, the non_max_suppression, the plot_one_box, the strategies, and the background_image
+                    # The create_videotransformer function is called with the necessary parameters, including the model, the names, the face_store, the scale_coords, the non_max_suppression, the plot_one_box, the strategies, the background_image, the img_size, async_processing, and detect_interval
                     webrtc_streamer(
                         key="example",
                         video_transformer_factory=create_videotransformer(
                             model,
                             names,
-                            images,
+                            face_store,
                             scale_coords,
                             non_max_suppression,
                             plot_one_box,
                             strategies,
                             background_image,
+                            img_size,
+                            async_processing,
+                            detect_interval,
+                            # The scheduled streams share the process-wide scheduler, which
+                            # batches their detections on a fixed number of model replicas
+                            scheduler=(
+                                get_scheduler(MODEL_PATH, BACKEND)
+                                if processing == "Shared scheduler"
+                                else None
+                            ),
+                            target_fps=target_fps or None,
                         ),
                     )
 
@@ -248,7 +328,7 @@ def show():
                 # Set the title of the column to "Detected Face"
                 st.title("Detected Face")
                 # Set a subheader with the number of detected faces
-                st.subheader("Number of detected faces : " + str(len(images)))
+                st.subheader("Number of detected faces : " + str(face_store.total))
                 with st.container(border=True):
                     # Set the background color of the markdown element to light gray
                     st.markdown(
@@ -267,6 +347,9 @@ def show():
                     #     accept_multiple_files=True,
                     #   )
 
+                    # Get the thumbnails of the latest detected faces from the store
+                    images = face_store.snapshot()
+
                     # Calculate the number of images per row
                     images_per_row = int(np.ceil(np.sqrt(len(images))))
 
@@ -291,5 +374,20 @@ def show():
                                     # Display the image in the column
                                     cols[j].image(images[idx], use_column_width=True)
 
+        # Show the recent durations of the stages and the counters of the session
+        if METRICS.enabled:
+            with st.expander("Performance metrics", expanded=True):
+                # Any interaction reruns the page, the button only forces a refresh
+                st.button("Refresh")
+                snapshot = METRICS.snapshot()
+                st.dataframe(
+                    [
+                        {"stage": name, **values}
+                        for name, values in snapshot["stages"].items()
+                    ],
+                    use_container_width=True,
+                )
+                st.write(snapshot["counters"])
+
 
 show()
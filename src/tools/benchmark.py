@@ -0,0 +1,311 @@
+"""
+Benchmarks the detection and rendering hot paths and reports the results as JSON.
+
+It measures the stages of process_image (preprocessing, forward pass, non-maximum
+suppression, box rescaling), each strategy of box_drawer at several frame sizes and face
+counts, and the end-to-end frame rate of predict and VideoTransformer.transform on
+synthetic frames. When the checkpoint is missing, a randomly initialized yolov7 model of
+the same configuration stands in, so the numbers stay comparable across runs. Save the
+JSON of two runs and compare them to spot a regression.
+
+Usage (from the repository root):
+    python -m src.tools.benchmark --output benchmark.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+import av
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from src.tools.inference_latency import parse_size, time_call
+from src.utils.box_drawer import (
+    StrategyCompositor,
+    apply_strategies,
+    select_detections,
+)
+from src.utils.image_processor import InputBuffer, letterbox, suppress
+from src.utils.model_loader import (
+    MODEL_PATH,
+    RANDOM_MODEL_CFG,
+    load_model,
+    prepare_for_inference,
+    random_model,
+    warmup_model,
+)
+from src.utils.predict import predict
+from src.utils.video_helper import VideoTransformer
+
+STRATEGIES = [
+    "blur faces",
+    "Change Background",
+    "change face color",
+    "replace faces",
+    "highlight edges",
+    "pixelate faces",
+]
+
+
+def synthetic_frame(height: int, width: int, seed: int = 0) -> np.ndarray:
+    """
+    Returns a smooth random BGR frame, closer to a camera frame than uniform noise.
+    """
+
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+    return np.ascontiguousarray(
+        np.repeat(np.repeat(small, 8, 0), 8, 1)[:height, :width]
+    )
+
+
+def synthetic_boxes(height: int, width: int, count: int) -> np.ndarray:
+    """
+    Returns count face boxes laid out on a grid over the frame, as an (N, 6) array.
+    """
+
+    side = int(np.ceil(np.sqrt(count)))
+    cell_h, cell_w = height / side, width / side
+    boxes = []
+    for index in range(count):
+        row, col = divmod(index, side)
+        y1, x1 = row * cell_h + cell_h * 0.1, col * cell_w + cell_w * 0.1
+        boxes.append((x1, y1, x1 + cell_w * 0.8, y1 + cell_h * 0.8, 0.9, 0))
+    return np.round(np.array(boxes, dtype=np.float32))
+
+
+def bench_process_image(
+    model: Any, non_max_suppression, scale_coords, sizes, img_size: int, runs: int
+) -> List[Dict[str, Any]]:
+    """
+    Times the stages of process_image separately, on synthetic frames.
+    """
+
+    stride = int(model.stride.max())
+    channels_last = getattr(model, "channels_last", False)
+    buffer = InputBuffer()
+    results = []
+    for height, width in sizes:
+        image = synthetic_frame(height, width)
+
+        def preprocess():
+            return buffer.fill(letterbox(image, img_size, stride)[0], channels_last)
+
+        img = preprocess()
+        with torch.inference_mode():
+            raw = model(img)[0]
+            pred = suppress(raw, non_max_suppression)
+
+        def forward():
+            with torch.inference_mode():
+                return model(img)[0]
+
+        def nms():
+            with torch.inference_mode():
+                return suppress(raw, non_max_suppression)
+
+        def rescale():
+            with torch.inference_mode():
+                return select_detections(
+                    [det.clone() for det in pred], img, image.shape, scale_coords
+                )
+
+        results.append(
+            {
+                "size": f"{height}x{width}",
+                "img_size": img_size,
+                "detections": int(sum(len(det) for det in pred)),
+                "preprocess": time_call(preprocess, runs),
+                "forward": time_call(forward, runs),
+                "nms": time_call(nms, runs),
+                "rescale": time_call(rescale, runs),
+            }
+        )
+    return results
+
+
+def bench_strategies(sizes, face_counts, runs: int) -> List[Dict[str, Any]]:
+    """
+    Times each strategy, and all of them through StrategyCompositor, per frame size and face count.
+
+    Every call starts by copying the frame into a work buffer, so the strategies that work
+    in place do not degrade the frame from one run to the next. That copy is timed alone
+    under "copy".
+    """
+
+    background = synthetic_frame(720, 1280, seed=1)
+    replacement = synthetic_frame(256, 256, seed=2)
+    results = []
+    for height, width in sizes:
+        frame = synthetic_frame(height, width)
+        work = np.empty_like(frame)
+        for count in face_counts:
+            boxes = synthetic_boxes(height, width, count)
+            row: Dict[str, Any] = {"size": f"{height}x{width}", "faces": count}
+            row["copy"] = time_call(lambda: np.copyto(work, frame), runs)
+            for strategy in STRATEGIES:
+                for name, back in (("color", "#123456"), ("image", background)):
+                    if strategy != "Change Background" and name == "image":
+                        continue
+                    key = (
+                        f"{strategy} ({name})"
+                        if strategy == "Change Background"
+                        else strategy
+                    )
+
+                    def run(strategy=strategy, back=back):
+                        np.copyto(work, frame)
+                        apply_strategies(
+                            work, boxes, [strategy], back, "#abcdef", replacement
+                        )
+
+                    row[key] = time_call(run, runs)
+            compositor = StrategyCompositor(
+                STRATEGIES, "#123456", "#abcdef", replacement
+            )
+
+            def composite():
+                np.copyto(work, frame)
+                compositor.render(work, boxes)
+
+            row["compositor (all)"] = time_call(composite, runs)
+            results.append(row)
+    return results
+
+
+def bench_end_to_end(
+    loaded: Tuple, sizes, img_size: int, frames: int
+) -> List[Dict[str, Any]]:
+    """
+    Measures the frame rate of predict and VideoTransformer.transform on synthetic frames.
+    """
+
+    model, names, scale_coords, non_max_suppression, plot_one_box = loaded
+    results = []
+    for height, width in sizes:
+        # Shift the frame a little every time, like a slowly moving camera
+        base = synthetic_frame(height, width)
+        images = [np.roll(base, 4 * index, axis=1) for index in range(frames)]
+
+        def predict_all():
+            for image in images:
+                predict(
+                    image,
+                    model,
+                    names,
+                    [],
+                    scale_coords,
+                    non_max_suppression,
+                    plot_one_box,
+                    ["blur faces"],
+                    "#56ecd5",
+                    img_size=img_size,
+                )
+
+        row: Dict[str, Any] = {"size": f"{height}x{width}", "img_size": img_size}
+        row["predict_fps"] = frames / _elapsed(predict_all)
+
+        video_frames = [
+            av.VideoFrame.from_ndarray(image, format="bgr24") for image in images
+        ]
+        for interval in (1, 3):
+            transformer = VideoTransformer(
+                model,
+                names,
+                [],
+                scale_coords,
+                non_max_suppression,
+                plot_one_box,
+                ["blur faces"],
+                img_size=img_size,
+                detect_interval=interval,
+            )
+
+            def transform_all():
+                for frame in video_frames:
+                    transformer.transform(frame)
+
+            row[f"transform_fps (detect every {interval})"] = frames / _elapsed(
+                transform_all
+            )
+        results.append(row)
+    return results
+
+
+def _elapsed(fn) -> float:
+    """
+    Returns the wall time of a call in seconds, after a warm-up call.
+    """
+
+    fn()
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument(
+        "--cfg",
+        default=RANDOM_MODEL_CFG,
+        help="yolov7 configuration of the random model used when --model is missing",
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", default=["480x640", "720x1280", "1080x1920"]
+    )
+    parser.add_argument("--faces", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--img-size", type=int, default=640)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    if os.path.exists(args.model):
+        loaded = load_model(args.model)
+        source = args.model
+    else:
+        loaded = random_model(args.cfg)
+        source = f"random ({args.cfg})"
+    # The ONNX and traced models are already prepared when they are exported
+    if isinstance(loaded[0], torch.nn.Module):
+        prepare_for_inference(loaded[0])
+    warmup_model(loaded[0])
+    model, _, scale_coords, non_max_suppression, _ = loaded
+
+    sizes = [parse_size(size) for size in args.sizes]
+    report = {
+        "environment": {
+            "model": source,
+            "torch": torch.__version__,
+            "threads": torch.get_num_threads(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "process_image": bench_process_image(
+            model, non_max_suppression, scale_coords, sizes, args.img_size, args.runs
+        ),
+        "strategies": bench_strategies(sizes, args.faces, args.runs),
+        "end_to_end": bench_end_to_end(loaded, sizes, args.img_size, args.frames),
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Builds a self-contained model package that loads without the checkpoint or the yolov7 sources.
+
+Run it once where the yolov7 sources are available (python config.py clones them), then
+ship the package directory to machines without network access and point FACE_SIGHT_MODEL
+at it. The package holds the exported model and a meta.json file with its class names,
+strides and input shape.
+
+Usage (from the repository root):
+    python -m src.tools.build_model_package --model src/models/model.pt --output src/models/package
+    FACE_SIGHT_MODEL=src/models/package streamlit run src/app.py
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from src.utils.model_loader import (
+    PACKAGE_FORMATS,
+    TRACE_SIZE,
+    build_model_package,
+    load_model_package,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", default="src/models/model.pt")
+    parser.add_argument("--output", default="src/models/package")
+    parser.add_argument(
+        "--format",
+        choices=sorted(PACKAGE_FORMATS),
+        default="torchscript",
+        help="torchscript runs at inference sizes up to --img-size, onnx at any size",
+    )
+    parser.add_argument("--img-size", type=int, default=TRACE_SIZE)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    build_model_package(args.model, args.output, args.format, args.img_size)
+    print(f"Built {args.output} in {time.perf_counter() - start:.2f}s")
+
+    # Check that the package loads on its own
+    start = time.perf_counter()
+    model = load_model_package(args.output)
+    print(f"Loaded it in {time.perf_counter() - start:.2f}s, classes: {model.names}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Builds the traced TorchScript artifacts of a checkpoint ahead of time.
+
+Run it in the image build so that pods started with FACE_SIGHT_BACKEND=torchscript load
+the cached artifact instead of unpickling the checkpoint. Artifacts that are already up to
+date are left untouched.
+
+Usage (from the repository root):
+    python -m src.tools.build_traced_model --model src/models/model.pt --sizes 640
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from src.utils.model_loader import ARTIFACT_DIR, TRACE_SIZE, load_traced_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", default="src/models/model.pt")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[TRACE_SIZE])
+    parser.add_argument("--artifact-dir", default=ARTIFACT_DIR)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        start = time.perf_counter()
+        load_traced_model(args.model, size, args.artifact_dir)
+        print(f"{size}x{size}: ready in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
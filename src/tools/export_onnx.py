@@ -0,0 +1,54 @@
+"""
+Exports a PyTorch checkpoint to ONNX and checks that both backends find the same boxes.
+
+Usage (from the repository root):
+    python -m src.tools.export_onnx --model src/models/model.pt --output src/models/model.onnx --images static/images
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from src.utils.image_processor import read_images
+from src.utils.model_loader import compare_backends, export_onnx, load_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", default="src/models/model.pt")
+    parser.add_argument("--output", default="src/models/model.onnx")
+    parser.add_argument("--img-size", type=int, default=640)
+    parser.add_argument("--opset", type=int, default=13)
+    parser.add_argument(
+        "--images",
+        help="Folder of images for the parity check (random images if omitted)",
+    )
+    args = parser.parse_args()
+
+    export_onnx(args.model, args.output, args.img_size, args.opset)
+    print(f"Exported {args.model} to {args.output}")
+
+    if args.images:
+        images = read_images(args.images)
+    else:
+        rng = np.random.default_rng(0)
+        images = [
+            rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+            for height, width in ((480, 640), (720, 1280), (640, 480))
+        ]
+
+    torch_model, _, _, non_max_suppression, _ = load_model(args.model, "torch")
+    onnx_model = load_model(args.output, "onnx")[0]
+    report = compare_backends(
+        torch_model, onnx_model, images, non_max_suppression, args.img_size
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Reports the CPU latency of process_image before and after the inference fast path.
+
+The baseline runs the model the way process_image used to: autograd enabled and a
+contiguous NCHW input. The fast path is the model prepared by prepare_for_inference
+(evaluation mode, no gradients, channels_last) run through process_image under
+torch.inference_mode.
+
+Usage (from the repository root):
+    python -m src.tools.inference_latency --model src/models/model.pt --sizes 320x320 480x640 720x1280
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import cv2
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from src.utils.model_loader import load_model, prepare_for_inference
+from src.utils.image_processor import process_image
+
+
+def parse_size(size: str) -> Tuple[int, int]:
+    """
+    Parses an input size given as HEIGHTxWIDTH (or a single number for a square input).
+    """
+
+    height, _, width = size.lower().partition("x")
+    return int(height), int(width or height)
+
+
+def time_call(fn: Callable[[], object], runs: int, warmup: int = 2) -> Dict[str, float]:
+    """
+    Times a call and returns its median, mean and worst latency in milliseconds.
+    """
+
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": float(np.median(timings)),
+        "mean_ms": float(np.mean(timings)),
+        "max_ms": float(np.max(timings)),
+    }
+
+
+def baseline_forward(
+    image: np.ndarray, model, non_max_suppression
+) -> List[torch.Tensor]:
+    """
+    Runs the model as process_image did before the fast path: autograd on, NCHW input.
+    """
+
+    stride = int(model.stride.max())
+    height, width = image.shape[:2]
+    image = cv2.resize(image, (width - width % stride, height - height % stride))
+    img = torch.from_numpy(np.ascontiguousarray(image.transpose((2, 0, 1))))
+    img = img.float().div(255.0).unsqueeze(0)
+    return non_max_suppression(model(img)[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", default="src/models/model.pt")
+    parser.add_argument(
+        "--sizes", nargs="+", default=["320x320", "480x640", "720x1280"]
+    )
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    baseline_model, _, _, non_max_suppression, _ = load_model(args.model)
+    fast_model = prepare_for_inference(copy.deepcopy(baseline_model), args.threads)
+
+    rng = np.random.default_rng(0)
+    report = []
+    for size in args.sizes:
+        height, width = parse_size(size)
+        image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+        before = time_call(
+            lambda: baseline_forward(image, baseline_model, non_max_suppression),
+            args.runs,
+        )
+        after = time_call(
+            lambda: process_image(image, fast_model, non_max_suppression), args.runs
+        )
+        report.append(
+            {
+                "size": f"{height}x{width}",
+                "before": before,
+                "after": after,
+                "speedup": before["median_ms"] / after["median_ms"],
+            }
+        )
+
+    print(f"torch {torch.__version__}, {torch.get_num_threads()} threads")
+    print(f"{'size':>10} {'before (ms)':>12} {'after (ms)':>11} {'speedup':>8}")
+    for row in report:
+        print(
+            f"{row['size']:>10} {row['before']['median_ms']:>12.1f} "
+            f"{row['after']['median_ms']:>11.1f} {row['speedup']:>7.2f}x"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Detects and anonymizes the faces of every image of a directory with a pool of worker processes.
+
+The rendered images are written to the output directory under the same relative paths, and
+the boxes of every image are appended to a JSON lines file. Running the same command again
+after an interruption skips the images already recorded.
+
+Usage (from the repository root):
+    python -m src.tools.process_directory photos/ anonymized/ --strategies "blur faces" --workers 4
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from src.utils.directory_processor import process_directory
+from src.utils.settings import MODEL_PATH
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--strategies", nargs="*", default=["blur faces"])
+    parser.add_argument("--background", default="#56ecd5")
+    parser.add_argument("--background-image", help="Image to use as the background")
+    parser.add_argument("--color", default="#56ecd5")
+    parser.add_argument("--replacement", help="Image to replace the faces with")
+    parser.add_argument(
+        "--img-size", type=int, default=640, help="0 runs on the whole images"
+    )
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--threads-per-worker", type=int)
+    parser.add_argument("--chunk-size", type=int, default=32)
+    parser.add_argument(
+        "--records",
+        help="JSON lines file of the boxes (detections.jsonl in the output directory if omitted)",
+    )
+    args = parser.parse_args()
+
+    stats = process_directory(
+        args.input_dir,
+        args.output_dir,
+        args.model,
+        args.strategies,
+        args.background,
+        args.color,
+        args.background_image,
+        args.replacement,
+        args.img_size or None,
+        args.workers,
+        args.threads_per_worker,
+        args.chunk_size,
+        args.records,
+    )
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
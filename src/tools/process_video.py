@@ -0,0 +1,76 @@
+"""
+Anonymizes a recorded video file: detects the faces of every frame, applies the strategies and writes the processed video.
+
+The detections of every frame are written as JSON lines next to the output video, and the
+throughput is reported at the end.
+
+Usage (from the repository root):
+    python -m src.tools.process_video input.mp4 output.mp4 --strategies "blur faces"
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import cv2
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from src.utils.model_loader import get_model
+from src.utils.settings import MODEL_PATH
+from src.utils.video_file import process_video_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument(
+        "--detections",
+        help="JSON lines file of the detections (the output path with .jsonl if omitted)",
+    )
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--strategies", nargs="*", default=["blur faces"])
+    parser.add_argument("--background", default="#56ecd5")
+    parser.add_argument("--background-image", help="Image to use as the background")
+    parser.add_argument("--color", default="#56ecd5")
+    parser.add_argument("--replacement", help="Image to replace the faces with")
+    parser.add_argument("--img-size", type=int, default=640)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--fourcc", default="mp4v")
+    args = parser.parse_args()
+
+    background = (
+        cv2.imread(args.background_image) if args.background_image else args.background
+    )
+    replacement = cv2.imread(args.replacement) if args.replacement else None
+    detections_path = args.detections or os.path.splitext(args.output)[0] + ".jsonl"
+
+    model, names, scale_coords, non_max_suppression, plot_one_box = get_model(
+        args.model
+    )
+    stats = process_video_file(
+        args.input,
+        args.output,
+        detections_path,
+        model,
+        names,
+        scale_coords,
+        non_max_suppression,
+        plot_one_box,
+        args.strategies,
+        background,
+        args.color,
+        replacement,
+        args.img_size,
+        args.batch_size,
+        args.queue_size,
+        args.fourcc,
+    )
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Quantizes the model to INT8 and reports its latency, size and box agreement against fp32.
+
+The fp32 model can be a PyTorch checkpoint, which is exported to ONNX next to it first.
+
+Usage (from the repository root):
+    python -m src.tools.quantize_model --model src/models/model.pt --calibration static/images --output src/models/model.int8.onnx
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from src.tools.inference_latency import time_call
+from src.utils.image_processor import process_image, read_images
+from src.utils.model_loader import compare_backends, export_onnx, load_model
+from src.utils.quantization import QUANTIZATION_MODES, quantize_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", default="src/models/model.pt")
+    parser.add_argument("--output", default="src/models/model.int8.onnx")
+    parser.add_argument("--mode", choices=QUANTIZATION_MODES, default="static")
+    parser.add_argument("--calibration", help="Folder of calibration images")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument(
+        "--images",
+        help="Folder of evaluation images (the calibration folder if omitted)",
+    )
+    parser.add_argument("--img-size", type=int, default=640)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+    # Check the folders before anything is exported or quantized
+    if args.mode == "static" and not args.calibration:
+        parser.error("--mode static needs --calibration")
+    if not (args.images or args.calibration):
+        parser.error("--images or --calibration is needed to evaluate the model")
+
+    fp32_path = args.model
+    if not fp32_path.endswith(".onnx"):
+        fp32_path = os.path.splitext(args.model)[0] + ".onnx"
+        export_onnx(args.model, fp32_path, args.img_size)
+
+    calibration_images = (
+        read_images(args.calibration, args.limit) if args.calibration else None
+    )
+    quantize_model(fp32_path, args.output, args.mode, calibration_images, args.img_size)
+
+    images = read_images(args.images or args.calibration, args.limit)
+    if not images:
+        parser.error("No evaluation images found")
+    fp32_model, _, _, non_max_suppression, _ = load_model(fp32_path)
+    int8_model = load_model(args.output)[0]
+
+    report = {}
+    for name, path, model in (
+        ("fp32", fp32_path, fp32_model),
+        ("int8", args.output, int8_model),
+    ):
+        timings = [
+            time_call(
+                lambda: process_image(image, model, non_max_suppression, args.img_size),
+                args.runs,
+            )["median_ms"]
+            for image in images
+        ]
+        report[name] = {
+            "size_mb": os.path.getsize(path) / 2**20,
+            "median_latency_ms": sorted(timings)[len(timings) // 2],
+        }
+    report["speedup"] = (
+        report["fp32"]["median_latency_ms"] / report["int8"]["median_latency_ms"]
+    )
+    report["agreement"] = compare_backends(
+        fp32_model,
+        int8_model,
+        images,
+        non_max_suppression,
+        args.img_size,
+        iou_threshold=0.5,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
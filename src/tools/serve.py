@@ -0,0 +1,67 @@
+"""
+Serves face detection over HTTP, batching the concurrent requests into shared forward passes.
+
+Endpoints:
+    POST /detect   image body (JPEG or PNG) -> JSON boxes
+    POST /render   image body -> the image with the strategies applied
+                   (?strategy=blur%20faces&strategy=...&background=%23...&color=%23...&format=jpg)
+    GET  /health   micro-batcher state
+
+Usage (from the repository root):
+    python -m src.tools.serve --port 8080
+    curl --data-binary @face.jpg http://localhost:8080/detect
+"""
+
+import argparse
+import os
+import sys
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from src.utils.model_loader import get_model
+from src.utils.settings import MODEL_PATH
+from src.utils.service import create_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--img-size", type=int, default=640)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument(
+        "--max-delay-ms",
+        type=float,
+        default=5.0,
+        help="Longest wait for other requests to share a batch",
+    )
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=64,
+        help="Queued requests beyond which new ones get 503",
+    )
+    args = parser.parse_args()
+
+    model, names, scale_coords, non_max_suppression, plot_one_box = get_model(
+        args.model
+    )
+    app = create_app(
+        model,
+        names,
+        scale_coords,
+        non_max_suppression,
+        plot_one_box,
+        args.img_size,
+        args.max_batch,
+        args.max_delay_ms / 1000,
+        args.max_pending,
+    )
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
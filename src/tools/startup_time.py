@@ -0,0 +1,136 @@
+"""
+Measures the cold start of the app: the import time of its modules and the time to load the model.
+
+Every module is imported in a fresh interpreter with python -X importtime, so nothing is
+shared between the measurements. The report gives the cumulative import time of each
+module and the heaviest packages it pulls in. With --model, it also times loading the
+model, warming it up and running the first detection, in another fresh interpreter.
+
+Usage (from the repository root):
+    python -m src.tools.startup_time --output startup.json
+    python -m src.tools.startup_time --model src/models/package
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+
+# Modules measured by default: the pages as Streamlit imports them, then the inference stack
+MODULES = (
+    "src.pages.face_detection",
+    "src.utils.model_loader",
+    "src.utils.predict",
+    "src.utils.video_helper",
+)
+
+# Loads the model in a fresh interpreter and prints the durations of the steps as JSON
+LOAD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import numpy as np
+from src.utils.model_loader import get_model
+from src.utils.predict import predict
+imported = time.perf_counter()
+model, names, scale_coords, nms, plot_one_box = get_model(sys.argv[1])
+loaded = time.perf_counter()
+image = np.zeros((480, 640, 3), np.uint8)
+predict(image, model, names, [], scale_coords, nms, plot_one_box, [], "", img_size=640)
+detected = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - start,
+    "load_and_warmup_s": loaded - imported,
+    "first_detection_s": detected - loaded,
+    "total_s": detected - start,
+}))
+"""
+
+
+def import_times(module: str, top: int = 10) -> Dict[str, Any]:
+    """
+    Imports a module in a fresh interpreter and returns its import times.
+
+    Parameters:
+    - module: The dotted name of the module.
+    - top: The number of heaviest top-level packages to report.
+
+    Returns:
+    - A dictionary with the cumulative import time of the module in seconds, and the
+      cumulative time of its heaviest top-level packages.
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1]}
+
+    # Lines look like "import time:      self [us] |  cumulative | imported package",
+    # the package indented by its import depth
+    cumulative: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, total, name = line[len("import time:") :].split("|")
+        cumulative[name.strip()] = int(total)
+
+    # The cost of a package is the cumulative time of its root, wherever it was first imported
+    own_root = module.split(".")[0]
+    packages = {
+        name: total
+        for name, total in cumulative.items()
+        if "." not in name and name != own_root
+    }
+    heaviest = sorted(packages.items(), key=lambda item: -item[1])
+    return {
+        "seconds": cumulative.get(module, 0) / 1e6,
+        "heaviest": {name: micros / 1e6 for name, micros in heaviest[:top]},
+    }
+
+
+def model_times(model_path: str) -> Dict[str, Any]:
+    """
+    Loads the model in a fresh interpreter and returns the durations of the steps.
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-c", LOAD_SCRIPT, model_path],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--modules", nargs="+", default=list(MODULES))
+    parser.add_argument("--model", help="Also time loading this model or package")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report: Dict[str, Any] = {
+        "python": sys.version.split()[0],
+        "imports": {module: import_times(module) for module in args.modules},
+    }
+    if args.model:
+        report["model"] = model_times(args.model)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+from typing import List, Optional, Sequence, Tuple
+
+from .metrics import METRICS
+
+# Quality levels of the real-time mode, from the best to the cheapest, as
+# (inference size, detect interval, blur max side) tuples
+QUALITY_LEVELS = (
+    (640, 1, 64),
+    (512, 1, 64),
+    (416, 2, 48),
+    (320, 2, 32),
+    (320, 3, 24),
+    (320, 5, 16),
+)
+
+
+def quality_levels(
+    max_img_size: Optional[int],
+) -> List[Tuple[Optional[int], int, int]]:
+    """
+    Returns the quality levels whose inference size is at most the given one.
+
+    Parameters:
+    - max_img_size: The largest inference size, or None to start from the whole frame.
+
+    Returns:
+    - The (inference size, detect interval, blur max side) levels, the best first.
+    """
+
+    if max_img_size is None:
+        return [(None, 1, 64)] + list(QUALITY_LEVELS)
+    levels = [level for level in QUALITY_LEVELS if level[0] <= max_img_size]
+    # Sizes below the cheapest level still get a level of their own
+    return levels or [(max_img_size, 1, 64)]
+
+
+class AdaptiveController:
+    """
+    A class used to hold a target frame rate by moving through quality levels.
+
+    The controller keeps an exponential moving average of the frame latency. When it
+    stays above the frame budget for patience_down frames in a row, the controller steps
+    down to the next cheaper level, and when it stays well below the budget for
+    patience_up frames, it steps back up. Several things keep it from oscillating between
+    two levels:
+
+    - the thresholds are apart: down above down_margin times the budget, up below
+      up_margin times the budget, so a level that just fits is kept;
+    - stepping up needs a much longer streak than stepping down;
+    - after every change, the average restarts and nothing changes for cooldown frames,
+      while the new level settles, its first frames paying for new buffers;
+    - when a step up is undone right away, the streak needed to step up again doubles,
+      up to max_backoff times patience_up.
+
+    Attributes
+    ----------
+    target_fps : float
+        The frame rate to hold.
+    levels : list
+        The (inference size, detect interval, blur max side) levels, the best first.
+    index : int
+        The index of the current level.
+    latency : float or None
+        The moving average of the frame latency, in seconds.
+    changes : int
+        The number of level changes so far.
+
+    Methods
+    -------
+    observe(seconds)
+        Records the latency of a frame, and returns whether the level changed.
+    level
+        The current (inference size, detect interval, blur max side) level.
+    """
+
+    def __init__(
+        self,
+        target_fps: float = 15.0,
+        levels: Sequence[Tuple[Optional[int], int, int]] = QUALITY_LEVELS,
+        smoothing: float = 0.2,
+        down_margin: float = 1.1,
+        up_margin: float = 0.7,
+        patience_down: int = 5,
+        patience_up: int = 30,
+        cooldown: int = 15,
+        max_backoff: int = 16,
+    ):
+        self.target_fps = target_fps
+        self.levels = list(levels)
+        self.smoothing = smoothing
+        self.down_margin = down_margin
+        self.up_margin = up_margin
+        self.patience_down = patience_down
+        self.patience_up = patience_up
+        self.cooldown = cooldown
+        self.max_backoff = max_backoff
+        self.index = 0
+        self.latency: Optional[float] = None
+        self.changes = 0
+        self._over = 0
+        self._under = 0
+        self._wait = 0
+        self._backoff = 1
+        # Frames since the last step up, or None if the last change was a step down
+        self._since_up: Optional[int] = None
+
+    @property
+    def budget(self) -> float:
+        return 1.0 / self.target_fps
+
+    @property
+    def level(self) -> Tuple[Optional[int], int, int]:
+        return self.levels[self.index]
+
+    def observe(self, seconds: float) -> bool:
+        """
+        Records the latency of a frame, and returns whether the level changed.
+
+        Parameters:
+        - seconds: The time the frame took, in seconds.
+
+        Returns:
+        - True if the controller moved to another level, then read from level.
+        """
+
+        self.latency = (
+            seconds
+            if self.latency is None
+            else self.latency + self.smoothing * (seconds - self.latency)
+        )
+        if self._since_up is not None:
+            self._since_up += 1
+        if self._wait > 0:
+            self._wait -= 1
+            return False
+
+        if self.latency > self.budget * self.down_margin:
+            self._over += 1
+            self._under = 0
+        elif self.latency < self.budget * self.up_margin:
+            self._under += 1
+            self._over = 0
+        else:
+            self._over = self._under = 0
+
+        if self._over >= self.patience_down and self.index < len(self.levels) - 1:
+            # A step up undone this soon means the better level does not fit: wait
+            # longer before trying it again
+            if (
+                self._since_up is not None
+                and self._since_up <= self.cooldown + 2 * self.patience_down
+            ):
+                self._backoff = min(self._backoff * 2, self.max_backoff)
+            self._since_up = None
+            return self._move(1)
+        if self._under >= self.patience_up * self._backoff and self.index > 0:
+            self._since_up = 0
+            return self._move(-1)
+        if self._since_up is not None and self._since_up > 10 * self.patience_up:
+            # The level has held for long, forget the failed attempts
+            self._backoff = 1
+        return False
+
+    def _move(self, step: int) -> bool:
+        """
+        Moves to the next cheaper (1) or better (-1) level and restarts the measurements.
+        """
+
+        self.index += step
+        self.changes += 1
+        self.latency = None
+        self._over = self._under = 0
+        self._wait = self.cooldown
+        METRICS.count("quality_changes")
+        return True
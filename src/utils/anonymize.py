@@ -0,0 +1,105 @@
+import cv2
+from typing import List, Tuple
+
+import numpy as np
+
+# The faces are blurred at this size at most, so the cost of the blur does not grow with the face
+BLUR_MAX_SIDE = 64
+# The kernel size and standard deviation of the blur, at full resolution
+BLUR_KERNEL = 21
+BLUR_SIGMA = 30
+
+
+def blur_regions(
+    image: np.ndarray,
+    regions: List[Tuple[slice, slice]],
+    kernel: int = BLUR_KERNEL,
+    sigma: float = BLUR_SIGMA,
+    max_side: int = BLUR_MAX_SIDE,
+) -> np.ndarray:
+    """
+    Blurs the face regions of the image in place, at a cost bounded regardless of face size.
+
+    A face larger than max_side is downscaled to fit in max_side, blurred there with the
+    kernel scaled by the same factor, then upscaled back into the frame. Smaller faces are
+    blurred directly, as blur_faces always did.
+
+    Parameters:
+    - image: The image to blur the faces of.
+    - regions: The face regions, as (rows, columns) slices clipped to the image.
+    - kernel: The size of the Gaussian kernel at full resolution.
+    - sigma: The standard deviation of the Gaussian kernel at full resolution.
+    - max_side: The largest side, in pixels, a face is blurred at.
+
+    Returns:
+    - The same image, with the face regions blurred.
+    """
+
+    for region in regions:
+        face = image[region]
+        height, width = face.shape[:2]
+        scale = max_side / max(height, width)
+        if scale >= 1:
+            cv2.GaussianBlur(face, (kernel, kernel), sigma, dst=face)
+            continue
+        # Blur a small copy with the kernel scaled down, the kernel size kept odd
+        small_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        small = cv2.resize(face, small_size, interpolation=cv2.INTER_AREA)
+        small_kernel = max(3, int(kernel * scale) | 1)
+        cv2.GaussianBlur(small, (small_kernel, small_kernel), sigma * scale, dst=small)
+        cv2.resize(small, (width, height), dst=face, interpolation=cv2.INTER_LINEAR)
+    return image
+
+
+def pixelate_regions(
+    image: np.ndarray, regions: List[Tuple[slice, slice]], pixel_size: int = 10
+) -> np.ndarray:
+    """
+    Pixelates the face regions of the image in place.
+
+    Each face is split into a pixel_size x pixel_size grid of blocks, and every block is
+    filled with its mean color. The means come from a single area resize of the face, and
+    the blocks are written back with a nearest-neighbour resize straight into the frame.
+
+    Parameters:
+    - image: The image to pixelate the faces of.
+    - regions: The face regions, as (rows, columns) slices clipped to the image.
+    - pixel_size: The number of blocks along each side of a face.
+
+    Returns:
+    - The same image, with the face regions pixelated.
+    """
+
+    for region in regions:
+        face = image[region]
+        height, width = face.shape[:2]
+        # A face smaller than the grid is left as is, each of its pixels is already a block
+        grid = (min(pixel_size, width), min(pixel_size, height))
+        means = cv2.resize(face, grid, interpolation=cv2.INTER_AREA)
+        cv2.resize(means, (width, height), dst=face, interpolation=cv2.INTER_NEAREST)
+    return image
+
+
+def face_regions(
+    image: np.ndarray, boxes: List[Tuple[int, int, int, int]]
+) -> List[Tuple[slice, slice]]:
+    """
+    Converts the boxes to integer slices clipped to the image, skipping empty ones.
+
+    Parameters:
+    - image: The image the boxes belong to.
+    - boxes: A list of bounding boxes. Each box starts with (x1, y1, x2, y2).
+
+    Returns:
+    - A list of (rows, columns) slices, one per non-empty box.
+    """
+
+    height, width = image.shape[:2]
+    regions = []
+    for box in boxes:
+        x1, y1, x2, y2 = (int(v) for v in box[:4])
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, width), min(y2, height)
+        if x2 > x1 and y2 > y1:
+            regions.append((slice(y1, y2), slice(x1, x2)))
+    return regions
@@ -0,0 +1,227 @@
+import cv2
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple, Union
+
+import numpy as np
+
+# Replacement images are cached at box sizes rounded to this many pixels
+SIZE_BUCKET = 8
+
+
+class AssetCache:
+    """
+    A class used to cache the assets derived from the strategy settings, such as resized
+    background plates, resized replacement images and parsed colors.
+
+    Entries are keyed by (asset id, target size) and evicted in least recently used order
+    once the cache holds more than max_entries entries or max_bytes bytes of arrays. An
+    image asset is identified by its identity, and the cache keeps a weak reference to it
+    so that a new image reusing the memory of a freed one is never mistaken for it.
+
+    Attributes
+    ----------
+    max_entries : int
+        The maximum number of cached assets.
+    max_bytes : int
+        The maximum total size of the cached arrays, in bytes.
+    hits : int
+        The number of lookups answered from the cache.
+    misses : int
+        The number of lookups that had to build the asset.
+
+    Methods
+    -------
+    get(key, build, source=None)
+        Returns the cached asset for the key, building it on a miss.
+    stats()
+        Returns the hit and miss counters and the current size of the cache.
+    clear()
+        Empties the cache and resets the counters.
+    """
+
+    def __init__(self, max_entries: int = 128, max_bytes: int = 256 * 2**20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._nbytes = 0
+        # Each entry is a (value, weak reference to the source image or None) pair
+        self._entries: "OrderedDict[Hashable, Tuple[Any, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key: Hashable, build: Callable[[], Any], source: Any = None) -> Any:
+        """
+        Returns the cached asset for the key, building it on a miss.
+
+        Parameters:
+        - key: The (asset id, target size) key of the asset.
+        - build: A function building the asset.
+        - source: The image the asset is derived from, if any, checked on every hit.
+
+        Returns:
+        - The cached asset. It is shared, so it must not be modified.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1]() is source):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        value = build()
+        with self._lock:
+            if key in self._entries:
+                self._nbytes -= _nbytes(self._entries.pop(key)[0])
+            reference = weakref.ref(source) if source is not None else None
+            self._entries[key] = (value, reference)
+            self._nbytes += _nbytes(value)
+            # Evict the least recently used entries
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or self._nbytes > self.max_bytes
+            ):
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._nbytes -= _nbytes(evicted)
+        return value
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the hit and miss counters and the current size of the cache.
+        """
+
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate,
+                "entries": len(self._entries),
+                "bytes": self._nbytes,
+            }
+
+    def clear(self) -> None:
+        """
+        Empties the cache and resets the counters.
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+def _nbytes(value: Any) -> int:
+    """
+    Returns the size of the arrays in a cached value, in bytes.
+    """
+
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sum(_nbytes(item) for item in value)
+    return 0
+
+
+# The cache shared by all the strategies of the process
+ASSET_CACHE = AssetCache()
+
+
+def parse_color(hex_color: str) -> Tuple[Tuple[int, int, int], np.ndarray]:
+    """
+    Returns the BGR tuple and the HSV values of a color in hexadecimal format.
+
+    Parameters:
+    - hex_color: The color, such as "#56ecd5".
+
+    Returns:
+    - bgr: The color as a tuple of BGR values.
+    - hsv: The color as a numpy array of HSV values.
+    """
+
+    def build():
+        value = hex_color.lstrip("#")
+        bgr = tuple(int(value[i : i + 2], 16) for i in (4, 2, 0))
+        hsv = cv2.cvtColor(np.array([[bgr]], dtype=np.uint8), cv2.COLOR_BGR2HSV)[0, 0]
+        return bgr, hsv
+
+    return ASSET_CACHE.get(("color", hex_color), build)
+
+
+def background_plate(
+    background: Union[str, np.ndarray], shape: Tuple[int, ...]
+) -> np.ndarray:
+    """
+    Returns the background of a frame of the given shape, for "Change Background".
+
+    Parameters:
+    - background: The background color in hexadecimal format, or an image as a numpy array.
+    - shape: The shape of the frame.
+
+    Returns:
+    - A read-only plate of the frame's shape: the color repeated (in RGB order, as the
+      strategy always used it) or the image resized to the frame.
+    """
+
+    height, width = shape[:2]
+    if isinstance(background, str):
+        bgr, _ = parse_color(background)
+        return ASSET_CACHE.get(
+            ("background", background, shape),
+            lambda: _read_only(np.full(shape, bgr[::-1], dtype=np.uint8)),
+        )
+    return ASSET_CACHE.get(
+        ("background", id(background), shape),
+        lambda: _read_only(cv2.resize(background, (width, height))),
+        source=background,
+    )
+
+
+def replacement_for_size(
+    replacement: np.ndarray, width: int, height: int
+) -> np.ndarray:
+    """
+    Returns the replacement image resized to a face of the given size, for "replace faces".
+
+    The large replacement image is resized once per size bucket (SIZE_BUCKET pixels) and
+    cached, then that small copy is resized to the exact size of the face.
+
+    Parameters:
+    - replacement: The replacement image as a numpy array.
+    - width: The width of the face.
+    - height: The height of the face.
+
+    Returns:
+    - The replacement image, resized to (height, width).
+    """
+
+    bucket = (
+        max(SIZE_BUCKET, -(-width // SIZE_BUCKET) * SIZE_BUCKET),
+        max(SIZE_BUCKET, -(-height // SIZE_BUCKET) * SIZE_BUCKET),
+    )
+    resized = ASSET_CACHE.get(
+        ("replacement", id(replacement), bucket),
+        lambda: _read_only(
+            cv2.resize(replacement, bucket, interpolation=cv2.INTER_AREA)
+        ),
+        source=replacement,
+    )
+    if bucket == (width, height):
+        return resized
+    return cv2.resize(resized, (width, height))
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    """
+    Marks a cached array as read-only, so that sharing it can never corrupt it.
+    """
+
+    array.flags.writeable = False
+    return array
@@ -2,6 +2,10 @@ import cv2
 from typing import List, Tuple, Optional, Union, Callable
 import numpy as np
 import torch
+from .face_store import add_face
+from .asset_cache import background_plate, parse_color, replacement_for_size
+from .anonymize import BLUR_MAX_SIDE, blur_regions, face_regions, pixelate_regions
+from .metrics import METRICS
 
 
 def blur_faces(image: np.ndarray, boxes: List[Tuple[int, int, int, int]]) -> np.ndarray:
@@ -10,25 +14,16 @@ def blur_faces(image: np.ndarray, boxes: List[Tuple[int, int, int, int]]) -> np.
 
     Parameters:
     - image: The original image.
-    - boxes: A list of bounding boxes for each detected face. Each box is a tuple (x1, y1, x2, y2).
+    - boxes: A list of bounding boxes for each detected face. Each box starts with (x1, y1, x2, y2).
 
     Returns:
     - The image with the detected faces blurred.
     """
 
-    # For each bounding box in the list of boxes
-    for box in boxes:
-        # Unpack the bounding box coordinates
-        x1, y1, x2, y2 = box
-        # Extract the face region from the image using the bounding box coordinates
-        face = image[int(y1) : int(y2), int(x1) : int(x2)]
-        # Apply a Gaussian blur to the face region
-        # The kernel size is 21x21 and the standard deviation in the x and y directions is 30
-        blurred_face = cv2.GaussianBlur(face, (21, 21), 30)
-        # Replace the face region in the original image with the blurred face
-        image[int(y1) : int(y2), int(x1) : int(x2)] = blurred_face
-    # Return the image with the blurred faces
-    return image
+    # Apply a Gaussian blur to every face region in place, in one call
+    # The kernel size is 21x21 and the standard deviation in the x and y directions is 30
+    # Large faces are blurred on a downscaled copy, so the cost does not grow with their size
+    return blur_regions(image, face_regions(image, boxes))
 
 
 def change_background(
@@ -41,7 +36,7 @@ def change_background(
 
     Parameters:
     - image: The original image.
-    - boxes: A list of bounding boxes for each detected face. Each box is a tuple (x1, y1, x2, y2).
+    - boxes: A list of bounding boxes for each detected face. Each box starts with (x1, y1, x2, y2).
     - background: The desired background color in hexadecimal format or an image as a numpy array.
 
     Returns:
@@ -52,27 +47,13 @@ def change_background(
     mask = np.zeros(image.shape[:2], dtype=np.uint8)
     # For each bounding box in the list of boxes
     for box in boxes:
-        x1, y1, x2, y2 = box
+        x1, y1, x2, y2 = box[:4]
         # Set the pixels within the bounding box in the mask to 255 (white)
         mask[int(y1) : int(y2), int(x1) : int(x2)] = 255
 
-    # If the background is a string (indicating a color in hexadecimal format)
-    if isinstance(background, str):
-
-        # Remove the '#' from the start of the string
-        background = background.lstrip("#")
-        # Convert the hexadecimal color to a tuple of RGB values
-        background_rgb = tuple(int(background[i : i + 2], 16) for i in (0, 2, 4))
-        # background = background[::-1]  # Reverse the tuple to get BGR
-        # Create a new image of the same size as the original image, filled with the background color
-        background_image = np.ones_like(image) * np.array(
-            background_rgb, dtype=np.uint8
-        )
-    else:
-
-        # If the background is not a string, it is an image
-        # Resize the background image to the same size as the original image
-        background_image = cv2.resize(background, (image.shape[1], image.shape[0]))
+    # Get the background plate of the image's size from the asset cache
+    # A color is repeated over the whole plate, an image is resized to the image's size
+    background_image = background_plate(background, image.shape)
 
     # Use the mask to segment the faces from the image
     faces = cv2.bitwise_and(image, image, mask=mask)
@@ -95,23 +76,18 @@ def change_face_color(
 
     Parameters:
     - image: The original image.
-    - boxes: A list of bounding boxes for each detected face. Each box is a tuple (x1, y1, x2, y2).
+    - boxes: A list of bounding boxes for each detected face. Each box starts with (x1, y1, x2, y2).
     - color: The desired color for the faces in hexadecimal format.
 
     Returns:
     - The image with the detected faces changed to the desired color.
     """
-    # Remove the '#' from the start of the color string
-    hex_color = color.lstrip("#")
-    # Convert the hexadecimal color to a tuple of BGR values and convert it to a 3D numpy array
-    bgr_color = np.array(
-        [[[int(hex_color[i : i + 2], 16) for i in (4, 2, 0)]]], dtype=np.uint8
-    )  # Reverse the tuple to get BGR and convert to 3D numpy array
-    desired_hsv = cv2.cvtColor(bgr_color, cv2.COLOR_BGR2HSV)[0, 0]
+    # Get the HSV values of the color from the asset cache
+    _, desired_hsv = parse_color(color)
 
     # For each bounding box in the list of boxes
     for box in boxes:
-        x1, y1, x2, y2 = box
+        x1, y1, x2, y2 = box[:4]
         # Extract the face region from the image using the bounding box coordinates
         face_region = image[int(y1) : int(y2), int(x1) : int(x2)]
 
@@ -141,7 +117,7 @@ def replace_faces(
 
     Parameters:
     - image: The original image.
-    - boxes: A list of bounding boxes for each detected face. Each box is a tuple (x1, y1, x2, y2).
+    - boxes: A list of bounding boxes for each detected face. Each box starts with (x1, y1, x2, y2).
     - replacement: The replacement image as a numpy array.
 
     Returns:
@@ -152,13 +128,19 @@ def replace_faces(
     if replacement is not None and type(replacement) == np.ndarray:
         # For each bounding box in the list of boxes
         for box in boxes:
-            x1, y1, x2, y2 = box
+            x1, y1, x2, y2 = box[:4]
             # Calculate the width and height of the face region
             face_width = int(x2) - int(x1)
             face_height = int(y2) - int(y1)
 
-            # Resize the replacement image to fit the face region
-            replacement_resized = cv2.resize(replacement, (face_width, face_height))
+            if face_width <= 0 or face_height <= 0:
+                continue
+
+            # Resize the replacement image to fit the face region, from a cached copy
+            # already scaled down to about the face's size
+            replacement_resized = replacement_for_size(
+                replacement, face_width, face_height
+            )
 
             # Replace the face region with the replacement image
             image[int(y1) : int(y2), int(x1) : int(x2)] = replacement_resized
@@ -177,19 +159,15 @@ def highlight_edges(
 
     Parameters:
     - image: The original image.
-    - boxes: A list of bounding boxes for each detected face. Each box is a tuple (x1, y1, x2, y2).
+    - boxes: A list of bounding boxes for each detected face. Each box starts with (x1, y1, x2, y2).
     - face_color: The color to use for highlighting the edges of the faces, in hexadecimal format.
 
     Returns:
     - The image with the edges of the detected faces highlighted.
     """
 
-    # Remove the '#' from the start of the color string
-    hex_color = face_color.lstrip("#")
-    # Convert the hexadecimal color to a tuple of BGR values
-    face_color_bgr = tuple(
-        int(hex_color[i : i + 2], 16) for i in (4, 2, 0)
-    )  # Reverse the tuple to get BGR
+    # Get the BGR values of the color from the asset cache
+    face_color_bgr, _ = parse_color(face_color)
     # Convert the image to grayscale
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
@@ -206,7 +184,7 @@ def highlight_edges(
     # Highlight the edges of the detected faces with the chosen color
     # For each bounding box in the list of boxes
     for box in boxes:
-        x1, y1, x2, y2 = box
+        x1, y1, x2, y2 = box[:4]
         # Extract the edges within the bounding box
         face_edges = edges[int(y1) : int(y2), int(x1) : int(x2)]
         # Set the pixels in the edge image where the face edges are detected to the desired color
@@ -226,35 +204,380 @@ def pixelate_faces(
 
     Parameters:
     - image: The original image.
-    - boxes: A list of bounding boxes for each detected face. Each box is a tuple (x1, y1, x2, y2).
+    - boxes: A list of bounding boxes for each detected face. Each box starts with (x1, y1, x2, y2).
     - pixel_size: The size of the pixels for the pixelation effect.
 
     Returns:
     - The image with the detected faces pixelated.
     """
 
-    # Create a copy of the original image to draw on
-    pixelated_image = image.copy()
+    # Fill each block of a pixel_size x pixel_size grid over every face with its mean color
+    # The faces are pixelated in place, in one call
+    return pixelate_regions(image, face_regions(image, boxes), pixel_size)
 
-    # For each bounding box in the list of boxes
-    for box in boxes:
-        # Unpack the bounding box coordinates
-        x1, y1, x2, y2 = box
-        # Extract the face region from the image using the bounding box coordinates
-        face = pixelated_image[int(y1) : int(y2), int(x1) : int(x2)]
-        # Resize the face to a smaller size to create the pixelation effect
-        small = cv2.resize(
-            face, (pixel_size, pixel_size), interpolation=cv2.INTER_LINEAR
+
+class StrategyCompositor:
+    """
+    A class used to apply a list of strategies to the detected faces in a single pass.
+
+    The strategies are compiled once into a plan. Consecutive per-face strategies (blur,
+    face color, replacement, pixelation) are merged into one step that works in place on
+    the face regions, each strategy handling all the boxes of the frame in one call. Only "Change Background" and "highlight
+    edges" touch the whole frame, each with a single in-place pass. The colors are parsed
+    once, the background plate and the resized replacement images come from the asset
+    cache, and the edge buffers are reused for the next frames of the same size. The
+    result is the same as running the strategy functions one after the other.
+
+    Attributes
+    ----------
+    strategies : list
+        The strategies to apply, in order.
+    plan : list
+        The compiled steps, as ("faces", [strategies]) or ("frame", strategy) pairs.
+    blur_max_side : int
+        The largest side, in pixels, the faces are blurred at. Lower is cheaper and coarser.
+
+    Methods
+    -------
+    render(image, boxes)
+        Applies the strategies to the image in place and returns it.
+    """
+
+    # Strategies that only change the face regions
+    FACE_STRATEGIES = (
+        "blur faces",
+        "change face color",
+        "replace faces",
+        "pixelate faces",
+    )
+    # Strategies that change the whole frame
+    FRAME_STRATEGIES = ("Change Background", "highlight edges")
+
+    def __init__(
+        self,
+        strategies: List[str],
+        background: Union[str, np.ndarray] = "#56ecd5",
+        color: str = "#56ecd5",
+        image_replacement: Optional[np.ndarray] = None,
+        edge_color: str = "#56ecd5",
+        pixel_size: int = 10,
+        blur_max_side: int = BLUR_MAX_SIDE,
+    ):
+        self.strategies = list(strategies)
+        self.pixel_size = pixel_size
+        self.blur_max_side = blur_max_side
+
+        # Parse the colors of the selected strategies once. An empty color or a missing
+        # image disables its strategy
+        self._background_color = None
+        self._background_image = None
+        if "Change Background" in self.strategies:
+            if isinstance(background, str) and background:
+                # The strategy has always painted the color in RGB order
+                bgr, _ = parse_color(background)
+                self._background_color = np.array(bgr[::-1], np.uint8)
+            elif isinstance(background, np.ndarray):
+                self._background_image = background
+        self._face_hsv = (
+            parse_color(color)[1]
+            if color and "change face color" in self.strategies
+            else None
         )
-        # Resize the small image back to the size of the face
-        face_pixelated = cv2.resize(
-            small, (face.shape[1], face.shape[0]), interpolation=cv2.INTER_NEAREST
+        self._replacement = (
+            image_replacement if isinstance(image_replacement, np.ndarray) else None
         )
-        # Replace the face in the image with the pixelated version
-        pixelated_image[int(y1) : int(y2), int(x1) : int(x2)] = face_pixelated
+        self._edge_color = (
+            parse_color(edge_color)[0] if "highlight edges" in self.strategies else None
+        )
+
+        # Buffers reused across frames of the same size
+        self._gray = None
+        self._edges = None
+
+        self.plan = self._compile(self.strategies)
+
+    def _compile(self, strategies: List[str]) -> List[Tuple[str, object]]:
+        """
+        Groups consecutive per-face strategies into single steps, and drops the strategies
+        that have nothing to apply.
+        """
+
+        plan = []
+        for strategy in strategies:
+            if strategy == "Change Background" and (
+                self._background_color is None and self._background_image is None
+            ):
+                continue
+            if strategy == "change face color" and self._face_hsv is None:
+                continue
+            if strategy == "replace faces" and self._replacement is None:
+                continue
+            if strategy in self.FACE_STRATEGIES:
+                if plan and plan[-1][0] == "faces":
+                    plan[-1][1].append(strategy)
+                else:
+                    plan.append(("faces", [strategy]))
+            elif strategy in self.FRAME_STRATEGIES:
+                plan.append(("frame", strategy))
+        return plan
+
+    def _apply_to_faces(
+        self, image: np.ndarray, regions: List[Tuple[slice, slice]], strategy: str
+    ) -> None:
+        """
+        Applies a per-face strategy to all the face regions, in place.
+        """
+
+        if strategy == "blur faces":
+            blur_regions(image, regions, max_side=self.blur_max_side)
+        elif strategy == "pixelate faces":
+            pixelate_regions(image, regions, self.pixel_size)
+        elif strategy == "change face color":
+            for region in regions:
+                face = image[region]
+                hsv = cv2.cvtColor(face, cv2.COLOR_BGR2HSV)
+                hsv[..., 0] = self._face_hsv[0]
+                hsv[..., 1] = self._face_hsv[1]
+                cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB, dst=face)
+        elif strategy == "replace faces":
+            for region in regions:
+                face = image[region]
+                face[...] = replacement_for_size(
+                    self._replacement, face.shape[1], face.shape[0]
+                )
+
+    def _change_background(
+        self, image: np.ndarray, regions: List[Tuple[slice, slice]]
+    ) -> None:
+        """
+        Replaces everything but the face regions with the background, in place.
+        """
+
+        # Keep the faces aside, paint the background over the frame, then put the faces back
+        faces = [image[region].copy() for region in regions]
+        if self._background_color is not None:
+            image[...] = self._background_color
+        else:
+            np.copyto(image, background_plate(self._background_image, image.shape))
+        for region, face in zip(regions, faces):
+            image[region] = face
+
+    def _highlight_edges(
+        self, image: np.ndarray, regions: List[Tuple[slice, slice]]
+    ) -> None:
+        """
+        Turns the image into its edges, white outside the faces and colored inside, in place.
+        """
+
+        if self._gray is None or self._gray.shape != image.shape[:2]:
+            self._gray = np.empty(image.shape[:2], np.uint8)
+            self._edges = np.empty(image.shape[:2], np.uint8)
+        cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        cv2.Canny(self._gray, 50, 150, edges=self._edges)
+        # The edges are 0 or 255, so this draws white edges on black in one pass
+        cv2.cvtColor(self._edges, cv2.COLOR_GRAY2BGR, dst=image)
+        for region in regions:
+            image[region][self._edges[region] != 0] = self._edge_color
+
+    def render(
+        self, image: np.ndarray, boxes: List[Tuple[int, int, int, int]]
+    ) -> np.ndarray:
+        """
+        Applies the strategies to the image in place and returns it.
+
+        Parameters:
+        - image: The image to apply the strategies to.
+        - boxes: A list of bounding boxes for each detected face. Each box starts with (x1, y1, x2, y2).
+
+        Returns:
+        - The same image, with the strategies applied.
+        """
+
+        regions = face_regions(image, boxes)
+        for kind, step in self.plan:
+            if kind == "faces":
+                # Apply each strategy of the step to all the faces in one batched call
+                for strategy in step:
+                    with METRICS.stage(strategy):
+                        self._apply_to_faces(image, regions, strategy)
+            elif step == "Change Background":
+                with METRICS.stage(step):
+                    self._change_background(image, regions)
+            elif step == "highlight edges":
+                with METRICS.stage(step):
+                    self._highlight_edges(image, regions)
+        return image
+
+
+def select_detections(
+    pred: List[torch.Tensor],
+    img: torch.Tensor,
+    image_shape: Tuple[int, ...],
+    scale_coords: Callable,
+) -> np.ndarray:
+    """
+    Rescales the model's predictions to the image and returns them as a single array.
+
+    The predictions are already limited to the confident boxes by non-maximum suppression
+    (see suppress in image_processor), so no box is filtered out here.
+
+    Parameters:
+    - pred: The model's predictions after non-maximum suppression.
+    - img: The reshaped and normalized image tensor the predictions were made on.
+    - image_shape: The shape of the image to rescale the coordinates to.
+    - scale_coords: The function to rescale the coordinates to the original image size.
+
+    Returns:
+    - A contiguous float32 (N, 6) array of [x1, y1, x2, y2, conf, cls] rows, the least
+      confident first so that the most confident boxes are drawn on top.
+    """
+
+    detections = []
+    for det in pred:
+        if len(det):
+            # Rescale the coordinates to the original image size
+            det[:, :4] = scale_coords(img.shape[2:], det[:, :4], image_shape).round()
+            detections.append(det)
+    if not detections:
+        return np.zeros((0, 6), dtype=np.float32)
+    # One conversion for all the boxes, instead of one per coordinate
+    return np.ascontiguousarray(
+        torch.cat(detections).flip(0).cpu().numpy(), dtype=np.float32
+    )
 
-    # Return the image with the pixelated faces
-    return pixelated_image
+
+def apply_strategies(
+    image: np.ndarray,
+    boxes: List[Tuple[int, int, int, int]],
+    strategies: List[str],
+    background: Union[str, np.ndarray] = "#56ecd5",
+    color: str = "#56ecd5",
+    image_replacement: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Applies the selected strategies to the faces in the given boxes.
+
+    Parameters:
+    - image: The image to apply the strategies to.
+    - boxes: A list of bounding boxes for each detected face. Each box starts with (x1, y1, x2, y2).
+    - strategies: A list of strategies to apply to the image.
+    - background: The desired background color in hexadecimal format or an image as a numpy array.
+    - color: The desired color for the faces in hexadecimal format.
+    - image_replacement: The replacement image as a numpy array.
+
+    Returns:
+    - The image with the strategies applied.
+    """
+
+    for strategy in strategies:
+        if strategy == "blur faces":
+            image = blur_faces(image, boxes)
+        if strategy == "Change Background":
+            image = change_background(image, boxes, background)
+        if strategy == "change face color":
+            image = change_face_color(image, boxes, color)
+        if strategy == "replace faces":
+            image = replace_faces(image, boxes, image_replacement)
+        if strategy == "highlight edges":
+            image = highlight_edges(image, boxes)
+        if strategy == "pixelate faces":
+            image = pixelate_faces(image, boxes)
+    return image
+
+
+def render_detections(
+    image: np.ndarray,
+    detections: np.ndarray,
+    names: List[str],
+    plot_one_box: Callable,
+    strategies: List[str],
+    background: Union[str, np.ndarray] = "#56ecd5",
+    color: str = "#56ecd5",
+    image_replacement: Optional[np.ndarray] = None,
+    compositor: Optional[StrategyCompositor] = None,
+) -> np.ndarray:
+    """
+    Draws the bounding boxes of the given detections and applies the selected strategies.
+
+    Parameters:
+    - image: The image to draw on.
+    - detections: The (N, 6) array of detections, as returned by select_detections.
+    - names: The names of the classes.
+    - plot_one_box: The function to draw a bounding box on the image.
+    - strategies: A list of strategies to apply to the image.
+    - background: The desired background color in hexadecimal format or an image as a numpy array.
+    - color: The desired color for the faces in hexadecimal format.
+    - image_replacement: The replacement image as a numpy array.
+    - compositor: A StrategyCompositor to reuse across frames. If None, one is compiled
+      for this call from the strategies, background, color and image_replacement.
+
+    Returns:
+    - The image with the bounding boxes drawn and the strategies applied.
+    """
+
+    # Draw the bounding boxes on the image
+    with METRICS.stage("plot_boxes"):
+        for *xyxy, conf, cls in detections:
+            label = f"{names[int(cls)]} {conf:.2f}"
+            plot_one_box(xyxy, image, label=label, color=(255, 0, 0), line_thickness=3)
+
+    # Apply the selected strategies to the detected faces
+    if len(detections):
+        if compositor is None:
+            compositor = StrategyCompositor(
+                strategies, background, color, image_replacement
+            )
+        image = compositor.render(image, detections)
+    return image
+
+
+def draw_detections(
+    image: np.ndarray,
+    boxes: np.ndarray,
+    names: List[str],
+    faces: List[np.ndarray],
+    plot_one_box: Callable,
+    strategies: List[str],
+    background: Union[str, np.ndarray] = "#56ecd5",
+    color: str = "#56ecd5",
+    image_replacement: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Stores the detected faces, draws their bounding boxes and applies the selected strategies.
+
+    Parameters:
+    - image: The image to draw on, the one the detections are in coordinates of.
+    - boxes: The (N, 6) array of detections, as returned by select_detections.
+    - names: The names of the classes.
+    - faces: A list or FaceStore to store the detected faces.
+    - plot_one_box: The function to draw a bounding box on the image.
+    - strategies: A list of strategies to apply to the image.
+    - background: The desired background color in hexadecimal format or an image as a numpy array.
+    - color: The desired color for the faces in hexadecimal format.
+    - image_replacement: The replacement image as a numpy array.
+
+    Returns:
+    - The image with the bounding boxes drawn and the strategies applied.
+    """
+
+    with METRICS.stage("store_faces"):
+        for box in boxes:
+            # Unpack the coordinates of the bounding box
+            x1, y1, x2, y2 = box[:4]
+            face = image[int(y1) : int(y2), int(x1) : int(x2)]
+            add_face(faces, face, box[:4])  # Add the detected face to the list or store
+
+    # Draw the bounding boxes on the image and apply the selected strategies
+    return render_detections(
+        image,
+        boxes,
+        names,
+        plot_one_box,
+        strategies,
+        background,
+        color,
+        image_replacement,
+    )
 
 
 def draw_boxes(
@@ -270,7 +593,7 @@ def draw_boxes(
     background: str = "#56ecd5",
     color: str = "#56ecd5",
     image_replacement: Optional[np.ndarray] = None,
-) -> Tuple[List[np.ndarray], List[Tuple[int, int, int, int]], np.ndarray]:
+) -> Tuple[List[np.ndarray], np.ndarray, np.ndarray]:
     """
     Draws bounding boxes on the detected faces in the image and applies various strategies.
 
@@ -280,7 +603,7 @@ def draw_boxes(
     - img: The reshaped and normalized image tensor.
     - names: The names of the classes.
     - original_size: The original size of the image.
-    - faces: A list to store the detected faces.
+    - faces: A list or FaceStore to store the detected faces.
     - scale_coords: The function to rescale the coordinates to the original image size.
     - plot_one_box: The function to draw a bounding box on the image.
     - strategies: A list of strategies to apply to the image.
@@ -290,48 +613,31 @@ def draw_boxes(
 
     Returns:
     - faces: The list of detected faces.
-    - boxes: The list of bounding boxes for each detected face.
+    - boxes: The float32 (N, 6) array of [x1, y1, x2, y2, conf, cls] detections.
     - image: The image with the bounding boxes drawn and the strategies applied.
     """
 
-    boxes = []  # List to store the bounding boxes
-    # Process the predictions
-    for det in pred:
-        if len(det):
-            # Rescale the coordinates to the original image size
-            det[:, :4] = scale_coords(img.shape[2:], det[:, :4], image.shape).round()
-
-            # Draw the bounding boxes on the image
-            for *xyxy, conf, cls in reversed(det):
-                if conf > 0.4:
-                    # Unpack the coordinates of the bounding box
-                    x1, y1, x2, y2 = xyxy
-                    label = f"{names[int(cls)]} {conf:.2f}"
-                    face = image[int(y1) : int(y2), int(x1) : int(x2)]
-                    faces.append(face)  # Add the detected face to the list
-                    # _, face = cv2.imencode(".jpeg", face)
-                    # Add the bounding box to the list
-                    boxes.append((x1, y1, x2, y2))
-                    plot_one_box(
-                        xyxy, image, label=label, color=(255, 0, 0), line_thickness=3
-                    )  # Draw the bounding box on the original image
-            # Apply the selected strategies to the detected faces
-            for strategy in strategies:
-                if strategy == "blur faces":
-                    image = blur_faces(image, boxes)
-                if strategy == "Change Background":
-                    image = change_background(image, boxes, background)
-                if strategy == "change face color":
-                    image = change_face_color(image, boxes, color)
-                if strategy == "replace faces":
-                    image = replace_faces(image, boxes, image_replacement)
-                if strategy == "highlight edges":
-                    image = highlight_edges(image, boxes)
-                if strategy == "pixelate faces":
-                    image = pixelate_faces(image, boxes)
-
-    # Resize the image back to its original size
-    image = cv2.resize(image, (original_size[1], original_size[0]))
+    # Rescale the predictions to the image, as one (N, 6) array
+    with METRICS.stage("scale_coords"):
+        boxes = select_detections(pred, img, image.shape, scale_coords)
+
+    # Store the faces, draw the bounding boxes on the original image and apply the selected strategies
+    image = draw_detections(
+        image,
+        boxes,
+        names,
+        faces,
+        plot_one_box,
+        strategies,
+        background,
+        color,
+        image_replacement,
+    )
+
+    # The image is drawn on at its original resolution, only resize it if it was not
+    if image.shape[:2] != tuple(original_size):
+        with METRICS.stage("resize"):
+            image = cv2.resize(image, (original_size[1], original_size[0]))
     return (
         faces,
         boxes,
@@ -0,0 +1,228 @@
+import cv2
+import glob
+import json
+import multiprocessing
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from .model_loader import get_model
+from .predict import predict
+
+# Extensions of the images picked up in the input directory
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# The model and settings of a worker process, set once by _init_worker
+_worker: Dict[str, Any] = {}
+
+
+def list_images(input_dir: str) -> List[str]:
+    """
+    Lists the images of a directory and its subdirectories.
+
+    Parameters:
+    - input_dir: The directory to list.
+
+    Returns:
+    - The paths of the images relative to input_dir, sorted.
+    """
+
+    paths = glob.glob(os.path.join(input_dir, "**", "*"), recursive=True)
+    return sorted(
+        os.path.relpath(path, input_dir)
+        for path in paths
+        if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path)
+    )
+
+
+def read_done(records_path: str) -> Set[str]:
+    """
+    Returns the images already processed by a previous run, so it can be resumed.
+
+    The images whose record holds an error are not done, so a resumed run retries them.
+    Their new record is appended after the failed one, the last record of an image wins.
+
+    Parameters:
+    - records_path: The JSON lines file of the previous run.
+
+    Returns:
+    - The relative paths of the images recorded without an error. A truncated last line is ignored.
+    """
+
+    done = set()
+    if os.path.exists(records_path):
+        with open(records_path) as records:
+            for line in records:
+                try:
+                    record = json.loads(line)
+                    image = record["image"]
+                except (ValueError, KeyError):
+                    continue
+                if "error" in record:
+                    done.discard(image)
+                else:
+                    done.add(image)
+    return done
+
+
+def _init_worker(settings: Dict[str, Any]) -> None:
+    """
+    Loads the model once in a worker process, along with the strategy settings.
+    """
+
+    _worker.update(settings)
+    _worker["model"] = get_model(settings["model_path"], warmup_shapes=())
+    for key in ("background", "image_replacement"):
+        # Images are passed as paths and read once per worker
+        path = settings.get(key + "_path")
+        if path:
+            _worker[key] = cv2.imread(path)
+
+
+def _process_chunk(paths: List[str]) -> List[Dict[str, Any]]:
+    """
+    Processes a chunk of images in a worker process and writes the rendered images.
+
+    Returns:
+    - One record per image: its relative path, and its boxes or the error that occurred.
+    """
+
+    model, names, scale_coords, non_max_suppression, plot_one_box = _worker["model"]
+    records = []
+    for path in paths:
+        record: Dict[str, Any] = {"image": path}
+        try:
+            image = cv2.imread(os.path.join(_worker["input_dir"], path))
+            if image is None:
+                raise ValueError("Could not read image")
+            _, boxes, rendered = predict(
+                image,
+                model,
+                names,
+                [],
+                scale_coords,
+                non_max_suppression,
+                plot_one_box,
+                _worker["strategies"],
+                _worker["background"],
+                _worker["color"],
+                _worker.get("image_replacement"),
+                _worker["img_size"],
+            )
+            output_path = os.path.join(_worker["output_dir"], path)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            if not cv2.imwrite(output_path, rendered):
+                raise ValueError("Could not write image")
+            record["boxes"] = boxes.astype(float).round(3).tolist()
+        except Exception as error:
+            record["error"] = str(error)
+        records.append(record)
+    return records
+
+
+def _chunks(paths: List[str], chunk_size: int) -> Iterator[List[str]]:
+    for start in range(0, len(paths), chunk_size):
+        yield paths[start : start + chunk_size]
+
+
+def process_directory(
+    input_dir: str,
+    output_dir: str,
+    model_path: str,
+    strategies: List[str],
+    background: str = "#56ecd5",
+    color: str = "#56ecd5",
+    background_path: Optional[str] = None,
+    replacement_path: Optional[str] = None,
+    img_size: Optional[int] = 640,
+    workers: Optional[int] = None,
+    threads_per_worker: Optional[int] = None,
+    chunk_size: int = 32,
+    records_path: Optional[str] = None,
+) -> Dict[str, float]:
+    """
+    Detects the faces of every image of a directory with a pool of worker processes.
+
+    Each worker loads the model once and gets an equal share of the CPU cores as torch
+    intra-op threads, so the workers do not compete for them. The images are handed out in
+    chunks, each image goes through predict, and its rendered copy is written to output_dir
+    under the same relative path. The records of the images, with their boxes, are appended
+    to a JSON lines file as the chunks complete. Images already recorded there without an
+    error are skipped, so an interrupted run is resumed, and its failed images retried, by
+    running it again.
+
+    Parameters:
+    - input_dir: The directory of the images to process.
+    - output_dir: The directory to write the rendered images to.
+    - model_path: The model to load in every worker.
+    - strategies: A list of strategies to apply to the images.
+    - background: The desired background color in hexadecimal format.
+    - color: The desired color for the faces in hexadecimal format.
+    - background_path: An image to use as the background instead of the color.
+    - replacement_path: The replacement image for "replace faces".
+    - img_size: The letterboxed inference size, or None to run on the whole images.
+    - workers: The number of worker processes, or None for one per two cores.
+    - threads_per_worker: The torch threads of each worker, or None to split the cores evenly.
+    - chunk_size: The number of images handed to a worker at a time.
+    - records_path: The JSON lines file of the records (output_dir/detections.jsonl if None).
+
+    Returns:
+    - A dictionary with the number of processed, skipped and failed images, the elapsed
+      time and the throughput in images per second.
+    """
+
+    cpus = os.cpu_count() or 1
+    workers = workers or max(1, cpus // 2)
+    threads_per_worker = threads_per_worker or max(1, cpus // workers)
+    records_path = records_path or os.path.join(output_dir, "detections.jsonl")
+    os.makedirs(output_dir, exist_ok=True)
+
+    paths = list_images(input_dir)
+    done = read_done(records_path)
+    todo = [path for path in paths if path not in done]
+
+    settings = {
+        "model_path": model_path,
+        "input_dir": input_dir,
+        "output_dir": output_dir,
+        "strategies": strategies,
+        "background": background,
+        "background_path": background_path,
+        "color": color,
+        "image_replacement_path": replacement_path,
+        "img_size": img_size,
+    }
+
+    processed = failed = 0
+    start = time.perf_counter()
+    # The workers read their thread count when they load the model
+    previous_threads = os.environ.get("FACE_SIGHT_NUM_THREADS")
+    os.environ["FACE_SIGHT_NUM_THREADS"] = str(threads_per_worker)
+    try:
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(workers, _init_worker, (settings,)) as pool, open(
+            records_path, "a"
+        ) as records:
+            for chunk_records in pool.imap_unordered(
+                _process_chunk, _chunks(todo, chunk_size)
+            ):
+                for record in chunk_records:
+                    records.write(json.dumps(record) + "\n")
+                    processed += 1
+                    failed += "error" in record
+                # Every completed chunk is on disk before the next one is awaited
+                records.flush()
+    finally:
+        if previous_threads is None:
+            os.environ.pop("FACE_SIGHT_NUM_THREADS", None)
+        else:
+            os.environ["FACE_SIGHT_NUM_THREADS"] = previous_threads
+    elapsed = time.perf_counter() - start
+
+    return {
+        "processed": processed,
+        "skipped": len(paths) - len(todo),
+        "failed": failed,
+        "seconds": elapsed,
+        "images_per_second": processed / elapsed if elapsed else 0.0,
+    }
@@ -0,0 +1,149 @@
+import threading
+from collections import deque
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+
+def box_iou(
+    box1: Tuple[float, float, float, float], box2: Tuple[float, float, float, float]
+) -> float:
+    """
+    Returns the intersection over union of two (x1, y1, x2, y2) boxes.
+    """
+
+    x1, y1 = max(box1[0], box2[0]), max(box1[1], box2[1])
+    x2, y2 = min(box1[2], box2[2]), min(box1[3], box2[3])
+    intersection = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    area1 = (box1[2] - box1[0]) * (box1[3] - box1[1])
+    area2 = (box2[2] - box2[0]) * (box2[3] - box2[1])
+    union = area1 + area2 - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+class FaceStore:
+    """
+    A class used to keep a bounded number of detected faces as small thumbnails.
+
+    Each face crop is copied into a thumbnail, so the store never keeps the frame it was
+    cropped from alive, and only the newest max_faces thumbnails are kept. When dedupe_iou
+    is set, a face whose box overlaps the box of one of the last stored faces by at least
+    that much is considered the same face seen again, and replaces its thumbnail instead of
+    being added.
+
+    Attributes
+    ----------
+    max_faces : int
+        The maximum number of thumbnails kept.
+    thumbnail_size : int
+        The size of the longest side of a thumbnail, in pixels.
+    dedupe_iou : float, optional
+        The overlap above which two boxes are the same face, or None to keep every face.
+    total : int
+        The number of faces added since the store was created or cleared.
+
+    Methods
+    -------
+    append(face, box=None)
+        Adds a face crop to the store.
+    snapshot()
+        Returns the stored thumbnails, oldest first.
+    clear()
+        Removes every face from the store.
+    """
+
+    def __init__(
+        self,
+        max_faces: int = 64,
+        thumbnail_size: int = 100,
+        dedupe_iou: Optional[float] = None,
+    ):
+        self.max_faces = max_faces
+        self.thumbnail_size = thumbnail_size
+        self.dedupe_iou = dedupe_iou
+        self.total = 0
+        # Each entry is a [box, thumbnail] pair, the newest last
+        self._entries = deque(maxlen=max_faces)
+        self._lock = threading.Lock()
+
+    def _thumbnail(self, face: np.ndarray) -> np.ndarray:
+        """
+        Returns a compact copy of a face crop, scaled down to thumbnail_size if needed.
+        """
+
+        height, width = face.shape[:2]
+        scale = self.thumbnail_size / max(height, width)
+        if scale >= 1:
+            return face.copy()
+        # OpenCV is only needed once a face is stored, not when the page imports the store
+        import cv2
+
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return cv2.resize(face, size, interpolation=cv2.INTER_AREA)
+
+    def append(
+        self,
+        face: np.ndarray,
+        box: Optional[Tuple[float, float, float, float]] = None,
+    ) -> None:
+        """
+        Adds a face crop to the store.
+
+        Parameters:
+        - face: The face crop. It is copied, so it can be a view of a frame.
+        - box: The (x1, y1, x2, y2) box of the face, used to recognise the same face seen again.
+        """
+
+        if face.size == 0:
+            return
+        thumbnail = self._thumbnail(face)
+        box = tuple(float(v) for v in box) if box is not None else None
+
+        with self._lock:
+            self.total += 1
+            if self.dedupe_iou is not None and box is not None:
+                # Look for the same face among the most recent entries
+                for entry in reversed(self._entries):
+                    if (
+                        entry[0] is not None
+                        and box_iou(entry[0], box) >= self.dedupe_iou
+                    ):
+                        entry[0], entry[1] = box, thumbnail
+                        return
+            self._entries.append([box, thumbnail])
+
+    def snapshot(self) -> List[np.ndarray]:
+        """
+        Returns the stored thumbnails, oldest first.
+        """
+
+        with self._lock:
+            return [thumbnail for _, thumbnail in self._entries]
+
+    def clear(self) -> None:
+        """
+        Removes every face from the store.
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self.total = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def add_face(faces: Any, face: np.ndarray, box: Tuple[float, ...]) -> None:
+    """
+    Adds a face crop to a FaceStore, with its box, or to a plain list.
+
+    Parameters:
+    - faces: The FaceStore or list to add the face to.
+    - face: The face crop.
+    - box: The (x1, y1, x2, y2) box of the face.
+    """
+
+    if isinstance(faces, FaceStore):
+        faces.append(face, box)
+    else:
+        faces.append(face)
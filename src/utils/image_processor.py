@@ -1,22 +1,276 @@
 import cv2
+import functools
+import glob
+import inspect
+import os
+import numpy as np
 import torch
-from typing import Any, Tuple
+from typing import Any, List, Optional, Tuple
+
+from .metrics import METRICS
+
+# Detection settings applied inside non-maximum suppression
+# Only the boxes whose confidence is above CONF_THRESHOLD are kept
+CONF_THRESHOLD = 0.4
+IOU_THRESHOLD = 0.45
+# The maximum number of detections kept per image, the most confident first
+MAX_DETECTIONS = 300
+
+
+def read_images(folder: str, limit: Optional[int] = None) -> List[np.ndarray]:
+    """
+    Reads the jpg, jpeg and png images of a folder as BGR numpy arrays.
+
+    Parameters:
+    - folder: The folder to read the images from.
+    - limit: The maximum number of images to read, or None to read them all.
+
+    Returns:
+    - The images that could be read, sorted by file name.
+    """
+
+    paths = sorted(
+        path
+        for pattern in ("*.jpg", "*.jpeg", "*.png")
+        for path in glob.glob(os.path.join(folder, pattern))
+    )[:limit]
+    return [image for image in map(cv2.imread, paths) if image is not None]
+
+
+def letterbox_shape(
+    shape: Tuple[int, int], new_size: int, stride: int
+) -> Tuple[int, int]:
+    """
+    Returns the (height, width) that letterbox produces for an image of the given shape.
+
+    Parameters:
+    - shape: The (height, width) of the original image.
+    - new_size: The target size of the longest side.
+    - stride: The model's stride.
+
+    Returns:
+    - The (height, width) of the letterboxed image.
+    """
+
+    height, width = shape[:2]
+    ratio = min(new_size / height, new_size / width, 1.0)
+    new_height, new_width = int(round(height * ratio)), int(round(width * ratio))
+    return (
+        new_height + (stride - new_height % stride) % stride,
+        new_width + (stride - new_width % stride) % stride,
+    )
+
+
+def inference_size(
+    model: Any, shape: Tuple[int, int], img_size: Optional[int] = None
+) -> int:
+    """
+    Returns the size an image is letterboxed to before going through the model.
+
+    A traced TorchScript model only runs inputs up to the shape it was traced at, so the
+    size is clamped to that shape, and larger images are scaled down instead of failing.
+
+    Parameters:
+    - model: The object detection model to use.
+    - shape: The (height, width) of the original image.
+    - img_size: The requested inference size, or None for the whole image.
+
+    Returns:
+    - The target size of the longest side.
+    """
+
+    size = img_size if img_size is not None else max(shape[:2])
+    # Only the traced models have a fixed input shape
+    fixed_shape = getattr(model, "shape", None)
+    if fixed_shape is not None:
+        size = min(size, *fixed_shape)
+    return size
+
+
+def letterbox(
+    image: np.ndarray,
+    new_size: int,
+    stride: int,
+    color: Tuple[int, int, int] = (114, 114, 114),
+) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+    """
+    Resizes an image so its longest side fits new_size while keeping its aspect ratio,
+    then pads it to the nearest multiple of the stride.
+
+    Images that are already smaller than new_size are not scaled up. The padding is
+    split evenly between both sides, which is what scale_coords expects when it maps
+    the boxes back to the original image.
+
+    Parameters:
+    - image: The original image.
+    - new_size: The target size of the longest side.
+    - stride: The model's stride.
+    - color: The color of the padding.
+
+    Returns:
+    - image: The letterboxed image.
+    - ratio: The scale factor applied to the original image.
+    - pad: The (width, height) padding added on each side.
+    """
+
+    height, width = image.shape[:2]
+
+    # Scale ratio (new / old), never scaling up
+    ratio = min(new_size / height, new_size / width, 1.0)
+    new_unpad = int(round(width * ratio)), int(round(height * ratio))
+
+    # Pad each dimension up to the next multiple of the stride, split between both sides
+    pad_w = (stride - new_unpad[0] % stride) % stride / 2
+    pad_h = (stride - new_unpad[1] % stride) % stride / 2
+
+    if (width, height) != new_unpad:
+        image = cv2.resize(image, new_unpad, interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(pad_h - 0.1)), int(round(pad_h + 0.1))
+    left, right = int(round(pad_w - 0.1)), int(round(pad_w + 0.1))
+    if top or bottom or left or right:
+        image = cv2.copyMakeBorder(
+            image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color
+        )
+    return image, ratio, (pad_w, pad_h)
+
+
+class InputBuffer:
+    """
+    A class used to keep the model input tensor of a stream of images and refill it in place.
+
+    Converting a frame to the model input normally allocates a float tensor, then a second
+    one for the normalization. The buffer allocates the tensor once per input shape and
+    layout, and each frame is converted and normalized straight into it. A buffer must only
+    be used by one thread at a time, and the tensor it returns is overwritten by the next fill.
+
+    Attributes
+    ----------
+    tensor : torch.Tensor or None
+        The last filled (1, 3, H, W) float tensor.
+
+    Methods
+    -------
+    fill(model_input, channels_last=False)
+        Converts a letterboxed image into the buffer and returns it.
+    """
+
+    def __init__(self):
+        self.tensor = None
+
+    def fill(
+        self, model_input: np.ndarray, channels_last: bool = False
+    ) -> torch.Tensor:
+        """
+        Converts a letterboxed image into the buffer and returns it.
+
+        Parameters:
+        - model_input: The letterboxed (H, W, 3) uint8 image.
+        - channels_last: Whether the model expects a channels_last input.
+
+        Returns:
+        - The (1, 3, H, W) float tensor holding the normalized image.
+        """
+
+        height, width = model_input.shape[:2]
+        memory_format = (
+            torch.channels_last if channels_last else torch.contiguous_format
+        )
+        # The buffer is an inference tensor, so it is only ever created and filled in inference mode
+        with torch.inference_mode():
+            if (
+                self.tensor is None
+                or self.tensor.shape[2:] != (height, width)
+                or not self.tensor.is_contiguous(memory_format=memory_format)
+            ):
+                self.tensor = torch.empty(
+                    (1, 3, height, width), memory_format=memory_format
+                )
+            # Convert the uint8 HWC image into the float CHW tensor, then normalize it in place
+            self.tensor[0].copy_(torch.from_numpy(model_input).permute(2, 0, 1))
+            self.tensor.mul_(1 / 255.0)
+        return self.tensor
+
+
+@functools.lru_cache(maxsize=None)
+def _accepts_max_det(non_max_suppression: Any) -> bool:
+    """
+    Returns whether a non-maximum suppression function takes a max_det argument.
+    """
+
+    try:
+        return "max_det" in inspect.signature(non_max_suppression).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def suppress(
+    pred: torch.Tensor,
+    non_max_suppression: Any,
+    conf_thres: float = CONF_THRESHOLD,
+    classes: Optional[List[int]] = None,
+    max_det: int = MAX_DETECTIONS,
+) -> List[torch.Tensor]:
+    """
+    Applies non-maximum suppression with the detection settings to the model's predictions.
+
+    Filtering the boxes by confidence and class inside the call means only the boxes that
+    will be kept are sorted and compared, instead of every box above the default threshold.
+
+    Parameters:
+    - pred: The model's raw predictions for a batch of images.
+    - non_max_suppression: The non-maximum suppression function to apply.
+    - conf_thres: The confidence above which a box is kept.
+    - classes: The classes to keep, or None to keep them all.
+    - max_det: The maximum number of detections kept per image.
+
+    Returns:
+    - One (n, 6) tensor of [x1, y1, x2, y2, conf, cls] rows per image, the most confident first.
+    """
+
+    kwargs = {"conf_thres": conf_thres, "iou_thres": IOU_THRESHOLD, "classes": classes}
+    # Stop at max_det inside NMS when the function supports it, like ops.non_max_suppression
+    if _accepts_max_det(non_max_suppression):
+        kwargs["max_det"] = max_det
+    detections = non_max_suppression(pred, **kwargs)
+    # The detections come sorted by confidence, so the limit keeps the most confident ones
+    return [det[:max_det] for det in detections]
 
 
 def process_image(
-    image: Any, model: Any, non_max_suppression: Any
+    image: Any,
+    model: Any,
+    non_max_suppression: Any,
+    img_size: Optional[int] = None,
+    buffer: Optional[InputBuffer] = None,
+    copy: bool = True,
+    conf_thres: float = CONF_THRESHOLD,
+    classes: Optional[List[int]] = None,
+    max_det: int = MAX_DETECTIONS,
 ) -> Tuple[Any, Any, torch.Tensor, Tuple[int, int]]:
     """
     Processes an image for object detection.
 
+    The original image is never resized: only the model input is letterboxed, into a
+    separate array, and the predictions are mapped straight back to the original image by
+    scale_coords. The image to draw on therefore keeps its resolution.
+
     Parameters:
     - image: The original image.
     - model: The object detection model to use.
     - non_max_suppression: The non-maximum suppression function to apply to the model's predictions.
+    - img_size: The inference size for the letterbox mode. If None, the whole image is
+      only padded to a multiple of the model's stride instead. Either way, it is clamped
+      to the shape of a traced model (see inference_size).
+    - buffer: An InputBuffer to convert the model input into, reused from one call to the
+      next. If None, a new tensor is allocated.
+    - copy: Whether to return a copy of the image to draw on, or the image itself.
+    - conf_thres: The confidence above which a box is kept.
+    - classes: The classes to keep, or None to keep them all.
+    - max_det: The maximum number of detections kept.
 
     Returns:
     - pred: The model's predictions after non-maximum suppression.
-    - image: The resized image.
+    - image: The image to draw on, at its original resolution.
     - img: The reshaped and normalized image tensor.
     - original_size: The original size of the image.
     """
@@ -27,28 +281,92 @@ def process_image(
     # Set the model's stride
     stride = int(model.stride.max())
 
-    # Compute the new size of the image
-    new_size = (
-        image.shape[1] - image.shape[1] % stride,
-        image.shape[0] - image.shape[0] % stride,
-    )
+    with METRICS.stage("preprocess"):
+        # Letterbox the image for the model, and keep the original resolution for drawing
+        # Without an inference size, the image keeps its size and is only padded to the stride
+        new_size = inference_size(model, original_size, img_size)
+        model_input, _, _ = letterbox(image, new_size, stride)
+        if copy:
+            image = image.copy()
+
+        # Convert the image to a normalized (1, 3, H, W) tensor, laid out like the model's weights
+        channels_last = getattr(model, "channels_last", False)
+        if buffer is None:
+            buffer = InputBuffer()
+        img = buffer.fill(model_input, channels_last)
+
+    # Run the model without recording anything for autograd
+    with torch.inference_mode():
+        with METRICS.stage("forward"):
+            pred = model(img)[0]
+
+        # Apply non-maximum suppression to the predictions, keeping the confident ones
+        with METRICS.stage("nms"):
+            pred = suppress(pred, non_max_suppression, conf_thres, classes, max_det)
 
-    # Resize the image
-    image = cv2.resize(image, new_size)
+    return pred, image, img, original_size
+
+
+def process_batch(
+    images: List[np.ndarray],
+    model: Any,
+    non_max_suppression: Any,
+    img_size: int,
+    conf_thres: float = CONF_THRESHOLD,
+    classes: Optional[List[int]] = None,
+    max_det: int = MAX_DETECTIONS,
+    copy: bool = True,
+) -> Tuple[List[torch.Tensor], List[np.ndarray], torch.Tensor, List[Tuple[int, int]]]:
+    """
+    Processes several images for object detection in a single forward pass.
 
-    # Convert the image to a tensor
-    img = torch.from_numpy(image.transpose((2, 0, 1)))
+    All the images must letterbox to the same shape (see letterbox_shape), so they can be
+    stacked into one batch tensor. Non-maximum suppression also runs once for the whole batch.
 
-    # Reshape and normalize the image
+    Parameters:
+    - images: The original images.
+    - model: The object detection model to use.
+    - non_max_suppression: The non-maximum suppression function to apply to the model's predictions.
+    - img_size: The letterboxed inference size, clamped to the shape of a traced model.
+    - conf_thres: The confidence above which a box is kept.
+    - classes: The classes to keep, or None to keep them all.
+    - max_det: The maximum number of detections kept per image.
+    - copy: Whether to return copies of the images to draw on, or the images themselves.
+
+    Returns:
+    - pred: The model's predictions after non-maximum suppression, one tensor per image.
+    - images: The images to draw on.
+    - img: The reshaped and normalized batch tensor.
+    - original_sizes: The original size of each image.
+    """
+
+    # Set the model's stride
+    stride = int(model.stride.max())
+
+    # Letterbox every image and stack them into a single (N, H, W, 3) array
+    img_size = inference_size(model, images[0].shape, img_size)
+    model_inputs = [letterbox(image, img_size, stride)[0] for image in images]
+    if len({model_input.shape for model_input in model_inputs}) > 1:
+        raise ValueError("All images of a batch must letterbox to the same shape")
+    batch = np.stack(model_inputs)
+
+    # Convert the batch to a tensor, then normalize it
+    img = torch.from_numpy(batch.transpose((0, 3, 1, 2)))
     img = img.float()
     img /= 255.0
-    if img.ndimension() == 3:
-        img = img.unsqueeze(0)
 
-    # Run the model on the image
-    pred = model(img)[0]
+    # Match the memory layout of the model's weights
+    if getattr(model, "channels_last", False):
+        img = img.contiguous(memory_format=torch.channels_last)
 
-    # Apply non-maximum suppression to the predictions
-    pred = non_max_suppression(pred)
+    # Run the model and non-maximum suppression once for the whole batch
+    with torch.inference_mode():
+        pred = model(img)[0]
+        pred = suppress(pred, non_max_suppression, conf_thres, classes, max_det)
 
-    return pred, image, img, original_size
+    return (
+        pred,
+        [image.copy() for image in images] if copy else images,
+        img,
+        [image.shape[:2] for image in images],
+    )
@@ -0,0 +1,297 @@
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+import numpy as np
+
+# Upper bounds, in seconds, of the buckets of the exported duration histograms
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Number of recent durations per stage the rolling percentiles are computed from
+WINDOW = 512
+
+
+class _Timer:
+    """
+    Times the block of a with statement and records it as a stage of the given metrics.
+    """
+
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics: "Metrics", name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    """
+    Does nothing, the timer handed out while the metrics are disabled.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """
+    A class used to record the duration of the stages of the hot path, and event counts.
+
+    Every stage keeps a rolling window of its last durations, for the live percentiles, and
+    a cumulative histogram, for the Prometheus export. The callbacks are called with the
+    name and duration of every observation. While the metrics are disabled, stage() hands
+    out a shared do-nothing timer and nothing is recorded, so the instrumentation costs a
+    single attribute check per stage.
+
+    Attributes
+    ----------
+    enabled : bool
+        Whether the stages and counts are recorded.
+
+    Methods
+    -------
+    stage(name)
+        Returns a context manager timing its block as the given stage.
+    observe(name, seconds)
+        Records a duration of the given stage.
+    count(name, value=1)
+        Increments a counter.
+    add_callback(callback)
+        Calls the callback with (name, seconds) on every observation.
+    snapshot()
+        Returns the rolling percentiles of the stages and the counters.
+    prometheus_text()
+        Returns the metrics in the Prometheus text exposition format.
+    write_prometheus(path)
+        Writes the Prometheus text to a file, atomically.
+    reset()
+        Forgets every observation and count.
+    """
+
+    def __init__(self, enabled: bool = False, window: int = WINDOW):
+        self.enabled = enabled
+        self.window = window
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[str, float], None]] = []
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forgets every observation and count.
+        """
+
+        with self._lock:
+            self._recent: Dict[str, Deque[float]] = {}
+            self._buckets: Dict[str, List[int]] = {}
+            self._sums: Dict[str, float] = {}
+            self._counts: Dict[str, int] = {}
+            self._counters: Dict[str, float] = {}
+
+    def stage(self, name: str):
+        """
+        Returns a context manager timing its block as the given stage.
+
+        Parameters:
+        - name: The name of the stage, such as "forward".
+        """
+
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def observe(self, name: str, seconds: float) -> None:
+        """
+        Records a duration of the given stage.
+
+        Parameters:
+        - name: The name of the stage.
+        - seconds: The duration, in seconds.
+        """
+
+        if not self.enabled:
+            return
+        with self._lock:
+            if name not in self._recent:
+                self._recent[name] = deque(maxlen=self.window)
+                self._buckets[name] = [0] * len(BUCKETS)
+                self._sums[name] = 0.0
+                self._counts[name] = 0
+            self._recent[name].append(seconds)
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    self._buckets[name][index] += 1
+                    break
+            self._sums[name] += seconds
+            self._counts[name] += 1
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback(name, seconds)
+
+    def count(self, name: str, value: float = 1) -> None:
+        """
+        Increments a counter, such as "frames", "faces" or "frames_dropped".
+        """
+
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def add_callback(self, callback: Callable[[str, float], None]) -> None:
+        """
+        Calls the callback with (name, seconds) on every observation.
+        """
+
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback: Callable[[str, float], None]) -> None:
+        """
+        Stops calling a callback added by add_callback.
+        """
+
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """
+        Returns the rolling percentiles of the stages and the counters.
+
+        Returns:
+        - A dictionary with "stages", mapping each stage to the count, mean, p50, p95 and
+          max of its recent durations in milliseconds, and "counters".
+        """
+
+        with self._lock:
+            recent = {name: np.array(values) for name, values in self._recent.items()}
+            counts = dict(self._counts)
+            counters = dict(self._counters)
+        stages = {}
+        for name, values in recent.items():
+            values = values * 1000
+            stages[name] = {
+                "count": counts[name],
+                "mean_ms": float(values.mean()),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                "max_ms": float(values.max()),
+            }
+        return {"stages": stages, "counters": counters}
+
+    def prometheus_text(self, prefix: str = "face_sight") -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format.
+
+        Parameters:
+        - prefix: The prefix of the metric names.
+
+        Returns:
+        - A histogram of the stage durations, with one series per stage, and one counter per count.
+        """
+
+        with self._lock:
+            buckets = {name: list(values) for name, values in self._buckets.items()}
+            sums = dict(self._sums)
+            counts = dict(self._counts)
+            counters = dict(self._counters)
+
+        lines = [
+            f"# HELP {prefix}_stage_seconds Duration of the stages of the hot path.",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        for name in sorted(buckets):
+            cumulative = 0
+            for bound, value in zip(BUCKETS, buckets[name]):
+                cumulative += value
+                lines.append(
+                    f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}'
+                )
+            lines.append(
+                f'{prefix}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {counts[name]}'
+            )
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {sums[name]}')
+            lines.append(
+                f'{prefix}_stage_seconds_count{{stage="{name}"}} {counts[name]}'
+            )
+        for name in sorted(counters):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {counters[name]}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        """
+        Writes the Prometheus text to a file, atomically, for the node exporter's textfile collector.
+        """
+
+        # A temp file of its own per writer, in the same directory so the rename is atomic:
+        # threads and worker processes may export to the same path at once
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path) or ".", prefix=".metrics-", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.prometheus_text())
+            # mkstemp creates the file readable by its owner only, and the collector may
+            # run as another user
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+
+class PrometheusFileExporter:
+    """
+    A metrics callback that rewrites a Prometheus text file at most every interval seconds.
+    """
+
+    def __init__(self, metrics: Metrics, path: str, interval: float = 5.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, name: str, seconds: float) -> None:
+        now = time.monotonic()
+        # Only one of the threads passing the interval at once writes the file
+        with self._lock:
+            if now - self._last < self.interval:
+                return
+            self._last = now
+        try:
+            self.metrics.write_prometheus(self.path)
+        except OSError:
+            # Exporting the metrics must never fail the detection that is being timed
+            pass
+
+
+# The metrics of the process, disabled unless FACE_SIGHT_METRICS is set or the page enables them
+METRICS = Metrics(enabled=os.environ.get("FACE_SIGHT_METRICS", "") not in ("", "0"))
+
+# Path of the Prometheus text file kept up to date while the metrics are enabled, if any
+METRICS_FILE: Optional[str] = os.environ.get("FACE_SIGHT_METRICS_FILE") or None
+if METRICS_FILE:
+    METRICS.add_callback(PrometheusFileExporter(METRICS, METRICS_FILE))
@@ -1,21 +1,400 @@
-import cv2
+import copy
+import hashlib
+import importlib
+import json
 import os
 import sys
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
-sys.path.insert(
-    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../yolov7"))
+import numpy as np
+import torch
+
+from .ops import non_max_suppression, plot_one_box, scale_coords
+from .settings import ARTIFACT_DIR, BACKEND, NUM_THREADS, TRACE_SIZE
+
+# Directory of the yolov7 sources, only needed to unpickle a PyTorch checkpoint or build
+# a model from its configuration. The exported backends and model packages run without them.
+YOLOV7_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../yolov7"))
+
+# Input shapes (height, width) the model is warmed up with after loading.
+# They cover the usual webcam frame and a square upload once cropped to the stride.
+WARMUP_SHAPES = ((480, 640), (640, 640))
+
+# Files of a model package directory: the metadata, and the model file it points to
+PACKAGE_META = "meta.json"
+PACKAGE_FORMATS = {"torchscript": "model.torchscript", "onnx": "model.onnx"}
+
+# Inference backends load_model can build
+BACKENDS = ("torch", "onnx", "torchscript", "package")
+
+# Backend used for each model file extension when none is given
+DEFAULT_BACKENDS = {".pt": "torch", ".onnx": "onnx"}
+
+# yolov7 configuration of the random stand-in model built when no checkpoint is available
+RANDOM_MODEL_CFG = os.path.join(
+    os.path.dirname(__file__), "../yolov7/cfg/training/yolov7-tiny.yaml"
 )
-from models.experimental import attempt_load
-from utils.general import scale_coords, non_max_suppression
-from utils.plots import plot_one_box
 
+# Process-wide registry of loaded models, keyed by the absolute checkpoint path and backend
+_MODEL_REGISTRY: Dict[Tuple[str, Optional[str]], Tuple[Any, ...]] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _import_yolov7(module: str) -> Any:
+    """
+    Imports a module of the yolov7 sources, putting them on the path on first use.
+
+    Only unpickling a PyTorch checkpoint and building a model from its configuration need
+    the sources, so importing this module neither touches sys.path nor loads them.
+    """
+
+    if YOLOV7_DIR not in sys.path:
+        sys.path.insert(0, YOLOV7_DIR)
+    return importlib.import_module(module)
+
+
+class OnnxModel:
+    """
+    Runs an exported ONNX model with ONNX Runtime behind the interface of the torch model.
+
+    Calling it with an image tensor returns a tuple whose first element is the raw prediction
+    tensor, and it exposes the stride and names attributes, so process_image and the rest of
+    the pipeline cannot tell it apart from the PyTorch model.
+
+    Attributes
+    ----------
+    session : onnxruntime.InferenceSession
+        The ONNX Runtime session running the model on the CPU.
+    onnx_path : str
+        The path of the ONNX model.
+    stride : torch.Tensor
+        The strides of the model's detection layers.
+    names : list
+        The names of the classes that the model can predict.
+    """
+
+    channels_last = False
+
+    def __init__(self, onnx_path: str, num_threads: Optional[int] = NUM_THREADS):
+        import onnxruntime as ort
+
+        self.onnx_path = onnx_path
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            onnx_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+        # The stride and class names are stored in the model's metadata by export_onnx
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.stride = torch.tensor(json.loads(metadata["stride"]))
+        self.names = json.loads(metadata["names"])
+
+    def __call__(self, img: torch.Tensor) -> Tuple[torch.Tensor]:
+        pred = self.session.run(
+            None, {self.input_name: np.ascontiguousarray(img.numpy())}
+        )[0]
+        return (torch.from_numpy(pred),)
+
+
+class _PredictionOutput(torch.nn.Module):
+    """
+    Wraps a YOLOv7 model so that it only returns the prediction tensor when exported,
+    leaving out the raw feature maps of the detection layers.
+    """
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, img: torch.Tensor) -> torch.Tensor:
+        return self.model(img)[0]
+
+
+def export_onnx(
+    model_path: str, onnx_path: str, img_size: int = 640, opset: int = 13
+) -> str:
+    """
+    Exports a PyTorch checkpoint to ONNX, with dynamic batch, height and width axes.
+
+    Parameters:
+    - model_path: The path to the pre-trained PyTorch model.
+    - onnx_path: The path to write the ONNX model to.
+    - img_size: The size of the example input used to trace the model.
+    - opset: The ONNX opset version to export with.
+
+    Returns:
+    - onnx_path: The path of the exported model.
+    """
+
+    import onnx
+
+    model, names, _, _, _ = load_model(model_path)
+    model = copy.deepcopy(model).eval()
 
-def load_model(model_path):
+    # Reset the detection grids so that tracing records how they are built from the input
+    # shape, instead of freezing the grids cached by a previous forward pass
+    detect = model.model[-1]
+    detect.grid = [torch.zeros(1)] * detect.nl
+
+    with torch.no_grad():
+        torch.onnx.export(
+            _PredictionOutput(model),
+            torch.zeros(1, 3, img_size, img_size),
+            onnx_path,
+            opset_version=opset,
+            input_names=["images"],
+            output_names=["output"],
+            dynamic_axes={
+                "images": {0: "batch", 2: "height", 3: "width"},
+                "output": {0: "batch", 1: "anchors"},
+            },
+        )
+
+    # Store what the pipeline needs besides the graph in the model's metadata
+    onnx_model = onnx.load(onnx_path)
+    for key, value in (
+        ("stride", json.dumps(model.stride.tolist())),
+        ("names", json.dumps(list(names))),
+    ):
+        entry = onnx_model.metadata_props.add()
+        entry.key, entry.value = key, value
+    onnx.save(onnx_model, onnx_path)
+    return onnx_path
+
+
+class TracedModel:
+    """
+    Runs a traced TorchScript artifact behind the interface of the torch model.
+
+    The artifact is traced at a fixed input shape. Smaller inputs, such as the letterboxed
+    images of process_image, are padded on the bottom and right up to that shape, which does
+    not move the boxes, and the predictions centred in that padding are discarded.
+
+    Attributes
+    ----------
+    module : torch.jit.ScriptModule
+        The traced and frozen model.
+    stride : torch.Tensor
+        The strides of the model's detection layers.
+    names : list
+        The names of the classes that the model can predict.
+    shape : tuple
+        The (height, width) input shape the model was traced at.
+    """
+
+    channels_last = False
+
+    def __init__(self, module: torch.jit.ScriptModule, metadata: Dict[str, Any]):
+        self.module = module
+        self.stride = torch.tensor(metadata["stride"])
+        self.names = metadata["names"]
+        self.shape = tuple(metadata["shape"])
+
+    def __call__(self, img: torch.Tensor) -> Tuple[torch.Tensor]:
+        height, width = img.shape[2:]
+        if height > self.shape[0] or width > self.shape[1]:
+            raise ValueError(
+                f"Input of {height}x{width} is larger than the traced shape "
+                f"{self.shape[0]}x{self.shape[1]}, use a smaller inference size"
+            )
+        if (height, width) == self.shape:
+            return (self.module(img),)
+
+        img = torch.nn.functional.pad(
+            img, (0, self.shape[1] - width, 0, self.shape[0] - height), value=114 / 255
+        )
+        pred = self.module(img)
+        # Drop the predictions centred in the padding, which the input never had
+        pred[..., 4] *= (pred[..., 0] < width) & (pred[..., 1] < height)
+        return (pred,)
+
+
+def checkpoint_hash(model_path: str) -> str:
+    """
+    Returns the SHA-256 digest of a checkpoint file.
+    """
+
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_traced_model(
+    model_path: str,
+    artifact_path: str,
+    shape: Tuple[int, int],
+    metadata: Dict[str, Any],
+) -> Dict[str, Any]:
+    """
+    Traces a PyTorch checkpoint at a fixed input shape and saves the frozen result.
+
+    Parameters:
+    - model_path: The path to the pre-trained PyTorch model.
+    - artifact_path: The path to write the TorchScript artifact to.
+    - shape: The (height, width) input shape to trace the model at.
+    - metadata: The artifact's metadata, completed with the stride and names and saved inside the archive.
+
+    Returns:
+    - The completed metadata.
+    """
+
+    model, names, _, _, _ = load_model(model_path, "torch")
+    model = prepare_for_inference(model, num_threads=None, channels_last=False)
+    metadata = dict(metadata, stride=model.stride.tolist(), names=list(names))
+
+    with torch.inference_mode(False), torch.no_grad():
+        traced = torch.jit.trace(
+            _PredictionOutput(model), torch.zeros(1, 3, *shape), check_trace=False
+        )
+        traced = torch.jit.freeze(traced.eval())
+
+    # Write to a temporary file first so that a concurrent load never sees a partial artifact
+    os.makedirs(os.path.dirname(os.path.abspath(artifact_path)), exist_ok=True)
+    temporary_path = f"{artifact_path}.{os.getpid()}.tmp"
+    torch.jit.save(
+        traced, temporary_path, _extra_files={"meta.json": json.dumps(metadata)}
+    )
+    os.replace(temporary_path, artifact_path)
+    return metadata
+
+
+def load_traced_model(
+    model_path: str, img_size: int = TRACE_SIZE, artifact_dir: str = ARTIFACT_DIR
+) -> TracedModel:
+    """
+    Loads the traced artifact of a checkpoint, building it first if it is missing or stale.
+
+    Artifacts are named after the checkpoint's hash and the traced input shape, so editing
+    or replacing the checkpoint leads to a new artifact. An artifact written by another
+    torch version is rebuilt as well. Loading an artifact does not unpickle the checkpoint
+    or run any yolov7 model code.
+
+    Parameters:
+    - model_path: The path to the pre-trained PyTorch model.
+    - img_size: The square input size to trace the model at.
+    - artifact_dir: The directory where the artifacts are cached.
+
+    Returns:
+    - The loaded TracedModel.
+    """
+
+    shape = (img_size, img_size)
+    digest = checkpoint_hash(model_path)
+    artifact_path = os.path.join(
+        artifact_dir, f"{digest[:16]}_{shape[0]}x{shape[1]}.torchscript"
+    )
+    expected = {"checkpoint": digest, "shape": list(shape), "torch": torch.__version__}
+
+    extra_files = {"meta.json": ""}
+    if os.path.exists(artifact_path):
+        module = torch.jit.load(
+            artifact_path, map_location="cpu", _extra_files=extra_files
+        )
+        metadata = json.loads(extra_files["meta.json"] or "{}")
+        if all(metadata.get(key) == value for key, value in expected.items()):
+            return TracedModel(module, metadata)
+
+    build_traced_model(model_path, artifact_path, shape, expected)
+    module = torch.jit.load(artifact_path, map_location="cpu", _extra_files=extra_files)
+    return TracedModel(module, json.loads(extra_files["meta.json"]))
+
+
+def build_model_package(
+    model_path: str,
+    package_dir: str,
+    model_format: str = "torchscript",
+    img_size: int = TRACE_SIZE,
+) -> str:
+    """
+    Builds a self-contained model package from a PyTorch checkpoint.
+
+    The package is a directory holding the exported model and a meta.json file with the
+    class names, strides and input shape. Loading it needs neither the checkpoint nor the
+    yolov7 sources, so it can be built once and shipped to machines without network access.
+
+    Parameters:
+    - model_path: The path to the pre-trained PyTorch model.
+    - package_dir: The directory to write the package to.
+    - model_format: "torchscript" for a traced artifact at a fixed input size, or "onnx" for
+      an ONNX model with dynamic input sizes.
+    - img_size: The square input size to trace the model at, and the largest inference
+      size the torchscript package accepts.
+
+    Returns:
+    - package_dir: The directory of the package.
+    """
+
+    if model_format not in PACKAGE_FORMATS:
+        raise ValueError(f"Unknown model package format: {model_format}")
+
+    os.makedirs(package_dir, exist_ok=True)
+    model_file = os.path.join(package_dir, PACKAGE_FORMATS[model_format])
+    metadata = {
+        "format": model_format,
+        "file": PACKAGE_FORMATS[model_format],
+        "checkpoint": checkpoint_hash(model_path),
+        "torch": torch.__version__,
+    }
+    if model_format == "torchscript":
+        shape = (img_size, img_size)
+        metadata = build_traced_model(
+            model_path, model_file, shape, dict(metadata, shape=list(shape))
+        )
+    else:
+        export_onnx(model_path, model_file, img_size)
+        model = OnnxModel(model_file)
+        metadata.update(stride=model.stride.tolist(), names=list(model.names))
+
+    # The metadata is written last, so an interrupted build is never mistaken for a package
+    temporary_path = os.path.join(package_dir, f"{PACKAGE_META}.tmp")
+    with open(temporary_path, "w") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(temporary_path, os.path.join(package_dir, PACKAGE_META))
+    return package_dir
+
+
+def load_model_package(package_dir: str) -> Any:
+    """
+    Loads the model of a package built by build_model_package.
+
+    Parameters:
+    - package_dir: The directory of the package.
+
+    Returns:
+    - The loaded TracedModel or OnnxModel.
+    """
+
+    meta_path = os.path.join(package_dir, PACKAGE_META)
+    if not os.path.exists(meta_path):
+        raise FileNotFoundError(
+            f"{package_dir} is not a model package, {PACKAGE_META} is missing"
+        )
+    with open(meta_path) as f:
+        metadata = json.load(f)
+
+    model_file = os.path.join(package_dir, metadata["file"])
+    if metadata["format"] == "onnx":
+        return OnnxModel(model_file)
+    if metadata["format"] == "torchscript":
+        return TracedModel(torch.jit.load(model_file, map_location="cpu"), metadata)
+    raise ValueError(f"Unknown model package format: {metadata['format']}")
+
+
+def load_model(model_path, backend: Optional[str] = None):
     """
     Loads a pre-trained model from the given path.
 
     Parameters:
     - model_path: The path to the pre-trained model.
+    - backend: The inference backend, "torch", "onnx", "torchscript" or "package". If None,
+      it is chosen from the file extension, and directories are loaded as model packages.
 
     Returns:
     - model: The loaded model.
@@ -25,6 +404,205 @@ def load_model(model_path):
     - plot_one_box: A function to draw a bounding box on the image.
     """
 
+    if backend is None and os.path.isdir(model_path):
+        backend = "package"
+    elif backend is None:
+        backend = DEFAULT_BACKENDS.get(os.path.splitext(model_path)[1], "torch")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+
+    if backend == "onnx":
+        model = OnnxModel(model_path)
+        return model, model.names, scale_coords, non_max_suppression, plot_one_box
+    if backend == "torchscript":
+        model = load_traced_model(model_path)
+        return model, model.names, scale_coords, non_max_suppression, plot_one_box
+    if backend == "package":
+        model = load_model_package(model_path)
+        return model, model.names, scale_coords, non_max_suppression, plot_one_box
+
+    # Unpickling the checkpoint needs the yolov7 model classes
+    attempt_load = _import_yolov7("models.experimental").attempt_load
     model = attempt_load(model_path)
     names = model.module.names if hasattr(model, "module") else model.names
     return model, names, scale_coords, non_max_suppression, plot_one_box
+
+
+def random_model(cfg_path: str = RANDOM_MODEL_CFG, names: Sequence[str] = ("face",)):
+    """
+    Builds a randomly initialized yolov7 model, a stand-in for the checkpoint in benchmarks.
+
+    The model has the layers, stride and output shapes of the given yolov7 configuration,
+    so it costs as much to run as a trained model of that configuration. Its boxes are
+    meaningless. Its Conv and BatchNorm layers are fused, like attempt_load does.
+
+    Parameters:
+    - cfg_path: The yolov7 model configuration (yaml) to build.
+    - names: The names of the classes.
+
+    Returns:
+    - The same tuple as load_model.
+    """
+
+    Model = _import_yolov7("models.yolo").Model
+
+    model = Model(cfg_path, ch=3, nc=len(names))
+    model.names = list(names)
+    # The implicit layers of the head are folded into the weights in place
+    with torch.no_grad():
+        model.fuse().eval()
+    return model, model.names, scale_coords, non_max_suppression, plot_one_box
+
+
+def compare_backends(
+    reference: Any,
+    candidate: Any,
+    images: List[np.ndarray],
+    non_max_suppression: Any,
+    img_size: Optional[int] = 640,
+    iou_threshold: float = 0.9,
+) -> Dict[str, float]:
+    """
+    Checks that two backends find the same boxes on the same images.
+
+    Every box of the reference model is matched with the candidate box that overlaps it the
+    most. A box agrees when that overlap is at least iou_threshold.
+
+    Parameters:
+    - reference: The reference model, usually the PyTorch model.
+    - candidate: The model to check, for instance an OnnxModel.
+    - images: The images to run both models on.
+    - non_max_suppression: The non-maximum suppression function to apply to the model's predictions.
+    - img_size: The letterboxed inference size, or None to run on the whole images.
+    - iou_threshold: The minimum overlap for two boxes to agree.
+
+    Returns:
+    - A dictionary with the number of reference and candidate boxes, the fraction of
+      reference boxes that agree, and the largest coordinate difference of agreeing boxes in pixels.
+    """
+
+    from torchvision.ops import box_iou
+
+    from .image_processor import process_image
+
+    reference_boxes, candidate_boxes, agreeing, max_difference = 0, 0, 0, 0.0
+    for image in images:
+        ref_det = process_image(image, reference, non_max_suppression, img_size)[0][0]
+        cand_det = process_image(image, candidate, non_max_suppression, img_size)[0][0]
+        reference_boxes += len(ref_det)
+        candidate_boxes += len(cand_det)
+        if not len(ref_det) or not len(cand_det):
+            continue
+
+        # Match every reference box with its most overlapping candidate box
+        iou, best = box_iou(ref_det[:, :4], cand_det[:, :4]).max(1)
+        matched = iou >= iou_threshold
+        agreeing += int(matched.sum())
+        if matched.any():
+            difference = (ref_det[matched, :4] - cand_det[best[matched], :4]).abs()
+            max_difference = max(max_difference, float(difference.max()))
+
+    return {
+        "reference_boxes": reference_boxes,
+        "candidate_boxes": candidate_boxes,
+        "agreement": agreeing / reference_boxes if reference_boxes else 1.0,
+        "max_box_difference": max_difference,
+    }
+
+
+def prepare_for_inference(
+    model: Any, num_threads: Optional[int] = NUM_THREADS, channels_last: bool = True
+) -> Any:
+    """
+    Puts a loaded model into CPU inference mode.
+
+    The model is switched to evaluation mode, its parameters stop tracking gradients and,
+    optionally, its weights are converted to the channels_last memory layout that the
+    oneDNN convolution kernels prefer. The Conv and BatchNorm layers are already fused by
+    attempt_load. process_image runs the forward pass under torch.inference_mode and feeds
+    channels_last inputs to models prepared this way.
+
+    Parameters:
+    - model: The object detection model to prepare.
+    - num_threads: The number of torch intra-op threads to use, or None to keep the current setting.
+    - channels_last: Whether to convert the weights to the channels_last memory layout.
+
+    Returns:
+    - model: The same model, ready for inference.
+    """
+
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    model.eval()
+    model.requires_grad_(False)
+    if channels_last:
+        model.to(memory_format=torch.channels_last)
+    # Remember the layout so process_image can lay the input tensor out the same way
+    model.channels_last = channels_last
+    return model
+
+
+def warmup_model(model: Any, shapes: Sequence[Tuple[int, int]] = WARMUP_SHAPES) -> None:
+    """
+    Runs one forward pass per input shape so the first real prediction does not pay
+    for lazy initialisation (anchor grids, allocator pools, kernel selection).
+
+    Parameters:
+    - model: The object detection model to warm up.
+    - shapes: The (height, width) input shapes to run, rounded down to the model's stride.
+    """
+
+    stride = int(model.stride.max())
+    memory_format = (
+        torch.channels_last
+        if getattr(model, "channels_last", False)
+        else torch.contiguous_format
+    )
+    with torch.inference_mode():
+        for height, width in shapes:
+            # Use the same stride-multiple sizes as process_image, which pads up to them
+            height, width = height + -height % stride, width + -width % stride
+            model(torch.zeros(1, 3, height, width).to(memory_format=memory_format))
+
+
+def get_model(
+    model_path,
+    warmup_shapes: Sequence[Tuple[int, int]] = WARMUP_SHAPES,
+    backend: Optional[str] = BACKEND,
+):
+    """
+    Returns the model for the given path, loading it only once per process.
+
+    The first call loads the checkpoint (attempt_load fuses the Conv and BatchNorm layers),
+    puts the model into CPU inference mode and warms it up. Every later call, from any Streamlit rerun,
+    session or VideoTransformer, gets the very same instance back.
+
+    Parameters:
+    - model_path: The path to the pre-trained model.
+    - warmup_shapes: The (height, width) input shapes to warm the model up with.
+    - backend: The inference backend, or None to choose it from the file extension.
+
+    Returns:
+    - The same tuple as load_model: model, names, scale_coords, non_max_suppression and plot_one_box.
+    """
+
+    key = (os.path.abspath(model_path), backend)
+    # Hold the lock while loading so concurrent sessions wait for one load instead of racing
+    with _REGISTRY_LOCK:
+        if key not in _MODEL_REGISTRY:
+            model, names, scale_coords, non_max_suppression, plot_one_box = load_model(
+                model_path, backend
+            )
+            # attempt_load has already fused the Conv and BatchNorm layers (fusing twice would
+            # fold the implicit layers of IDetect into the head a second time)
+            if isinstance(model, torch.nn.Module):
+                model = prepare_for_inference(model)
+            warmup_model(model, warmup_shapes)
+            _MODEL_REGISTRY[key] = (
+                model,
+                names,
+                scale_coords,
+                non_max_suppression,
+                plot_one_box,
+            )
+        return _MODEL_REGISTRY[key]
@@ -0,0 +1,182 @@
+import random
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import torch
+
+# Box operations of the detection pipeline. They behave like the functions of the same
+# names in yolov7's utils, so the exported models (ONNX, TorchScript, model packages) run
+# without the yolov7 sources, and no module of the pipeline needs them at import time.
+
+# Boxes of different classes are offset by this many pixels so one NMS call keeps them apart
+MAX_WH = 4096
+
+# Maximum number of candidate boxes going into NMS, the most confident first
+MAX_NMS = 30000
+
+
+def xywh2xyxy(x: torch.Tensor) -> torch.Tensor:
+    """
+    Converts (n, 4) boxes from [center x, center y, width, height] to [x1, y1, x2, y2].
+    """
+
+    y = x.clone()
+    y[:, 0] = x[:, 0] - x[:, 2] / 2
+    y[:, 1] = x[:, 1] - x[:, 3] / 2
+    y[:, 2] = x[:, 0] + x[:, 2] / 2
+    y[:, 3] = x[:, 1] + x[:, 3] / 2
+    return y
+
+
+def non_max_suppression(
+    prediction: torch.Tensor,
+    conf_thres: float = 0.25,
+    iou_thres: float = 0.45,
+    classes: Optional[List[int]] = None,
+    agnostic: bool = False,
+    multi_label: bool = False,
+    max_det: int = 300,
+) -> List[torch.Tensor]:
+    """
+    Applies non-maximum suppression to the raw predictions of a batch of images.
+
+    Parameters:
+    - prediction: The (batch, anchors, 5 + classes) raw predictions of the model.
+    - conf_thres: The confidence above which a box is kept.
+    - iou_thres: The overlap above which the less confident of two boxes is removed.
+    - classes: The classes to keep, or None to keep them all.
+    - agnostic: Whether boxes of different classes suppress each other.
+    - multi_label: Whether a box can be kept once per class above conf_thres.
+    - max_det: The maximum number of detections kept per image.
+
+    Returns:
+    - One (n, 6) tensor of [x1, y1, x2, y2, conf, cls] rows per image, the most confident first.
+    """
+
+    from torchvision.ops import nms
+
+    nc = prediction.shape[2] - 5
+    multi_label &= nc > 1
+    candidates = prediction[..., 4] > conf_thres
+
+    output = [torch.zeros((0, 6), device=prediction.device)] * prediction.shape[0]
+    for index, x in enumerate(prediction):
+        x = x[candidates[index]]
+        if not x.shape[0]:
+            continue
+
+        if nc == 1:
+            # With a single class, the class confidence is meaningless
+            x[:, 5:] = x[:, 4:5]
+        else:
+            # The confidence is the objectness times the class confidence
+            x[:, 5:] *= x[:, 4:5]
+
+        box = xywh2xyxy(x[:, :4])
+        if multi_label:
+            i, j = (x[:, 5:] > conf_thres).nonzero(as_tuple=False).T
+            x = torch.cat((box[i], x[i, j + 5, None], j[:, None].float()), 1)
+        else:
+            conf, j = x[:, 5:].max(1, keepdim=True)
+            x = torch.cat((box, conf, j.float()), 1)[conf.view(-1) > conf_thres]
+
+        if classes is not None:
+            x = x[(x[:, 5:6] == torch.tensor(classes, device=x.device)).any(1)]
+        if not x.shape[0]:
+            continue
+        if x.shape[0] > MAX_NMS:
+            x = x[x[:, 4].argsort(descending=True)[:MAX_NMS]]
+
+        offsets = x[:, 5:6] * (0 if agnostic else MAX_WH)
+        keep = nms(x[:, :4] + offsets, x[:, 4], iou_thres)[:max_det]
+        output[index] = x[keep]
+    return output
+
+
+def clip_coords(boxes: torch.Tensor, img_shape: Tuple[int, ...]) -> None:
+    """
+    Clips (n, 4+) [x1, y1, x2, y2] boxes to an image of the given (height, width), in place.
+    """
+
+    boxes[:, 0].clamp_(0, img_shape[1])
+    boxes[:, 1].clamp_(0, img_shape[0])
+    boxes[:, 2].clamp_(0, img_shape[1])
+    boxes[:, 3].clamp_(0, img_shape[0])
+
+
+def scale_coords(
+    img1_shape: Tuple[int, ...],
+    coords: torch.Tensor,
+    img0_shape: Tuple[int, ...],
+    ratio_pad: Optional[Tuple[Tuple[float, float], Tuple[float, float]]] = None,
+) -> torch.Tensor:
+    """
+    Rescales [x1, y1, x2, y2] boxes from a letterboxed image back to the original image, in place.
+
+    Parameters:
+    - img1_shape: The (height, width) of the letterboxed image.
+    - coords: The (n, 4+) boxes in the letterboxed image.
+    - img0_shape: The (height, width) of the original image.
+    - ratio_pad: The letterbox's ((ratio, ratio), (pad w, pad h)), or None to compute them from the shapes.
+
+    Returns:
+    - The same boxes, in the original image's coordinates and clipped to it.
+    """
+
+    if ratio_pad is None:
+        gain = min(img1_shape[0] / img0_shape[0], img1_shape[1] / img0_shape[1])
+        pad = (
+            (img1_shape[1] - img0_shape[1] * gain) / 2,
+            (img1_shape[0] - img0_shape[0] * gain) / 2,
+        )
+    else:
+        gain = ratio_pad[0][0]
+        pad = ratio_pad[1]
+
+    coords[:, [0, 2]] -= pad[0]
+    coords[:, [1, 3]] -= pad[1]
+    coords[:, :4] /= gain
+    clip_coords(coords, img0_shape)
+    return coords
+
+
+def plot_one_box(
+    x: Sequence[float],
+    img: np.ndarray,
+    color: Optional[Sequence[int]] = None,
+    label: Optional[str] = None,
+    line_thickness: Optional[int] = 3,
+) -> None:
+    """
+    Draws a box, and its label on top of it, on the image in place.
+
+    Parameters:
+    - x: The [x1, y1, x2, y2] box.
+    - img: The image to draw on.
+    - color: The color of the box, or None for a random one.
+    - label: The text written above the box, if any.
+    - line_thickness: The thickness of the lines, or None to scale it with the image.
+    """
+
+    thickness = line_thickness or round(0.002 * (img.shape[0] + img.shape[1]) / 2) + 1
+    color = color or [random.randint(0, 255) for _ in range(3)]
+    c1, c2 = (int(x[0]), int(x[1])), (int(x[2]), int(x[3]))
+    cv2.rectangle(img, c1, c2, color, thickness=thickness, lineType=cv2.LINE_AA)
+    if label:
+        font_thickness = max(thickness - 1, 1)
+        text_size = cv2.getTextSize(
+            label, 0, fontScale=thickness / 3, thickness=font_thickness
+        )[0]
+        c2 = c1[0] + text_size[0], c1[1] - text_size[1] - 3
+        cv2.rectangle(img, c1, c2, color, -1, cv2.LINE_AA)
+        cv2.putText(
+            img,
+            label,
+            (c1[0], c1[1] - 2),
+            0,
+            thickness / 3,
+            [225, 255, 255],
+            thickness=font_thickness,
+            lineType=cv2.LINE_AA,
+        )
@@ -1,8 +1,18 @@
 from .model_loader import load_model
-from .image_processor import process_image
-from .box_drawer import draw_boxes
-from typing import List, Tuple, Callable, Any, Optional
+from .image_processor import (
+    inference_size,
+    letterbox_shape,
+    process_batch,
+    process_image,
+)
+from .box_drawer import draw_boxes, draw_detections, select_detections
+from .metrics import METRICS
+from .result_cache import ResultCache
+from .tiling import TILE_SIZE, detect_tiled
+from collections import defaultdict
+from typing import Dict, List, Tuple, Callable, Any, Optional
 import numpy as np
+import torch
 
 
 def predict(
@@ -17,9 +27,13 @@ def predict(
     background: str,
     color: str = "#56ecd5",
     image_replacement: Optional[np.ndarray] = None,
+    img_size: Optional[int] = None,
+    cache: Optional[ResultCache] = None,
+    model_key: Optional[str] = None,
+    tiled: bool = False,
 ) -> Tuple[
     Optional[List[np.ndarray]],
-    Optional[List[Tuple[int, int, int, int]]],
+    Optional[np.ndarray],
     Optional[np.ndarray],
 ]:
     """
@@ -37,35 +51,168 @@ def predict(
     - background: The desired background color in hexadecimal format.
     - color: The desired color for the faces in hexadecimal format.
     - image_replacement: The replacement image as a numpy array.
+    - img_size: The letterboxed inference size, or None to run on the whole image padded to the model's stride.
+    - cache: A ResultCache to reuse the detections of an image already processed. The model
+      then only runs for new images, or another model or inference size, and changing the
+      strategies or colors only renders the image again.
+    - model_key: An identifier of the model for the cache, such as the one returned by model_id.
+    - tiled: Whether to detect the faces at full resolution on overlapping tiles (see
+      detect_tiled), for the small faces of large photos. img_size is then ignored.
 
     Returns:
     - faces: The list of detected faces.
-    - boxes: The list of bounding boxes for each detected face.
+    - boxes: The float32 (N, 6) array of [x1, y1, x2, y2, conf, cls] detections.
     - image_with_boxes: The image with the bounding boxes drawn and the strategies applied.
     """
 
     if image is None:
         print("Error: Could not read image")
         return None, None, None
+    elif cache is not None or tiled:
+        with METRICS.stage("predict"):
+            # The tiled detections are cached apart from those of any inference size
+            size_key = f"tiled-{TILE_SIZE}" if tiled else img_size
+            key = cache.key(image, model_key, size_key) if cache is not None else None
+            boxes = cache.get(key) if cache is not None else None
+            if boxes is None:
+                if tiled:
+                    boxes = detect_tiled(
+                        image, model, non_max_suppression, scale_coords
+                    )
+                else:
+                    # The predictions are inference tensors, rescaled in place
+                    with torch.inference_mode():
+                        pred, _, processed_image, _ = process_image(
+                            image, model, non_max_suppression, img_size, copy=False
+                        )
+                        boxes = select_detections(
+                            pred, processed_image, image.shape, scale_coords
+                        )
+                if cache is not None:
+                    boxes = cache.put(key, boxes)
+
+            # Render a copy of the image with the detections
+            image_with_boxes = draw_detections(
+                image.copy(),
+                boxes,
+                names,
+                faces,
+                plot_one_box,
+                strategies,
+                background,
+                color,
+                image_replacement,
+            )
+        METRICS.count("frames")
+        METRICS.count("faces", len(boxes))
+        return faces, boxes, image_with_boxes
     else:
-        # Process the image
-        pred, image, processed_image, original_size = process_image(
-            image, model, non_max_suppression
-        )
-
-        # Draw boxes on the image
-        faces, boxes, image_with_boxes = draw_boxes(
-            pred,
-            image,
-            processed_image,
-            names,
-            original_size,
-            faces,
-            scale_coords,
-            plot_one_box,
-            strategies,
-            background,
-            color,
-            image_replacement,
-        )
+        # The predictions are inference tensors, so rescaling them in place in draw_boxes
+        # has to happen in inference mode as well
+        with METRICS.stage("predict"), torch.inference_mode():
+            # Process the image
+            pred, image, processed_image, original_size = process_image(
+                image, model, non_max_suppression, img_size
+            )
+
+            # Draw boxes on the image
+            faces, boxes, image_with_boxes = draw_boxes(
+                pred,
+                image,
+                processed_image,
+                names,
+                original_size,
+                faces,
+                scale_coords,
+                plot_one_box,
+                strategies,
+                background,
+                color,
+                image_replacement,
+            )
+        METRICS.count("frames")
+        METRICS.count("faces", len(boxes))
         return faces, boxes, image_with_boxes
+
+
+def predict_batch(
+    images: List[np.ndarray],
+    model: Any,
+    names: List[str],
+    scale_coords: Callable,
+    non_max_suppression: Callable,
+    plot_one_box: Callable,
+    strategies: List[str],
+    background: str,
+    color: str = "#56ecd5",
+    image_replacement: Optional[np.ndarray] = None,
+    img_size: int = 640,
+    batch_size: int = 8,
+) -> List[Tuple[List[np.ndarray], np.ndarray, np.ndarray]]:
+    """
+    Predicts the bounding boxes for the detected faces in many images and applies various strategies.
+
+    The images are grouped by letterboxed shape, and each group is split into batches of
+    at most batch_size images that go through the model and non-maximum suppression together.
+    Larger batches give more throughput at the cost of memory.
+
+    Parameters:
+    - images: The original images.
+    - model: The object detection model to use.
+    - names: The names of the classes.
+    - scale_coords: The function to rescale the coordinates to the original image size.
+    - non_max_suppression: The non-maximum suppression function to apply to the model's predictions.
+    - plot_one_box: The function to draw a bounding box on the image.
+    - strategies: A list of strategies to apply to the images.
+    - background: The desired background color in hexadecimal format.
+    - color: The desired color for the faces in hexadecimal format.
+    - image_replacement: The replacement image as a numpy array.
+    - img_size: The letterboxed inference size.
+    - batch_size: The maximum number of images per forward pass.
+
+    Returns:
+    - A list with one (faces, boxes, image_with_boxes) tuple per image, in the input order.
+    """
+
+    stride = int(model.stride.max())
+
+    # Group the image indices by the shape of their letterboxed model input, at the size
+    # process_batch letterboxes them to
+    buckets: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+    for index, image in enumerate(images):
+        size = inference_size(model, image.shape, img_size)
+        buckets[letterbox_shape(image.shape, size, stride)].append(index)
+
+    results: List[Any] = [None] * len(images)
+    with torch.inference_mode():
+        for indices in buckets.values():
+            for start in range(0, len(indices), batch_size):
+                chunk = indices[start : start + batch_size]
+
+                # Run the model once for the whole chunk
+                pred, chunk_images, batch, original_sizes = process_batch(
+                    [images[index] for index in chunk],
+                    model,
+                    non_max_suppression,
+                    img_size,
+                )
+
+                # Draw the boxes of each image separately
+                for det, image, original_size, index in zip(
+                    pred, chunk_images, original_sizes, chunk
+                ):
+                    results[index] = draw_boxes(
+                        [det],
+                        image,
+                        batch,
+                        names,
+                        original_size,
+                        [],
+                        scale_coords,
+                        plot_one_box,
+                        strategies,
+                        background,
+                        color,
+                        image_replacement,
+                    )
+    return results
@@ -0,0 +1,143 @@
+import json
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+from .image_processor import letterbox
+
+# Quantization modes quantize_model supports
+QUANTIZATION_MODES = ("static", "dynamic")
+
+# Only the convolutions are quantized. The box decoding at the end of the detection head
+# mixes pixel coordinates and probabilities in one tensor, which a single INT8 scale
+# cannot represent, so it stays in fp32.
+QUANTIZED_OPS = ["Conv"]
+
+
+class ImageFolderCalibrationReader:
+    """
+    Feeds local images to the ONNX Runtime calibrator, preprocessed like process_image does.
+
+    Every image is letterboxed, padded to a square of img_size pixels so that all the
+    calibration batches have the same shape, and normalized to [0, 1].
+
+    Attributes
+    ----------
+    input_name : str
+        The name of the model's input.
+    images : list
+        The calibration images.
+    img_size : int
+        The inference size the model will be used at.
+    stride : int
+        The model's stride.
+    """
+
+    def __init__(
+        self, input_name: str, images: List[np.ndarray], img_size: int, stride: int
+    ):
+        self.input_name = input_name
+        self.images = images
+        self.img_size = img_size
+        self.stride = stride
+        self._iterator = iter(self.images)
+
+    def get_next(self):
+        image = next(self._iterator, None)
+        if image is None:
+            return None
+        image, _, _ = letterbox(image, self.img_size, self.stride)
+        # Pad to a full square, on the bottom and right so the boxes are not shifted
+        image = cv2.copyMakeBorder(
+            image,
+            0,
+            self.img_size - image.shape[0],
+            0,
+            self.img_size - image.shape[1],
+            cv2.BORDER_CONSTANT,
+            value=(114, 114, 114),
+        )
+        img = image.transpose((2, 0, 1))[None].astype(np.float32) / 255.0
+        return {self.input_name: img}
+
+    def rewind(self):
+        self._iterator = iter(self.images)
+
+
+def quantize_model(
+    onnx_path: str,
+    output_path: str,
+    mode: str = "static",
+    calibration_images: Optional[List[np.ndarray]] = None,
+    img_size: int = 640,
+) -> str:
+    """
+    Quantizes an exported ONNX model to INT8 weights (and activations in static mode).
+
+    Static post-training quantization calibrates the activation ranges on local images and
+    gives the fastest CPU model. Dynamic quantization needs no images but only quantizes
+    the weights ahead of time. The stride and class names stored by export_onnx are carried
+    over, so the output loads through load_model like any other ONNX model.
+
+    Parameters:
+    - onnx_path: The path to the fp32 ONNX model.
+    - output_path: The path to write the INT8 model to.
+    - mode: "static" or "dynamic".
+    - calibration_images: The images to calibrate with, required in static mode.
+    - img_size: The inference size the model will be used at.
+
+    Returns:
+    - output_path: The path of the quantized model.
+    """
+
+    import onnx
+    from onnxruntime.quantization import (
+        CalibrationMethod,
+        QuantFormat,
+        QuantType,
+        quantize_dynamic,
+        quantize_static,
+    )
+
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode}")
+
+    model = onnx.load(onnx_path)
+    metadata = {entry.key: entry.value for entry in model.metadata_props}
+
+    if mode == "static":
+        if not calibration_images:
+            raise ValueError("Static quantization needs calibration images")
+        stride = int(max(json.loads(metadata["stride"])))
+        reader = ImageFolderCalibrationReader(
+            model.graph.input[0].name, calibration_images, img_size, stride
+        )
+        quantize_static(
+            onnx_path,
+            output_path,
+            reader,
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=CalibrationMethod.MinMax,
+            op_types_to_quantize=QUANTIZED_OPS,
+        )
+    else:
+        quantize_dynamic(
+            onnx_path,
+            output_path,
+            weight_type=QuantType.QUInt8,
+            op_types_to_quantize=QUANTIZED_OPS,
+        )
+
+    # Copy the stride and class names over to the quantized model
+    quantized = onnx.load(output_path)
+    existing = {entry.key for entry in quantized.metadata_props}
+    for key, value in metadata.items():
+        if key not in existing:
+            entry = quantized.metadata_props.add()
+            entry.key, entry.value = key, value
+    onnx.save(quantized, output_path)
+    return output_path
@@ -0,0 +1,261 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Hashable, List, Optional
+
+import numpy as np
+
+# Directory where the detections are persisted across restarts, if set
+RESULT_CACHE_DIR = os.environ.get("FACE_SIGHT_RESULT_CACHE_DIR") or None
+
+
+def image_digest(image: np.ndarray) -> str:
+    """
+    Returns a digest of the content of an image, its pixels along with its shape and type.
+
+    Parameters:
+    - image: The image as a numpy array.
+
+    Returns:
+    - The hexadecimal BLAKE2b digest.
+    """
+
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{image.shape}{image.dtype}".encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+def model_id(model_path: str, backend: Optional[str] = None) -> str:
+    """
+    Returns an identifier of a model file that changes whenever the file is replaced.
+
+    The identifier is built from the file's path, size and modification time rather than
+    from its content, so it costs a stat instead of reading the whole checkpoint.
+
+    Parameters:
+    - model_path: The path of the model.
+    - backend: The inference backend the model is served with.
+
+    Returns:
+    - A short hexadecimal identifier.
+    """
+
+    path = os.path.abspath(model_path)
+    stat = os.stat(path)
+    key = f"{path}:{stat.st_size}:{stat.st_mtime_ns}:{backend}"
+    return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+
+
+class ResultCache:
+    """
+    A class used to keep the detections of the images already processed.
+
+    The entries are keyed by the content of the image, the model and the inference size,
+    and hold the raw (N, 6) detections in the image's coordinates, not the rendered image.
+    Rendering the same image with other strategies or colors therefore reuses them and
+    skips the model. The entries are evicted in least recently used order beyond
+    max_entries. With a cache_dir, they are also saved there as .npy files and read back on
+    a miss, so they survive restarts. Once there are more than max_disk_entries files, the
+    least recently used ones are removed, down to nine tenths of max_disk_entries, so the
+    directory is only listed once every few thousand puts.
+
+    Attributes
+    ----------
+    max_entries : int
+        The maximum number of detections kept in memory.
+    cache_dir : str or None
+        The directory the detections are persisted to, or None to keep them in memory only.
+    max_disk_entries : int
+        The maximum number of files kept in cache_dir.
+    hits : int
+        The number of lookups answered from the cache.
+    misses : int
+        The number of lookups that had to run the model.
+
+    Methods
+    -------
+    key(image, model_key, img_size)
+        Returns the key of the detections of an image.
+    get(key)
+        Returns the cached detections, or None.
+    put(key, detections)
+        Caches the detections.
+    clear()
+        Empties the memory cache.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 64,
+        cache_dir: Optional[str] = None,
+        max_disk_entries: int = 10000,
+    ):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Estimated number of files in cache_dir, counted once and then kept up to date
+        self._disk_entries = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk_entries = len(self._cached_files())
+
+    def key(
+        self, image: np.ndarray, model_key: Hashable, img_size: Optional[int]
+    ) -> str:
+        """
+        Returns the key of the detections of an image.
+
+        Parameters:
+        - image: The image as a numpy array.
+        - model_key: An identifier of the model, such as the one returned by model_id.
+        - img_size: The inference size, or None for the whole image.
+
+        Returns:
+        - The key, usable as a file name.
+        """
+
+        return f"{image_digest(image)}-{model_key}-{img_size}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        Returns the cached detections, or None.
+
+        Parameters:
+        - key: The key returned by key().
+
+        Returns:
+        - The read-only (N, 6) detections, or None if they are not cached.
+        """
+
+        with self._lock:
+            detections = self._entries.get(key)
+            if detections is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return detections
+
+        if self.cache_dir is not None and os.path.exists(self._path(key)):
+            try:
+                detections = np.load(self._path(key))
+                # Mark the file as recently used
+                os.utime(self._path(key))
+            except (OSError, ValueError):
+                detections = None
+            if detections is not None:
+                self._remember(key, detections)
+                with self._lock:
+                    self.hits += 1
+                return detections
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, detections: np.ndarray) -> np.ndarray:
+        """
+        Caches the detections.
+
+        Parameters:
+        - key: The key returned by key().
+        - detections: The (N, 6) detections in the image's coordinates.
+
+        Returns:
+        - The cached, read-only detections.
+        """
+
+        detections = np.array(detections, dtype=np.float32).reshape(-1, 6)
+        self._remember(key, detections)
+        if self.cache_dir is not None:
+            # Write to a temporary file of its own first, so a crash never leaves a truncated
+            # entry and concurrent puts of the same image never share one
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, detections)
+                is_new = not os.path.exists(self._path(key))
+                os.replace(temp_path, self._path(key))
+            except OSError:
+                # The entry stays in memory, only its file is lost
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+                return detections
+            with self._lock:
+                self._disk_entries += is_new
+                evict = self._disk_entries > self.max_disk_entries
+            if evict:
+                self._evict_files()
+        return detections
+
+    def _remember(self, key: str, detections: np.ndarray) -> None:
+        """
+        Keeps the detections in memory, evicting the least recently used ones.
+        """
+
+        # The entries are shared by every caller, so they must never be modified
+        detections.flags.writeable = False
+        with self._lock:
+            self._entries[key] = detections
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _cached_files(self) -> List[str]:
+        """
+        Returns the paths of the detection files in cache_dir.
+        """
+
+        return [
+            os.path.join(self.cache_dir, name)
+            for name in os.listdir(self.cache_dir)
+            if name.endswith(".npy")
+        ]
+
+    def _evict_files(self) -> None:
+        """
+        Removes the least recently used files, down to nine tenths of max_disk_entries.
+        """
+
+        def mtime(path: str) -> float:
+            # A concurrent eviction may have removed the file already
+            try:
+                return os.path.getmtime(path)
+            except FileNotFoundError:
+                return 0.0
+
+        paths = self._cached_files()
+        keep = self.max_disk_entries * 9 // 10
+        if len(paths) > keep:
+            paths.sort(key=mtime)
+            for path in paths[: len(paths) - keep]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        with self._lock:
+            self._disk_entries = min(len(paths), keep)
+
+    def clear(self) -> None:
+        """
+        Empties the memory cache and resets the counters. The files are kept.
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# The cache shared by every session of the process
+RESULT_CACHE = ResultCache(cache_dir=RESULT_CACHE_DIR)
@@ -0,0 +1,353 @@
+import copy
+import os
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from .box_drawer import select_detections
+from .image_processor import inference_size, letterbox_shape, process_batch
+from .metrics import METRICS
+from .model_loader import BACKEND, OnnxModel, get_model
+
+# Number of model replicas of the shared scheduler, each running one batch at a time
+REPLICAS = int(os.environ.get("FACE_SIGHT_REPLICAS") or 1)
+
+# Intra-op threads of each replica. None splits the cores evenly between the replicas.
+# The ONNX Runtime replicas get them per session; for the PyTorch replicas, torch's thread
+# count is process-wide, so it is set once for the whole process when the scheduler starts.
+THREADS_PER_REPLICA = (
+    int(os.environ["FACE_SIGHT_THREADS_PER_REPLICA"])
+    if os.environ.get("FACE_SIGHT_THREADS_PER_REPLICA")
+    else None
+)
+
+# Process-wide schedulers, keyed like the model registry of model_loader
+_SCHEDULERS: Dict[Tuple[str, Optional[str]], "InferenceScheduler"] = {}
+_SCHEDULERS_LOCK = threading.Lock()
+
+
+class SchedulerSession:
+    """
+    A class used by one video stream to submit its frames to an InferenceScheduler.
+
+    A session holds at most one waiting frame: a new frame replaces the one the scheduler
+    has not taken yet, which is then dropped. A session also has at most one frame being
+    detected at a time, so its results arrive in order and a busy session cannot take
+    more than its share of a batch.
+
+    Attributes
+    ----------
+    img_size : int or None
+        The letterboxed inference size of the stream's frames.
+    frames_submitted : int
+        The number of frames submitted.
+    frames_dropped : int
+        The number of frames replaced before the scheduler could take them.
+    frames_detected : int
+        The number of frames the scheduler has taken into a batch.
+
+    Methods
+    -------
+    submit(frame)
+        Hands a frame over to the scheduler, replacing the one still waiting, if any.
+    close()
+        Unregisters the session from the scheduler.
+    """
+
+    def __init__(
+        self,
+        scheduler: "InferenceScheduler",
+        callback: Callable[[np.ndarray, np.ndarray], None],
+        img_size: Optional[int],
+    ):
+        self.scheduler = scheduler
+        self.callback = callback
+        self.img_size = img_size
+        self.frames_submitted = 0
+        self.frames_dropped = 0
+        self.frames_detected = 0
+        # Guarded by the scheduler's condition
+        self._pending: Optional[np.ndarray] = None
+        self._in_flight = False
+
+    def submit(self, frame: np.ndarray) -> None:
+        """
+        Hands a frame over to the scheduler, replacing the one still waiting, if any.
+
+        Parameters:
+        - frame: The frame as a BGR numpy array. It must not be modified afterwards.
+        """
+
+        with self.scheduler._condition:
+            if self._pending is not None:
+                self.frames_dropped += 1
+                METRICS.count("frames_dropped")
+            self._pending = frame
+            self.frames_submitted += 1
+            self.scheduler._condition.notify()
+
+    def close(self) -> None:
+        """
+        Unregisters the session from the scheduler.
+        """
+
+        self.scheduler.unregister(self)
+
+
+class InferenceScheduler:
+    """
+    A class used to share a few model replicas between all the video streams of the process.
+
+    Every replica runs on its own thread with a fixed number of intra-op threads, so the
+    streams no longer each run the model on their own callback thread and oversubscribe
+    the cores. A free replica builds its batch from the waiting frames of the sessions
+    served the least so far, up to max_batch frames and an even share of the sessions per
+    replica. Every session gets the same share of the forward passes, and a session that
+    submits faster than its share only drops its own older frames. With more streams, each
+    stream's frame rate goes down evenly instead of some streams starving.
+
+    An ONNX Runtime replica has its own session with threads_per_replica intra-op threads.
+    torch has no per-thread setting: torch.set_num_threads also applies to every thread
+    started later. So for the PyTorch models, the scheduler sets threads_per_replica once,
+    for the whole process, before starting the replicas, and every later torch call of the
+    process, outside the scheduler too, runs with that many threads.
+
+    Attributes
+    ----------
+    replicas : int
+        The number of model replicas.
+    threads_per_replica : int
+        The intra-op threads of each replica.
+    max_batch : int
+        The maximum number of frames per forward pass.
+    batches : int
+        The number of batches run.
+
+    Methods
+    -------
+    register(callback, img_size=None)
+        Creates a session whose detections are passed to callback(frame, detections).
+    unregister(session)
+        Removes a session and its waiting frame.
+    stop()
+        Stops the replica threads.
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        non_max_suppression: Callable,
+        scale_coords: Callable,
+        replicas: int = REPLICAS,
+        threads_per_replica: Optional[int] = THREADS_PER_REPLICA,
+        max_batch: int = 8,
+    ):
+        self.non_max_suppression = non_max_suppression
+        self.scale_coords = scale_coords
+        self.replicas = max(1, replicas)
+        self.threads_per_replica = threads_per_replica or max(
+            1, (os.cpu_count() or 1) // self.replicas
+        )
+        self.max_batch = max_batch
+        self.batches = 0
+        self._sessions: List[SchedulerSession] = []
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._threads = []
+        if not isinstance(model, OnnxModel):
+            # Process-wide, set once before the replica threads start, see above
+            torch.set_num_threads(self.threads_per_replica)
+        for index in range(self.replicas):
+            replica = self._replicate(model)
+            thread = threading.Thread(
+                target=self._run,
+                args=(replica,),
+                name=f"inference-replica-{index}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _replicate(self, model: Any) -> Any:
+        """
+        Returns a replica of the model that can run concurrently with the others.
+        """
+
+        if isinstance(model, torch.nn.Module):
+            # The yolov7 head caches its grids during the forward pass, so every replica
+            # needs its own copy
+            return copy.deepcopy(model)
+        if isinstance(model, OnnxModel):
+            # A session per replica, with its own intra-op thread pool
+            return OnnxModel(model.onnx_path, num_threads=self.threads_per_replica)
+        # Frozen TorchScript modules keep no state and can be shared
+        return model
+
+    def register(
+        self,
+        callback: Callable[[np.ndarray, np.ndarray], None],
+        img_size: Optional[int] = None,
+    ) -> SchedulerSession:
+        """
+        Creates a session whose detections are passed to callback(frame, detections).
+
+        Parameters:
+        - callback: Called on a replica thread with each detected frame and its (N, 6)
+          detections in frame coordinates. It must return quickly.
+        - img_size: The letterboxed inference size, or None to run on the whole frames.
+
+        Returns:
+        - The new session.
+        """
+
+        session = SchedulerSession(self, callback, img_size)
+        with self._condition:
+            self._sessions.append(session)
+        return session
+
+    def unregister(self, session: SchedulerSession) -> None:
+        """
+        Removes a session and its waiting frame.
+        """
+
+        with self._condition:
+            if session in self._sessions:
+                self._sessions.remove(session)
+            session._pending = None
+
+    def stop(self) -> None:
+        """
+        Stops the replica threads.
+        """
+
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def _take_batch(self) -> List[Tuple[SchedulerSession, np.ndarray]]:
+        """
+        Takes the waiting frames of the least served free sessions, up to an even share of
+        the sessions per replica. Must be called with the condition held.
+        """
+
+        # Without the cap, the replicas settle into serving fixed groups of sessions, and
+        # the groups with cheaper batches get a higher frame rate
+        limit = min(self.max_batch, -(-len(self._sessions) // self.replicas))
+        waiting = [
+            session
+            for session in self._sessions
+            if session._pending is not None and not session._in_flight
+        ]
+        # The sort is stable, so the sessions served equally keep their registration order
+        waiting.sort(key=lambda session: session.frames_detected)
+
+        batch = []
+        for session in waiting[:limit]:
+            batch.append((session, session._pending))
+            session._pending = None
+            session._in_flight = True
+            session.frames_detected += 1
+        return batch
+
+    def _run(self, model: Any) -> None:
+        """
+        Replica loop: takes a batch across the sessions, detects it and delivers the results.
+        """
+
+        while True:
+            with self._condition:
+                batch = self._take_batch()
+                while not batch and not self._stopped:
+                    self._condition.wait()
+                    batch = self._take_batch()
+                if self._stopped:
+                    return
+
+            try:
+                results = self._infer(model, batch)
+            except Exception:
+                # A failed batch only costs its frames, the sessions keep submitting
+                METRICS.count("scheduler_errors")
+                results = [None] * len(batch)
+            self.batches += 1
+            METRICS.count("batches")
+
+            for (session, frame), detections in zip(batch, results):
+                with self._condition:
+                    session._in_flight = False
+                    # The session may have a frame waiting that no replica could take
+                    self._condition.notify()
+                if detections is None:
+                    continue
+                try:
+                    session.callback(frame, detections)
+                except Exception:
+                    # A failing session must not stop the replica serving the others
+                    METRICS.count("scheduler_errors")
+
+    def _infer(
+        self, model: Any, batch: List[Tuple[SchedulerSession, np.ndarray]]
+    ) -> List[np.ndarray]:
+        """
+        Detects the faces of a batch of frames, one forward pass per input shape.
+        """
+
+        stride = int(model.stride.max())
+        groups: Dict[Tuple[int, Tuple[int, int]], List[int]] = defaultdict(list)
+        for index, (session, frame) in enumerate(batch):
+            img_size = inference_size(model, frame.shape, session.img_size)
+            groups[(img_size, letterbox_shape(frame.shape, img_size, stride))].append(
+                index
+            )
+
+        results: List[Any] = [None] * len(batch)
+        with torch.inference_mode():
+            for (img_size, _), indices in groups.items():
+                frames = [batch[index][1] for index in indices]
+                with METRICS.stage("scheduler_batch"):
+                    pred, _, tensor, _ = process_batch(
+                        frames, model, self.non_max_suppression, img_size
+                    )
+                for det, frame, index in zip(pred, frames, indices):
+                    results[index] = select_detections(
+                        [det], tensor, frame.shape, self.scale_coords
+                    )
+        return results
+
+
+def get_scheduler(
+    model_path: str,
+    backend: Optional[str] = BACKEND,
+    replicas: int = REPLICAS,
+    threads_per_replica: Optional[int] = THREADS_PER_REPLICA,
+) -> InferenceScheduler:
+    """
+    Returns the inference scheduler of a model, creating it only once per process.
+
+    Parameters:
+    - model_path: The path to the pre-trained model.
+    - backend: The inference backend, or None to choose it from the file extension.
+    - replicas: The number of model replicas, used when the scheduler is created.
+    - threads_per_replica: The intra-op threads of each replica, used when the scheduler is created.
+
+    Returns:
+    - The scheduler shared by every session of the process.
+    """
+
+    key = (os.path.abspath(model_path), backend)
+    with _SCHEDULERS_LOCK:
+        if key not in _SCHEDULERS:
+            model, _, scale_coords, non_max_suppression, _ = get_model(
+                model_path, backend=backend
+            )
+            _SCHEDULERS[key] = InferenceScheduler(
+                model,
+                non_max_suppression,
+                scale_coords,
+                replicas,
+                threads_per_replica,
+            )
+        return _SCHEDULERS[key]
@@ -0,0 +1,344 @@
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+from aiohttp import web
+
+from .box_drawer import draw_detections, select_detections
+from .image_processor import inference_size, letterbox_shape, process_batch
+from .metrics import METRICS
+
+# Largest request body accepted, in bytes
+MAX_BODY_SIZE = 32 * 2**20
+
+
+class Overloaded(RuntimeError):
+    """
+    Raised when a request arrives while the micro-batcher's queue is full.
+    """
+
+
+class MicroBatcher:
+    """
+    A class used to group the concurrent detection requests into batched forward passes.
+
+    Requests are queued, and the batching loop takes the first one then keeps collecting
+    for at most max_delay seconds, or until max_batch requests are gathered. The batch
+    goes through process_batch on a single inference thread, one forward pass per
+    letterboxed shape, while the event loop keeps accepting requests. Under load, the
+    batches fill up and the cost of a forward pass is shared by many requests. Once
+    max_pending requests are waiting, new ones are refused with Overloaded instead of
+    queuing without bound.
+
+    Attributes
+    ----------
+    max_batch : int
+        The maximum number of images per forward pass.
+    max_delay : float
+        The longest time, in seconds, the first request of a batch waits for others.
+    max_pending : int
+        The maximum number of queued requests.
+    requests : int
+        The number of images detected.
+    batches : int
+        The number of batches run.
+
+    Methods
+    -------
+    start()
+        Starts the batching loop, in the running event loop.
+    stop()
+        Stops the batching loop and the inference thread.
+    detect(image)
+        Queues an image and returns its detections once its batch has run.
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        non_max_suppression: Callable,
+        scale_coords: Callable,
+        img_size: int = 640,
+        max_batch: int = 8,
+        max_delay: float = 0.005,
+        max_pending: int = 64,
+    ):
+        self.model = model
+        self.non_max_suppression = non_max_suppression
+        self.scale_coords = scale_coords
+        self.img_size = img_size
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.requests = 0
+        self.batches = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # A single thread runs the forward passes, one batch at a time
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="inference")
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self) -> None:
+        """
+        Starts the batching loop, in the running event loop.
+        """
+
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops the batching loop and the inference thread.
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+    async def detect(self, image: np.ndarray) -> np.ndarray:
+        """
+        Queues an image and returns its detections once its batch has run.
+
+        Parameters:
+        - image: The image as a BGR numpy array.
+
+        Returns:
+        - The float32 (N, 6) array of [x1, y1, x2, y2, conf, cls] detections in the image's coordinates.
+        """
+
+        if self.pending >= self.max_pending:
+            METRICS.count("requests_rejected")
+            raise Overloaded(f"{self.pending} requests are already waiting")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((image, future))
+        return await future
+
+    async def _run(self) -> None:
+        """
+        Batching loop: collects the requests of a batch and runs it on the inference thread.
+        """
+
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Skip the requests whose client is gone
+            batch = [(image, future) for image, future in batch if not future.done()]
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self._infer, [image for image, _ in batch]
+                )
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            METRICS.count("batches")
+            for (_, future), detections in zip(batch, results):
+                if not future.done():
+                    future.set_result(detections)
+
+    def _infer(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        """
+        Detects the faces of a batch of images, one forward pass per letterboxed shape.
+        """
+
+        stride = int(self.model.stride.max())
+        groups: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for index, image in enumerate(images):
+            # At the size process_batch letterboxes to, clamped for the traced models
+            size = inference_size(self.model, image.shape, self.img_size)
+            groups[letterbox_shape(image.shape, size, stride)].append(index)
+
+        results: List[Any] = [None] * len(images)
+        with torch.inference_mode():
+            for indices in groups.values():
+                pred, _, batch, _ = process_batch(
+                    [images[index] for index in indices],
+                    self.model,
+                    self.non_max_suppression,
+                    self.img_size,
+                )
+                for det, index in zip(pred, indices):
+                    results[index] = select_detections(
+                        [det], batch, images[index].shape, self.scale_coords
+                    )
+        return results
+
+
+def _decode(body: bytes) -> np.ndarray:
+    """
+    Decodes the image of a request body, or answers 400 Bad Request.
+    """
+
+    image = cv2.imdecode(np.frombuffer(body, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise web.HTTPBadRequest(text="The body is not a JPEG or PNG image")
+    return image
+
+
+async def _detect(request: web.Request) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes the image of a request and detects its faces, or answers 503 when overloaded.
+    """
+
+    image = _decode(await request.read())
+    try:
+        detections = await request.app["batcher"].detect(image)
+    except Overloaded as error:
+        raise web.HTTPServiceUnavailable(text=str(error), headers={"Retry-After": "1"})
+    return image, detections
+
+
+async def handle_detect(request: web.Request) -> web.Response:
+    """
+    POST /detect with a JPEG or PNG body: returns the boxes as JSON.
+    """
+
+    image, detections = await _detect(request)
+    names = request.app["names"]
+    return web.json_response(
+        {
+            "width": image.shape[1],
+            "height": image.shape[0],
+            "boxes": [
+                {
+                    "box": [float(v) for v in det[:4]],
+                    "confidence": round(float(det[4]), 4),
+                    "label": names[int(det[5])],
+                }
+                for det in detections
+            ],
+        }
+    )
+
+
+async def handle_render(request: web.Request) -> web.Response:
+    """
+    POST /render with a JPEG or PNG body: returns the image with the strategies applied.
+
+    The query selects the strategies (strategy, repeated), the background and face colors
+    (background, color) and the output format (format, "jpg" or "png").
+    """
+
+    image, detections = await _detect(request)
+    strategies = request.query.getall("strategy", ["blur faces"])
+    background = request.query.get("background", "#56ecd5")
+    color = request.query.get("color", "#56ecd5")
+    extension = "." + request.query.get("format", "jpg").lstrip(".")
+    if extension not in (".jpg", ".png"):
+        raise web.HTTPBadRequest(text="The format must be jpg or png")
+
+    def render() -> bytes:
+        rendered = draw_detections(
+            image,
+            detections,
+            request.app["names"],
+            [],
+            request.app["plot_one_box"],
+            strategies,
+            background,
+            color,
+        )
+        return cv2.imencode(extension, rendered)[1].tobytes()
+
+    # Rendering is CPU work, keep it off the event loop
+    body = await asyncio.get_running_loop().run_in_executor(None, render)
+    content_type = "image/jpeg" if extension == ".jpg" else "image/png"
+    return web.Response(body=body, content_type=content_type)
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    """
+    GET /health: returns the state of the micro-batcher.
+    """
+
+    batcher = request.app["batcher"]
+    return web.json_response(
+        {
+            "status": "ok",
+            "pending": batcher.pending,
+            "requests": batcher.requests,
+            "batches": batcher.batches,
+        }
+    )
+
+
+def create_app(
+    model: Any,
+    names: List[str],
+    scale_coords: Callable,
+    non_max_suppression: Callable,
+    plot_one_box: Callable,
+    img_size: int = 640,
+    max_batch: int = 8,
+    max_delay: float = 0.005,
+    max_pending: int = 64,
+) -> web.Application:
+    """
+    Creates the HTTP inference service.
+
+    Parameters:
+    - model: The object detection model to use.
+    - names: The names of the classes.
+    - scale_coords: The function to rescale the coordinates to the original image size.
+    - non_max_suppression: The non-maximum suppression function to apply to the model's predictions.
+    - plot_one_box: The function to draw a bounding box on the image.
+    - img_size: The letterboxed inference size.
+    - max_batch: The maximum number of images per forward pass.
+    - max_delay: The longest time, in seconds, a request waits for others to share its batch.
+    - max_pending: The number of queued requests beyond which requests are refused with 503.
+
+    Returns:
+    - The aiohttp application, with the /detect, /render and /health routes.
+    """
+
+    app = web.Application(client_max_size=MAX_BODY_SIZE)
+    app["names"] = names
+    app["plot_one_box"] = plot_one_box
+    app["batcher"] = MicroBatcher(
+        model,
+        non_max_suppression,
+        scale_coords,
+        img_size,
+        max_batch,
+        max_delay,
+        max_pending,
+    )
+
+    async def on_startup(app):
+        await app["batcher"].start()
+
+    async def on_cleanup(app):
+        await app["batcher"].stop()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post("/detect", handle_detect)
+    app.router.add_post("/render", handle_render)
+    app.router.add_get("/health", handle_health)
+    return app
@@ -0,0 +1,28 @@
+import os
+
+# Settings read from the environment. This module imports nothing heavy, so the pages can
+# read them and draw before torch, OpenCV or the model are loaded.
+
+# Path of the model served by the detection page. Point it at an exported .onnx file to
+# use the ONNX Runtime backend instead of PyTorch, or at a model package directory (see
+# build_model_package) to load the model without the yolov7 sources.
+MODEL_PATH = os.environ.get("FACE_SIGHT_MODEL", "src/models/model.pt")
+
+# Inference backend of the detection page. None picks it from the model's file extension,
+# "torchscript" serves a traced artifact of the PyTorch checkpoint.
+BACKEND = os.environ.get("FACE_SIGHT_BACKEND") or None
+
+# Number of intra-op threads torch uses for CPU inference. None keeps torch's default,
+# which is one thread per physical core.
+NUM_THREADS = (
+    int(os.environ["FACE_SIGHT_NUM_THREADS"])
+    if os.environ.get("FACE_SIGHT_NUM_THREADS")
+    else None
+)
+
+# Directory where the traced model artifacts are cached, and the input size they are traced at
+ARTIFACT_DIR = os.environ.get("FACE_SIGHT_ARTIFACT_DIR", "src/models/cache")
+TRACE_SIZE = 640
+
+# Inference sizes offered for the letterbox mode (longest side of the model input, in pixels)
+INFERENCE_SIZES = (320, 416, 512, 640)
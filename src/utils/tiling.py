@@ -0,0 +1,235 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from .image_processor import (
+    CONF_THRESHOLD,
+    IOU_THRESHOLD,
+    MAX_DETECTIONS,
+    process_batch,
+    process_image,
+)
+from .metrics import METRICS
+
+# Side of the square tiles, in pixels of the original image
+TILE_SIZE = 640
+
+# Overlap between two neighbouring tiles, in pixels. Faces smaller than the overlap are
+# always seen whole by at least one tile.
+TILE_OVERLAP = 128
+
+# Distance, in pixels, within which a box touching an inner tile border counts as cut
+EDGE_MARGIN = 2
+
+
+def tile_origins(length: int, tile: int, overlap: int) -> List[int]:
+    """
+    Returns the start offsets of the tiles covering a side of an image.
+
+    The tiles overlap by at least overlap pixels. The last tile is moved back to end at the
+    border of the image, so every tile has the same size.
+
+    Parameters:
+    - length: The length of the side of the image.
+    - tile: The length of the tiles.
+    - overlap: The minimum overlap between two neighbouring tiles.
+
+    Returns:
+    - The sorted start offsets.
+    """
+
+    if length <= tile:
+        return [0]
+    step = tile - overlap
+    count = -(-(length - overlap) // step)
+    return sorted({min(index * step, length - tile) for index in range(count)})
+
+
+def tile_image(
+    image: np.ndarray, tile_size: int, overlap: int, stride: int
+) -> Tuple[List[Tuple[int, int]], List[np.ndarray]]:
+    """
+    Splits an image into overlapping tiles of the same size.
+
+    The tile size is rounded down to a multiple of the model's stride, so the tiles go
+    through the model without being resized or padded. The tiles are views of the image,
+    not copies.
+
+    Parameters:
+    - image: The image as a numpy array.
+    - tile_size: The side of the tiles.
+    - overlap: The minimum overlap between two neighbouring tiles.
+    - stride: The model's stride.
+
+    Returns:
+    - origins: The (x, y) offset of each tile in the image.
+    - tiles: The tiles.
+    """
+
+    height, width = image.shape[:2]
+    tile_size = max(stride, tile_size - tile_size % stride)
+    tile_height, tile_width = min(tile_size, height), min(tile_size, width)
+
+    origins, tiles = [], []
+    for y in tile_origins(height, tile_height, overlap):
+        for x in tile_origins(width, tile_width, overlap):
+            origins.append((x, y))
+            tiles.append(image[y : y + tile_height, x : x + tile_width])
+    return origins, tiles
+
+
+def _inner_edge_mask(
+    boxes: torch.Tensor,
+    origin: Tuple[int, int],
+    tile_shape: Tuple[int, int],
+    image_shape: Tuple[int, int],
+) -> torch.Tensor:
+    """
+    Returns the mask of the boxes cut by a border of their tile that is not a border of the image.
+    """
+
+    x, y = origin
+    tile_height, tile_width = tile_shape
+    height, width = image_shape
+    cut = torch.zeros(len(boxes), dtype=torch.bool)
+    if x > 0:
+        cut |= boxes[:, 0] <= EDGE_MARGIN
+    if y > 0:
+        cut |= boxes[:, 1] <= EDGE_MARGIN
+    if x + tile_width < width:
+        cut |= boxes[:, 2] >= tile_width - EDGE_MARGIN
+    if y + tile_height < height:
+        cut |= boxes[:, 3] >= tile_height - EDGE_MARGIN
+    return cut
+
+
+def detect_tiled(
+    image: np.ndarray,
+    model: Any,
+    non_max_suppression: Callable,
+    scale_coords: Callable,
+    tile_size: int = TILE_SIZE,
+    overlap: int = TILE_OVERLAP,
+    batch_size: int = 8,
+    workers: int = 1,
+    full_image: bool = True,
+    conf_thres: float = CONF_THRESHOLD,
+    classes: Optional[List[int]] = None,
+    max_det: int = MAX_DETECTIONS,
+) -> np.ndarray:
+    """
+    Detects the faces of a large image at its full resolution, one tile at a time.
+
+    Letterboxing a 20 megapixel photo down to the inference size shrinks its small faces
+    below what the model can find, and running the model on the whole image at once takes
+    too long and too much memory. The image is instead split into overlapping tiles of
+    tile_size pixels, which go through the model at their own resolution, batch_size tiles
+    per forward pass. The time and memory therefore grow with the number of tiles, and a
+    batch never holds more than batch_size tiles.
+
+    The boxes of each tile are moved back to the image's coordinates. The boxes cut by an
+    inner tile border are dropped, as the neighbouring tile sees those faces whole. With
+    full_image, the whole image is also letterboxed to tile_size, so the faces larger than
+    the overlap are still found. A global non-maximum suppression then merges the boxes
+    found several times.
+
+    Parameters:
+    - image: The original image.
+    - model: The object detection model to use.
+    - non_max_suppression: The non-maximum suppression function to apply to the model's predictions.
+    - scale_coords: The function to rescale the coordinates to the original image size.
+    - tile_size: The side of the tiles.
+    - overlap: The minimum overlap between two neighbouring tiles.
+    - batch_size: The maximum number of tiles per forward pass.
+    - workers: The number of threads running the batches concurrently. The forward passes
+      release the GIL, which helps the models that do not use every core on their own.
+    - full_image: Whether to also detect the large faces on the whole image.
+    - conf_thres: The confidence above which a box is kept.
+    - classes: The classes to keep, or None to keep them all.
+    - max_det: The maximum number of detections kept.
+
+    Returns:
+    - A contiguous float32 (N, 6) array of [x1, y1, x2, y2, conf, cls] rows in the image's
+      coordinates, the least confident first, like select_detections.
+    """
+
+    from torchvision.ops import batched_nms
+
+    stride = int(model.stride.max())
+    image_shape = image.shape[:2]
+    origins, tiles = tile_image(image, tile_size, overlap, stride)
+    tile_shape = tiles[0].shape[:2]
+    # The tiles are never scaled, only padded to the stride if the image is smaller than a tile
+    img_size = max(tile_shape)
+
+    def detect_chunk(start: int) -> List[torch.Tensor]:
+        """
+        Detects the faces of a chunk of tiles and moves their boxes to the image's coordinates.
+        """
+
+        # Inference mode is set per thread
+        with torch.inference_mode():
+            pred, _, batch, _ = process_batch(
+                tiles[start : start + batch_size],
+                model,
+                non_max_suppression,
+                img_size,
+                conf_thres,
+                classes,
+                max_det,
+                copy=False,
+            )
+            detections = []
+            for det, (x, y) in zip(pred, origins[start : start + batch_size]):
+                if not len(det):
+                    continue
+                det[:, :4] = scale_coords(batch.shape[2:], det[:, :4], tile_shape)
+                det = det[~_inner_edge_mask(det, (x, y), tile_shape, image_shape)]
+                det[:, [0, 2]] += x
+                det[:, [1, 3]] += y
+                detections.append(det)
+            return detections
+
+    starts = range(0, len(tiles), batch_size)
+    with METRICS.stage("tiles"):
+        if workers > 1 and len(starts) > 1:
+            with ThreadPoolExecutor(workers, thread_name_prefix="tile") as executor:
+                chunks = list(executor.map(detect_chunk, starts))
+        else:
+            chunks = [detect_chunk(start) for start in starts]
+    detections = [det for chunk in chunks for det in chunk]
+
+    if full_image and len(tiles) > 1:
+        # Find the faces too large for a tile on the whole, downscaled image
+        with torch.inference_mode():
+            pred, _, img, _ = process_image(
+                image,
+                model,
+                non_max_suppression,
+                tile_size,
+                copy=False,
+                conf_thres=conf_thres,
+                classes=classes,
+                max_det=max_det,
+            )
+            for det in pred:
+                if len(det):
+                    det[:, :4] = scale_coords(img.shape[2:], det[:, :4], image_shape)
+                    detections.append(det)
+
+    if not detections:
+        return np.zeros((0, 6), dtype=np.float32)
+
+    with METRICS.stage("merge"), torch.inference_mode():
+        detections = torch.cat(detections)
+        # Merge the faces found by several tiles, class by class, the most confident first
+        keep = batched_nms(
+            detections[:, :4], detections[:, 4], detections[:, 5], IOU_THRESHOLD
+        )[:max_det]
+        detections = detections[keep]
+        detections[:, :4] = detections[:, :4].round()
+
+    # The least confident first, so that the most confident boxes are drawn on top
+    return np.ascontiguousarray(detections.flip(0).cpu().numpy(), dtype=np.float32)
@@ -0,0 +1,134 @@
+import cv2
+import numpy as np
+from typing import Tuple
+
+# Detections as returned by select_detections: a float32 (N, 6) array of
+# [x1, y1, x2, y2, conf, cls] rows
+Detections = np.ndarray
+
+
+class BoxTracker:
+    """
+    A class used to move face boxes between two detections with sparse optical flow.
+
+    A grid of points is laid over each box and followed to the next frame with pyramidal
+    Lucas-Kanade optical flow. The box is then shifted by the median displacement of its
+    points and scaled by the median change of their distances to the centre, which costs
+    far less than running the detector.
+
+    Attributes
+    ----------
+    grid_size : int
+        The number of points per side of the grid laid over each box.
+    min_tracked : float
+        The fraction of a box's points that must be tracked for the box to be kept.
+    lost : bool
+        Whether a box was lost during the last update, a hint to run the detector again.
+
+    Methods
+    -------
+    reset(gray, detections)
+        Starts tracking the detections found on the given frame.
+    update(gray)
+        Moves the tracked boxes to the given frame and returns them.
+    """
+
+    def __init__(self, grid_size: int = 5, min_tracked: float = 0.5):
+        self.grid_size = grid_size
+        self.min_tracked = min_tracked
+        self.lost = False
+        self._gray = None
+        self._detections: Detections = np.zeros((0, 6), dtype=np.float32)
+
+    def _grid_points(self, box: Tuple[float, float, float, float]) -> np.ndarray:
+        """
+        Returns the grid of points laid over the central part of a box, as float32 (N, 1, 2).
+        """
+
+        x1, y1, x2, y2 = (float(v) for v in box[:4])
+        # Keep away from the box edges, where the background dominates
+        margin_x, margin_y = (x2 - x1) * 0.15, (y2 - y1) * 0.15
+        xs = np.linspace(x1 + margin_x, x2 - margin_x, self.grid_size)
+        ys = np.linspace(y1 + margin_y, y2 - margin_y, self.grid_size)
+        grid = np.stack(np.meshgrid(xs, ys), -1).reshape(-1, 1, 2)
+        return grid.astype(np.float32)
+
+    def reset(self, gray: np.ndarray, detections: Detections) -> None:
+        """
+        Starts tracking the detections found on the given frame.
+
+        Parameters:
+        - gray: The grayscale frame the detections were found on.
+        - detections: The (N, 6) array of detections.
+        """
+
+        self._gray = gray
+        self._detections = np.array(detections, dtype=np.float32).reshape(-1, 6)
+        self.lost = False
+
+    def update(self, gray: np.ndarray) -> Detections:
+        """
+        Moves the tracked boxes to the given frame and returns them.
+
+        Parameters:
+        - gray: The new grayscale frame.
+
+        Returns:
+        - The (N, 6) array of detections moved to the new frame, without the boxes that
+          were lost.
+        """
+
+        if self._gray is None or not len(self._detections):
+            self._gray = gray
+            return self._detections[:0]
+
+        # Follow the grid of every box at once
+        grids = [self._grid_points(det) for det in self._detections]
+        points = np.concatenate(grids)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(
+            self._gray, gray, points, None, winSize=(15, 15), maxLevel=2
+        )
+        status = status.reshape(-1).astype(bool)
+
+        height, width = gray.shape[:2]
+        kept = []
+        start = 0
+        for det, grid in zip(self._detections, grids):
+            end = start + len(grid)
+            ok = status[start:end]
+            old, new = points[start:end, 0][ok], moved[start:end, 0][ok]
+            start = end
+            if len(old) < self.min_tracked * len(grid):
+                continue
+
+            # Shift the box by the median displacement and scale it by the median spread change
+            old_center, new_center = np.median(old, 0), np.median(new, 0)
+            old_spread = np.linalg.norm(old - old_center, axis=1)
+            new_spread = np.linalg.norm(new - new_center, axis=1)
+            valid = old_spread > 1e-3
+            scale = (
+                float(np.median(new_spread[valid] / old_spread[valid]))
+                if valid.any()
+                else 1.0
+            )
+
+            x1, y1, x2, y2 = (float(v) for v in det[:4])
+            center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
+            center_x += new_center[0] - old_center[0]
+            center_y += new_center[1] - old_center[1]
+            half_w, half_h = (x2 - x1) / 2 * scale, (y2 - y1) / 2 * scale
+            new_box = (
+                max(0.0, round(center_x - half_w)),
+                max(0.0, round(center_y - half_h)),
+                min(float(width), round(center_x + half_w)),
+                min(float(height), round(center_y + half_h)),
+            )
+            if new_box[2] > new_box[0] and new_box[3] > new_box[1]:
+                # Keep the confidence and class of the detection
+                kept.append((*new_box, det[4], det[5]))
+
+        detections = np.array(kept, dtype=np.float32).reshape(-1, 6)
+        self.lost = len(detections) < len(self._detections)
+        self._gray = gray
+        self._detections = detections
+        return detections
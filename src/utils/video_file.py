@@ -0,0 +1,227 @@
+import cv2
+import json
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import numpy as np
+import torch
+
+from .box_drawer import draw_boxes
+from .image_processor import process_batch
+
+# Marks the end of the stream in the queues between the stages
+_END = object()
+
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """
+    Puts an item in a bounded queue, giving up if the pipeline is stopped meanwhile.
+    """
+
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event) -> Any:
+    """
+    Gets an item from a queue, returning the end marker if the pipeline is stopped meanwhile.
+    """
+
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def process_video_file(
+    input_path: str,
+    output_path: str,
+    detections_path: Optional[str],
+    model: Any,
+    names: List[str],
+    scale_coords: Callable,
+    non_max_suppression: Callable,
+    plot_one_box: Callable,
+    strategies: List[str],
+    background: Union[str, np.ndarray] = "#56ecd5",
+    color: str = "#56ecd5",
+    image_replacement: Optional[np.ndarray] = None,
+    img_size: int = 640,
+    batch_size: int = 4,
+    queue_size: int = 8,
+    fourcc: str = "mp4v",
+) -> Dict[str, float]:
+    """
+    Detects the faces of a video file, applies the strategies and writes the processed video.
+
+    Decoding, inference, rendering and encoding run as four stages on their own threads,
+    connected by bounded queues. A stage that gets ahead of the next one blocks on its
+    queue, so at most a few batches of frames are in memory whatever the length of the
+    video. The frames go through the model batch_size at a time (see process_batch), and
+    each frame is rendered by draw_boxes, like an uploaded image.
+
+    Parameters:
+    - input_path: The video file to read.
+    - output_path: The video file to write.
+    - detections_path: The JSON lines file to write the detections of every frame to, or None.
+    - model: The object detection model to use.
+    - names: The names of the classes.
+    - scale_coords: The function to rescale the coordinates to the original image size.
+    - non_max_suppression: The non-maximum suppression function to apply to the model's predictions.
+    - plot_one_box: The function to draw a bounding box on the image.
+    - strategies: A list of strategies to apply to the frames.
+    - background: The desired background color in hexadecimal format or an image as a numpy array.
+    - color: The desired color for the faces in hexadecimal format.
+    - image_replacement: The replacement image as a numpy array.
+    - img_size: The letterboxed inference size.
+    - batch_size: The maximum number of frames per forward pass.
+    - queue_size: The capacity of each queue between two stages.
+    - fourcc: The codec of the output video.
+
+    Returns:
+    - A dictionary with the number of frames, the elapsed time and the throughput in frames per second.
+    """
+
+    capture = cv2.VideoCapture(input_path)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video {input_path}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+
+    decoded: queue.Queue = queue.Queue(queue_size)
+    inferred: queue.Queue = queue.Queue(max(1, queue_size // batch_size))
+    rendered: queue.Queue = queue.Queue(queue_size)
+    # Set on the first error, so that the other stages stop instead of waiting forever
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    frames = [0]
+
+    def decode():
+        while True:
+            ok, frame = capture.read()
+            if not ok or not _put(decoded, frame, stop):
+                break
+
+    def infer():
+        # The predictions are inference tensors, rescaled in place when they are rendered
+        with torch.inference_mode():
+            finished = False
+            while not finished:
+                # Take up to batch_size frames, without waiting for more once the video ends
+                chunk = []
+                while len(chunk) < batch_size:
+                    frame = _get(decoded, stop)
+                    if frame is _END:
+                        finished = True
+                        break
+                    chunk.append(frame)
+                # Every decoded frame belongs to the pipeline alone, so it is drawn on in place
+                if chunk and not _put(
+                    inferred,
+                    process_batch(
+                        chunk, model, non_max_suppression, img_size, copy=False
+                    ),
+                    stop,
+                ):
+                    break
+
+    def render():
+        with torch.inference_mode():
+            while True:
+                item = _get(inferred, stop)
+                if item is _END:
+                    break
+                pred, images, batch, original_sizes = item
+                for det, image, original_size in zip(pred, images, original_sizes):
+                    _, boxes, image = draw_boxes(
+                        [det],
+                        image,
+                        batch,
+                        names,
+                        original_size,
+                        [],
+                        scale_coords,
+                        plot_one_box,
+                        strategies,
+                        background,
+                        color,
+                        image_replacement,
+                    )
+                    if not _put(rendered, (boxes, image), stop):
+                        return
+
+    def encode():
+        writer = None
+        detections_file = (
+            open(detections_path, "w") if detections_path is not None else None
+        )
+        try:
+            while True:
+                item = _get(rendered, stop)
+                if item is _END:
+                    break
+                boxes, image = item
+                if writer is None:
+                    # Open the writer with the size of the first frame
+                    height, width = image.shape[:2]
+                    writer = cv2.VideoWriter(
+                        output_path,
+                        cv2.VideoWriter_fourcc(*fourcc),
+                        fps,
+                        (width, height),
+                    )
+                writer.write(image)
+                if detections_file is not None:
+                    record = {
+                        "frame": frames[0],
+                        "boxes": boxes.astype(float).round(3).tolist(),
+                    }
+                    detections_file.write(json.dumps(record) + "\n")
+                frames[0] += 1
+        finally:
+            if writer is not None:
+                writer.release()
+            if detections_file is not None:
+                detections_file.close()
+
+    def run(stage, output):
+        try:
+            stage()
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+        finally:
+            # Tell the next stage that nothing more is coming
+            if output is not None:
+                _put(output, _END, stop)
+
+    stages = [(decode, decoded), (infer, inferred), (render, rendered), (encode, None)]
+    threads = [
+        threading.Thread(target=run, args=stage, daemon=True) for stage in stages
+    ]
+    start = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        stop.set()
+        capture.release()
+    elapsed = time.perf_counter() - start
+
+    if errors:
+        raise errors[0]
+    return {
+        "frames": frames[0],
+        "seconds": elapsed,
+        "fps": frames[0] / elapsed if elapsed else 0.0,
+    }
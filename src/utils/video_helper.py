@@ -1,12 +1,28 @@
 from streamlit_webrtc import VideoTransformerBase
 import av
-from .image_processor import process_image
-from .box_drawer import draw_boxes
+import logging
+import threading
+from collections import deque
+from .image_processor import InputBuffer, process_image
+from .box_drawer import (
+    StrategyCompositor,
+    draw_boxes,
+    render_detections,
+    select_detections,
+)
 from .predict import predict
+from .tracker import BoxTracker
+from .face_store import add_face
+from .metrics import METRICS
+from .adaptive import AdaptiveController, quality_levels
 import cv2
+import time
 import numpy as np
+import torch
 from typing import List, Tuple, Callable, Any, Optional
 
+logger = logging.getLogger(__name__)
+
 
 def process_frame(
     frame: np.ndarray,
@@ -18,6 +34,7 @@ def process_frame(
     plot_one_box: Callable,
     strategies: List[str],
     background: str,
+    img_size: Optional[int] = None,
 ) -> Tuple[Optional[List[Tuple[int, int, int, int]]], Optional[np.ndarray]]:
     """
     Processes a frame for object detection and applies various strategies.
@@ -32,9 +49,10 @@ def process_frame(
     - plot_one_box: The function to draw a bounding box on the image.
     - strategies: A list of strategies to apply to the image.
     - background: The desired background color in hexadecimal format.
+    - img_size: The letterboxed inference size, or None to run on the whole frame.
 
     Returns:
-    - boxes: The list of bounding boxes for each detected face.
+    - boxes: The float32 (N, 6) array of [x1, y1, x2, y2, conf, cls] detections.
     - image_with_boxes: The image with the bounding boxes drawn and the strategies applied.
     """
 
@@ -49,6 +67,7 @@ def process_frame(
         plot_one_box,
         strategies,
         background,
+        img_size=img_size,
     )
 
     # Return the list of bounding boxes and the image with the bounding boxes drawn and the strategies applied
@@ -67,8 +86,8 @@ class VideoTransformer(VideoTransformerBase):
         The object detection model to use.
     names : list
         The names of the classes that the model can predict.
-    faces : list
-        A list to store the detected faces.
+    faces : list or FaceStore
+        A list or bounded FaceStore to store the detected faces.
     scale_coords : function
         The function to rescale the coordinates to the original image size.
     non_max_suppression : function
@@ -79,9 +98,25 @@ class VideoTransformer(VideoTransformerBase):
         A list of strategies to apply to the image.
     background : str
         The desired background color in hexadecimal format.
+    img_size : int, optional
+        The letterboxed inference size, or None to run on the whole frame.
+    detect_interval : int
+        Run the detector every detect_interval frames and track the boxes in between.
+        The detector also runs as soon as the tracker loses a face. 1 detects on every frame.
+    tracker : BoxTracker
+        The tracker moving the boxes between two detections.
+    compositor : StrategyCompositor
+        The compiled strategies, applied to every frame in a single pass.
+    input_buffer : InputBuffer
+        The model input tensor, reused from one detection to the next.
+    adaptive : AdaptiveController, optional
+        The controller moving the inference size, detect interval and blur quality to
+        hold a target frame rate. The detect interval never goes below the one given.
 
     Methods
     -------
+    detect(img)
+        Detects the faces in a frame and stores their crops.
     transform(frame)
         Processes a frame for object detection and applies various strategies.
     """
@@ -96,6 +131,9 @@ class VideoTransformer(VideoTransformerBase):
         plot_one_box,
         strategies=None,
         background="#56ecd5",
+        img_size=None,
+        detect_interval=1,
+        adaptive=None,
     ):
         self.model = model
         self.names = names
@@ -105,6 +143,84 @@ class VideoTransformer(VideoTransformerBase):
         self.plot_one_box = plot_one_box
         self.strategies = strategies if strategies is not None else []
         self.background = background
+        self.img_size = img_size
+        self.detect_interval = detect_interval
+        self.tracker = BoxTracker()
+        self.compositor = StrategyCompositor(self.strategies, background)
+        # The model input tensor, refilled in place for every detection
+        self.input_buffer = InputBuffer()
+        # Number of frames since the last detection
+        self._frames_since_detection = 0
+        self.adaptive = adaptive
+        self._min_detect_interval = detect_interval
+        if adaptive is not None:
+            self._apply_quality()
+
+    def _apply_quality(self):
+        """
+        Applies the current level of the adaptive controller.
+        """
+
+        img_size, detect_interval, blur_max_side = self.adaptive.level
+        self.img_size = img_size
+        self.detect_interval = max(self._min_detect_interval, detect_interval)
+        self.compositor.blur_max_side = blur_max_side
+
+    def _observe(self, seconds):
+        """
+        Reports the latency of a frame to the adaptive controller, if any.
+        """
+
+        if self.adaptive is not None and self.adaptive.observe(seconds):
+            self._apply_quality()
+
+    def _due_for_detection(self):
+        """
+        Returns whether the current frame goes to the detector, every detect_interval
+        frames or as soon as the tracker loses a face, and counts it.
+        """
+
+        due = (
+            self.detect_interval <= 1
+            or self._frames_since_detection % self.detect_interval == 0
+            or self.tracker.lost
+        )
+        if due:
+            self._frames_since_detection = 0
+        self._frames_since_detection += 1
+        return due
+
+    def detect(self, img):
+        """
+        Detects the faces in a frame and stores their crops.
+
+        Parameters:
+        - img: The frame as a BGR numpy array.
+
+        Returns:
+        - detections: The float32 (N, 6) array of detections in frame coordinates.
+        """
+
+        with torch.inference_mode():
+            # The frame itself is not copied, it is only read to build the model input
+            pred, _, processed_image, _ = process_image(
+                img,
+                self.model,
+                self.non_max_suppression,
+                self.img_size,
+                buffer=self.input_buffer,
+                copy=False,
+            )
+            detections = select_detections(
+                pred, processed_image, img.shape, self.scale_coords
+            )
+        METRICS.count("detections")
+        METRICS.count("faces", len(detections))
+        # The boxes are rescaled to the frame, so the crops are taken from it directly
+        for box in detections[:, :4]:
+            x1, y1, x2, y2 = box
+            add_face(self.faces, img[int(y1) : int(y2), int(x1) : int(x2)], box)
+        return detections
 
     def transform(self, frame):
         """
@@ -118,31 +234,302 @@ class VideoTransformer(VideoTransformerBase):
         - img: The image with the bounding boxes drawn and the strategies applied.
         """
 
+        start = time.perf_counter()
         img = frame.to_ndarray(format="bgr24")
 
-        # Process the image using the process_frame function
-        boxes, img = process_frame(
+        if self.detect_interval > 1:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            # Run the detector every detect_interval frames, or as soon as a face is lost
+            if self._due_for_detection():
+                detections = self.detect(img)
+                self.tracker.reset(gray, detections)
+            else:
+                # Move the boxes of the last detection to this frame
+                with METRICS.stage("track"):
+                    detections = self.tracker.update(gray)
+        else:
+            # Detect the faces on every frame
+            detections = self.detect(img)
+
+        METRICS.count("frames")
+        # Draw the boxes and apply the strategies in a single pass, reusing the buffers
+        # of the compositor from one frame to the next
+        img = render_detections(
             img,
-            self.model,
+            detections,
             self.names,
-            self.faces,
-            self.non_max_suppression,
-            self.scale_coords,
             self.plot_one_box,
             self.strategies,
             self.background,
+            compositor=self.compositor,
         )
-        # for strategy in self.strategies:
-        #     if strategy == "blur_faces":
-        #         img = blur_faces(img, boxes)
-        #         cv2.imwrite("output.jpg", img)
-        #     if strategy == "whiten_background":
-        #         img = whiten_background(img, boxes)
-
-        # Return the list of bounding boxes and the processed image
+        self._observe(time.perf_counter() - start)
         return img
 
 
+class AsyncVideoTransformer(VideoTransformer):
+    """
+    A VideoTransformer that runs the detection on a background thread and never blocks the
+    WebRTC callback thread.
+
+    Each incoming frame replaces the frame waiting for the detector, so the detector always
+    works on the newest frame and stale frames are dropped instead of queuing up. Every
+    outgoing frame is rendered right away with the latest known boxes, so the latency of a
+    frame is bounded by the rendering time, however slow the model is. With a detect_interval
+    above 1, only every detect_interval-th frame is handed over, and the latest boxes are
+    moved onto each frame by the tracker. The adaptive
+    controller, if any, holds the target frame rate of the detections rather than of the
+    video, which never waits for them. A detection that fails is counted as a
+    detection_errors metric and logged, and the worker moves on to the next frame.
+
+    Attributes
+    ----------
+    frames_dropped : int
+        The number of frames replaced before the detector could take them.
+    frames_detected : int
+        The number of frames the detector has processed.
+
+    Methods
+    -------
+    transform(frame)
+        Hands the frame over to the detector and renders it with the latest known boxes.
+    on_ended()
+        Stops the detection thread.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frames_dropped = 0
+        self.frames_detected = 0
+        # The newest frame waiting for the detector, and the latest (N, 6) detections
+        self._pending = None
+        self._detections = np.zeros((0, 6), dtype=np.float32)
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def _run(self):
+        """
+        Detection loop: waits for the newest frame, detects the faces and publishes the boxes.
+        """
+
+        while True:
+            with self._condition:
+                while self._pending is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                frame, self._pending = self._pending, None
+
+            try:
+                self._detect_pending(frame)
+            except Exception:
+                # A failed detection only costs its frame, the worker must outlive it
+                METRICS.count("detection_errors")
+                logger.exception("Detection failed on the background thread")
+
+    def _detect_pending(self, frame):
+        """
+        Detects the faces of a frame taken by the worker and publishes its boxes.
+        """
+
+        start = time.perf_counter()
+        detections = self.detect(frame)
+        gray = (
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if self.detect_interval > 1
+            else None
+        )
+
+        with self._condition:
+            self._detections = detections
+            if gray is not None:
+                # Track from the detected frame up to the frames rendered meanwhile
+                self.tracker.reset(gray, detections)
+            self.frames_detected += 1
+            self._observe(time.perf_counter() - start)
+
+    def transform(self, frame):
+        """
+        Hands the frame over to the detector and renders it with the latest known boxes.
+
+        Parameters:
+        - frame: The original frame.
+
+        Returns:
+        - img: The frame with the latest bounding boxes drawn and the strategies applied.
+        """
+
+        img = frame.to_ndarray(format="bgr24")
+
+        with self._condition:
+            # Hand over every detect_interval frames, or as soon as a face is lost; the
+            # boxes are tracked on the frames in between
+            if self._due_for_detection():
+                # Replace the frame the detector has not taken yet, if any
+                if self._pending is not None:
+                    self.frames_dropped += 1
+                    METRICS.count("frames_dropped")
+                self._pending = img
+                self._condition.notify()
+            if self.detect_interval > 1:
+                # Move the latest boxes to this frame
+                detections = self.tracker.update(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+            else:
+                detections = self._detections
+
+        METRICS.count("frames")
+        # Render on a copy, the detector may still be reading the frame
+        return render_detections(
+            img.copy(),
+            detections,
+            self.names,
+            self.plot_one_box,
+            self.strategies,
+            self.background,
+            compositor=self.compositor,
+        )
+
+    def on_ended(self):
+        """
+        Stops the detection thread once the stream has ended.
+        """
+
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+
+class ScheduledVideoTransformer(VideoTransformer):
+    """
+    A VideoTransformer that hands its frames to the shared InferenceScheduler of the process
+    instead of running the model itself.
+
+    Like AsyncVideoTransformer, every outgoing frame is rendered right away with the latest
+    known boxes and only the newest frame waits for the detector. The forward passes, though,
+    are batched with the frames of the other streams on the scheduler's replicas, so many
+    concurrent streams share a fixed number of cores fairly. With a detect_interval above 1,
+    only every detect_interval-th frame is submitted, and the boxes are tracked on the
+    others. The adaptive controller, if any, holds the target rate of the stream's
+    detections, measured from the submission of a frame to its result, so the time it waits
+    behind the other streams counts too.
+
+    Attributes
+    ----------
+    session : SchedulerSession
+        The stream's session with the scheduler.
+    frames_detected : int
+        The number of frames the scheduler has detected.
+
+    Methods
+    -------
+    transform(frame)
+        Submits the frame to the scheduler and renders it with the latest known boxes.
+    on_ended()
+        Unregisters the stream from the scheduler.
+    """
+
+    def __init__(self, *args, scheduler, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frames_detected = 0
+        self._detections = np.zeros((0, 6), dtype=np.float32)
+        self._lock = threading.Lock()
+        # The (frame, submission time) of the frames not detected yet, the oldest first. The
+        # scheduler holds at most a frame in flight and a pending one per session, so older
+        # frames were dropped, or failed, and never come back
+        self._submitted = deque(maxlen=2)
+        self.session = scheduler.register(self._on_detections, self.img_size)
+
+    def _apply_quality(self):
+        super()._apply_quality()
+        # The session does not exist yet while the first level is applied
+        if getattr(self, "session", None) is not None:
+            self.session.img_size = self.img_size
+
+    @property
+    def frames_dropped(self):
+        return self.session.frames_dropped
+
+    def _on_detections(self, frame, detections):
+        """
+        Called on a scheduler thread with the detections of a submitted frame.
+        """
+
+        METRICS.count("detections")
+        METRICS.count("faces", len(detections))
+        for box in detections[:, :4]:
+            x1, y1, x2, y2 = box
+            add_face(self.faces, frame[int(y1) : int(y2), int(x1) : int(x2)], box)
+        gray = (
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if self.detect_interval > 1
+            else None
+        )
+
+        now = time.perf_counter()
+        with self._lock:
+            self._detections = detections
+            if gray is not None:
+                # Track from the detected frame up to the frames rendered meanwhile
+                self.tracker.reset(gray, detections)
+            self.frames_detected += 1
+            # Forget the frames replaced before they were detected, then time this one
+            while any(submitted is frame for submitted, _ in self._submitted):
+                submitted, submitted_at = self._submitted.popleft()
+                if submitted is frame:
+                    self._observe(now - submitted_at)
+                    break
+
+    def transform(self, frame):
+        """
+        Submits the frame to the scheduler and renders it with the latest known boxes.
+
+        Parameters:
+        - frame: The original frame.
+
+        Returns:
+        - img: The frame with the latest bounding boxes drawn and the strategies applied.
+        """
+
+        img = frame.to_ndarray(format="bgr24")
+
+        with self._lock:
+            # Submit every detect_interval frames, or as soon as a face is lost; the boxes
+            # are tracked on the frames in between
+            submit = self._due_for_detection()
+        if submit:
+            with self._lock:
+                self._submitted.append((img, time.perf_counter()))
+            self.session.submit(img)
+
+        with self._lock:
+            if self.detect_interval > 1:
+                # Move the latest boxes to this frame
+                detections = self.tracker.update(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+            else:
+                detections = self._detections
+
+        METRICS.count("frames")
+        # Render on a copy, the scheduler may still be reading the frame
+        return render_detections(
+            img.copy(),
+            detections,
+            self.names,
+            self.plot_one_box,
+            self.strategies,
+            self.background,
+            compositor=self.compositor,
+        )
+
+    def on_ended(self):
+        """
+        Unregisters the stream from the scheduler once it has ended.
+        """
+
+        self.session.close()
+
+
 def create_videotransformer(
     model,
     names,
@@ -152,6 +539,11 @@ def create_videotransformer(
     plot_one_box,
     strategies,
     background="#56ecd5",
+    img_size=None,
+    async_processing=False,
+    detect_interval=1,
+    scheduler=None,
+    target_fps=None,
 ):
     """
     Creates a function that returns a VideoTransformer instance.
@@ -165,6 +557,13 @@ def create_videotransformer(
     - plot_one_box: The function to draw a bounding box on the image.
     - strategies: A list of strategies to apply to the image.
     - background: The desired background color in hexadecimal format.
+    - img_size: The letterboxed inference size, or None to run on the whole frame.
+    - async_processing: Whether to run the detection on a background thread that drops stale frames.
+    - detect_interval: Run the detector every detect_interval frames and track the boxes in between.
+    - scheduler: The shared InferenceScheduler to submit the frames to, or None to run the model
+      in each transformer.
+    - target_fps: The frame rate each transformer holds by adapting its inference size, detect
+      interval and blur quality, starting from img_size. None keeps them fixed.
 
     Returns:
     - _create_videotransformer: A function that returns a VideoTransformer instance when called.
@@ -178,8 +577,7 @@ def create_videotransformer(
         - A VideoTransformer instance.
         """
 
-        # Create a VideoTransformer instance with the provided parameters
-        return VideoTransformer(
+        args = (
             model,
             names,
             images,
@@ -188,7 +586,26 @@ def create_videotransformer(
             plot_one_box,
             strategies,
             background,
+            img_size,
+            detect_interval,
+        )
+        # Every stream adapts to its own load, from the chosen inference size down
+        adaptive = (
+            AdaptiveController(target_fps, quality_levels(img_size))
+            if target_fps
+            else None
+        )
+        if scheduler is not None:
+            # Batch the detections with the other streams of the process
+            return ScheduledVideoTransformer(
+                *args, adaptive=adaptive, scheduler=scheduler
+            )
+
+        # Create a VideoTransformer instance with the provided parameters
+        transformer_class = (
+            AsyncVideoTransformer if async_processing else VideoTransformer
         )
+        return transformer_class(*args, adaptive=adaptive)
 
     # Return the function that creates a VideoTransformer instance
     return _create_videotransformer